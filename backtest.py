@@ -0,0 +1,221 @@
+import argparse
+import csv
+import os
+import sys
+from typing import List, Literal, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pydantic import BaseModel
+
+from calculations import tax_schedule
+from engine import CompInput, process_scenario
+
+# Historical sequence backtest.
+# Every item of a scenario is re-solved under every rolling window of an annual return history
+# (income return, growth return, CPI). The engine's cash flows are linear in the return path, so a whole
+# item is one array expression over a (windows x years) matrix: no per-window projection calls.
+
+# Default history: CSV with columns year, income_return, growth_return, cpi (all in %), one row per year.
+# No market history ships with the repo; data/returns_history.sample.csv shows the format with synthetic
+# figures (illustrative only — point RETURNS_HISTORY_FILE at real index data, or post `history` rows inline).
+RETURNS_HISTORY_FILE = os.getenv("RETURNS_HISTORY_FILE", "data/returns_history.csv")
+RETURNS_HISTORY_SAMPLE = "data/returns_history.sample.csv"
+
+# Quantile reported as "capital for a 90% success rate"
+SUCCESS_QUANTILE = 0.9
+
+
+class HistoryRow(BaseModel):
+    year: int
+    income_return: float  # %
+    growth_return: float  # %
+    cpi: float            # %
+
+
+class BacktestRequest(BaseModel):
+    scenario: CompInput
+    history: Optional[List[HistoryRow]] = None  # inline series; default RETURNS_HISTORY_FILE
+    anchor: Literal["item", "history"] = "item"
+    wrap: Optional[bool] = None                 # circular windows (default: only when history is too short)
+
+
+def history_arrays(rows):
+    """Rows (dicts or HistoryRow) sorted by year -> dict of numpy arrays, returns/CPI as decimals."""
+    rows = sorted((r if isinstance(r, dict) else r.model_dump() for r in rows), key=lambda r: int(r["year"]))
+    if not rows:
+        raise ValueError("Return history is empty")
+    return {
+        "year": np.array([int(r["year"]) for r in rows]),
+        "income_return": np.array([float(r["income_return"]) for r in rows]) / 100,
+        "growth_return": np.array([float(r["growth_return"]) for r in rows]) / 100,
+        "cpi": np.array([float(r["cpi"]) for r in rows]) / 100,
+    }
+
+
+_history_cache = {}  # path -> (mtime, arrays)
+
+def load_history(path: str = None):
+    """Read (and cache until the file changes) a year,income_return,growth_return,cpi CSV."""
+    path = path or RETURNS_HISTORY_FILE
+    if not os.path.exists(path):
+        raise ValueError(f"Return history file not found: {path} (columns year,income_return,growth_return,cpi "
+                         f"in %; see {RETURNS_HISTORY_SAMPLE}, or send `history` rows with the request)")
+    mtime = os.path.getmtime(path)
+    cached = _history_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = [{k.strip().lower(): v for k, v in row.items()} for row in reader]
+    history = history_arrays(rows)
+    _history_cache[path] = (mtime, history)
+    return history
+
+
+def windows(series, horizon, wrap):
+    """(windows x horizon) strided view of a yearly series; wrap=True continues from the start."""
+    if wrap:
+        series = np.take(series, np.arange(len(series) + horizon - 1), mode="wrap")
+    return sliding_window_view(series, horizon)
+
+
+def item_capital_paths(flows, income_w, growth_w, cpi_index_w):
+    """
+    Capital each window needs for one item.
+    income_w / growth_w: (W x H) return paths from today; cpi_index_w: (W x H) cumulative CPI from today.
+    Returns (capital at fund age, capital today), each of shape (W,).
+    """
+    k = max(flows["offset"], 0)
+    funding = np.asarray(flows["funding_drawdowns"], dtype=float)
+    n = len(funding)
+    if n == 0:
+        zeros = np.zeros(income_w.shape[0])
+        return zeros, zeros
+
+    tax = np.asarray(tax_schedule(flows["tax_rate"], n), dtype=float)
+    fee = flows["fee_rate"] if flows["subtract_fees"] else 0.0
+    multipliers = 1 + growth_w[:, k:k + n] + income_w[:, k:k + n] * (1 - tax) - fee
+    weights = 1 / np.cumprod(multipliers, axis=1)
+
+    if flows["inflates"]:
+        # Engine drawdowns are in assumed-inflation dollars; swap that index for the window's CPI. Amounts priced
+        # today were inflated from today, start-priced ones (holding costs, stated trade-ins / resale) only from
+        # the item's start, so each is deflated over its own span and re-inflated by the window's CPI over it.
+        years = np.arange(n)
+        start = min(flows.get("defer_years", 0), n - 1)
+        inflation = 1 + flows["inflation"]
+        start_priced = np.asarray(flows.get("start_priced", np.zeros(n)), dtype=float)
+        today_priced = np.asarray(flows["drawdowns"], dtype=float) - start_priced
+        cpi = cpi_index_w[:, k:k + n]
+        drawdowns = (today_priced / inflation ** (k + years)) * cpi \
+            + (start_priced / inflation ** (years - start)) * (cpi / cpi[:, start:start + 1])
+        # Solve on costs only, as the engine does (a no-op for streams without inflows)
+        drawdowns = np.maximum(drawdowns, 0)
+    else:
+        drawdowns = funding
+
+    capital_at_fund_age = (drawdowns * weights).sum(axis=1)
+    # Discount to today the way the engine does (growth component only) — along the window's path
+    discount = np.prod(1 + growth_w[:, :k], axis=1) if k else 1.0
+    return capital_at_fund_age, capital_at_fund_age / discount
+
+
+def _stats(capital, planned, start_years):
+    worst = int(np.argmax(capital))
+    return {
+        "planned_capital": planned,
+        "worst": float(capital[worst]),
+        "worst_start_year": int(start_years[worst]),
+        "median": float(np.median(capital)),
+        "p90": float(np.quantile(capital, SUCCESS_QUANTILE)),
+        "best": float(capital.min()),
+        "success_rate": float(np.mean(capital <= planned * (1 + 1e-9))),
+    }
+
+
+def backtest_scenario(data: CompInput, history: dict, anchor: str = "item", wrap: bool = None):
+    """
+    Re-solve every item of the scenario under every rolling window of the return history.
+    anchor="item": keep each item's assumed mean returns/inflation and apply the history's year-by-year
+    deviations (sequence risk for that portfolio); anchor="history": use the raw historical figures.
+    Success rate = share of windows in which the planned (deterministic) capital would have been enough.
+    """
+    results, planned_total = process_scenario(data, totals_only=True, with_flows=True)
+    years = history["year"]
+    n_years = len(years)
+    horizon = max((max(r["flows"]["offset"], 0) + len(r["flows"]["funding_drawdowns"]) for r in results), default=1)
+    if wrap is None:
+        wrap = horizon > n_years
+    if not wrap and horizon > n_years:
+        raise ValueError(f"History covers {n_years} years but the plan needs {horizon}; allow wrap")
+
+    deviation = {key: history[key] - history[key].mean() for key in ("income_return", "growth_return", "cpi")}
+    start_years = years if wrap else years[:n_years - horizon + 1]
+
+    def path(key, assumed):
+        series = assumed + deviation[key] if anchor == "item" else history[key]
+        return windows(series, horizon, wrap)
+
+    totals = np.zeros(len(start_years))
+    items = []
+    cpi_cache = {}
+    for r in results:
+        flows = r["flows"]
+        income_w = path("income_return", flows["income_return"])
+        growth_w = path("growth_return", flows["growth_return"])
+        inflation = flows["inflation"] if flows["inflates"] else 0.0
+        if inflation not in cpi_cache:
+            cpi_w = path("cpi", inflation)
+            cpi_cache[inflation] = np.hstack([np.ones((len(cpi_w), 1)), np.cumprod(1 + cpi_w[:, :-1], axis=1)])
+        _, capital = item_capital_paths(flows, income_w, growth_w, cpi_cache[inflation])
+        totals += capital
+        items.append({"title": r["title"], **_stats(capital, r["capital_required"], start_years)})
+
+    report = {
+        "history": {
+            "first_year": int(years[0]), "last_year": int(years[-1]), "years": n_years,
+            "windows": len(start_years), "horizon": horizon, "wrapped": wrap, "anchor": anchor,
+        },
+        "items": items,
+        "total": _stats(totals, planned_total, start_years),
+        "window_totals": [{"start_year": int(y), "capital": float(c)} for y, c in zip(start_years, totals)],
+    }
+    report["summary"] = describe_backtest(report)
+    return report
+
+
+def describe_backtest(report) -> str:
+    """One-paragraph, number-backed text for ResilienceReport.market_shock_response / longevity_check."""
+    h, t = report["history"], report["total"]
+    extra = t["worst"] - t["planned_capital"]
+    return (
+        f"Across {h['windows']} historical {h['horizon']}-year sequences ({h['first_year']}-{h['last_year']}), "
+        f"the planned capital of ${t['planned_capital']:,.0f} would have been sufficient in {t['success_rate']:.0%} of them. "
+        f"The median sequence needed ${t['median']:,.0f}; a 90% success rate needs ${t['p90']:,.0f}. "
+        f"The worst sequence (starting {t['worst_start_year']}) needed ${t['worst']:,.0f}"
+        + (f", ${extra:,.0f} more than planned." if extra > 0 else ".")
+    )
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest a CompInput scenario against a return history.")
+    parser.add_argument("scenario", help="Path to a CompInput JSON file ('-' for stdin)")
+    parser.add_argument("history", nargs="?", default=None, help=f"History CSV (default {RETURNS_HISTORY_FILE})")
+    parser.add_argument("--anchor", choices=["item", "history"], default="item")
+    parser.add_argument("--wrap", action="store_true", help="Use circular windows")
+    args = parser.parse_args(argv)
+
+    raw = sys.stdin.read() if args.scenario == "-" else open(args.scenario, encoding="utf-8").read()
+    report = backtest_scenario(CompInput.model_validate_json(raw), load_history(args.history),
+                               anchor=args.anchor, wrap=args.wrap or None)
+    for item in report["items"]:
+        print(f"{item['title']:<40} planned ${item['planned_capital']:>12,.0f}  median ${item['median']:>12,.0f}  "
+              f"worst ${item['worst']:>12,.0f}  success {item['success_rate']:>4.0%}")
+    print(report["summary"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,9 @@
-import pandas as pd
-import numpy as np
+from functools import lru_cache
 
-def calculate_projection(
+# pandas is only needed by calculate_projection's DataFrame wrapper, so it is imported lazily there.
+# The portfolio functions below work on plain record lists and never pay its import cost.
+
+def project_records(
     start_capital,
     years,
     income_return,
@@ -27,7 +29,7 @@ def calculate_projection(
     - subtract_fees: Boolean, if True fees are deducted from balance.
     
     Returns:
-    - DataFrame containing the projection year by year.
+    - List of dicts (one per year) with the projection columns.
     """
     records = []
     balance = start_capital
@@ -80,117 +82,121 @@ def calculate_projection(
         # Update balance for next year
         balance = closing_balance
         
-    return pd.DataFrame(records)
+    return records
 
-def solve_required_capital(
+def calculate_projection(
+    start_capital,
     years,
     income_return,
     growth_return,
     tax_rate,
     fee_rate,
     drawdown_schedule,
-    subtract_fees=True
+    subtract_fees=True,
+    p1_age=None,
+    p2_age=None
 ):
     """
-    Calculates the starting capital required to survive the given drawdown schedule.
+    Core function to project portfolio balance over time.
+    Same parameters as project_records; returns a DataFrame containing the projection year by year.
     """
-    low = 0.0
-    # Upper bound guess: Sum of drawdowns * 2 (safe buffer)
-    # If drawdowns are 0 (e.g., funded by growth?), default to something small
-    total_drawdown = sum(drawdown_schedule)
-    high = total_drawdown * 20 if total_drawdown > 0 else 1000000.0
-    
-    required_capital = high
-    
-    # Binary search
-    for _ in range(100):
-        mid = (low + high) / 2
-        
-        # Run projection logic inline for speed or call function
-        # Calling function is cleaner
-        df = calculate_projection(mid, years, income_return, growth_return, tax_rate, fee_rate, drawdown_schedule, subtract_fees)
-        final_balance = df.iloc[-1]["Closing Balance"]
-        
-        if final_balance >= -0.01: # allow slightly negative due to float precision, essentially 0
-            required_capital = mid
-            high = mid
-        else:
-            low = mid
-            
-    return required_capital
+    import pandas as pd
+    return pd.DataFrame(project_records(start_capital, years, income_return, growth_return, tax_rate, fee_rate,
+                                        drawdown_schedule, subtract_fees, p1_age, p2_age))
 
-def calculate_income_portfolio(
-    start_year: int,
-    duration_years: int,
-    initial_drawdown: float,
-    inflation: float,
-    income_return: float,
-    growth_return: float,
-    tax_rate: float,
-    fee_rate: float,
-    p1_age: int,
-    p2_age: int,
-    defer_years: int = 0,
-    start_capital: float = None
+# --- Annuity Factor Tables ---
+# The projection is linear in start capital: closing_i = opening_i * m_i - drawdown_i, where
+#   m_i = 1 + growth + income * (1 - tax_i) - (fee if fees are subtracted).
+# Ending at exactly $0 therefore needs capital = sum_i drawdown_i * w_i, with w_i = 1 / (m_0 * ... * m_i).
+# w depends only on the return profile (not on the drawdowns), so one table serves every item,
+# request and client sharing that profile — capital is then a single dot product.
+
+def _tax_key(tax_rate):
+    """Hashable form of a scalar rate or per-year tax schedule."""
+    if isinstance(tax_rate, (list, tuple)):
+        return tuple(tax_rate)
+    return tax_rate
+
+def tax_schedule(tax_rate, horizon):
+    """Per-year tax rates, same rule as project_records: a scalar applies every year, a schedule shorter
+    than the horizon means 0% after its end."""
+    if isinstance(tax_rate, (list, tuple)):
+        return [tax_rate[i] if i < len(tax_rate) else 0 for i in range(horizon)]
+    return [tax_rate] * horizon
+
+def growth_multipliers(income_return, growth_return, tax_rate, fee_rate, subtract_fees, horizon):
+    """Per-year balance multipliers m_i (see above)."""
+    fee = fee_rate if subtract_fees else 0.0
+    return [1 + growth_return + income_return * (1 - t) - fee for t in tax_schedule(tax_rate, horizon)]
+
+def flow_multipliers(flows, horizon=None):
+    """growth_multipliers of a portfolio_flows dict, by default over its funding stream."""
+    if horizon is None:
+        horizon = len(flows["funding_drawdowns"])
+    return growth_multipliers(flows["income_return"], flows["growth_return"], flows["tax_rate"], flows["fee_rate"],
+                              flows["subtract_fees"], horizon)
+
+@lru_cache(maxsize=4096)
+def _annuity_factor_table(income_return, growth_return, tax_key, fee_rate, subtract_fees, horizon):
+    factors = []
+    cumulative = 1.0
+    for m in growth_multipliers(income_return, growth_return, tax_key, fee_rate, subtract_fees, horizon):
+        cumulative *= m
+        factors.append(1 / cumulative)
+    return tuple(factors)
+
+def annuity_factors(income_return, growth_return, tax_rate, fee_rate, subtract_fees, horizon):
+    """
+    Per-year present-value weights for a return profile (cached by profile and horizon).
+    Capital needed for a drawdown stream = sum(drawdown[i] * factors[i]).
+    """
+    return _annuity_factor_table(income_return, growth_return, _tax_key(tax_rate), fee_rate, bool(subtract_fees), horizon)
+
+def capital_for_drawdowns(drawdown_schedule, factors):
+    """Dot product of a drawdown stream with an annuity factor table."""
+    return sum(d * w for d, w in zip(drawdown_schedule, factors))
+
+def solve_required_capital(
+    years,
+    income_return,
+    growth_return,
+    tax_rate,
+    fee_rate,
+    drawdown_schedule,
+    subtract_fees=True
 ):
     """
-    Calculates the Income Portfolio (fees subtracted, inflating drawdown).
-    Supports 'Deferral Phase' where capital grows but no drawdown occurs.
+    Calculates the starting capital required to survive the given drawdown schedule,
+    i.e. the capital whose projection closes at $0 in the final year.
+    Drawdowns are taken as given — callers that must ignore inflows (e.g. trade-in proceeds in
+    calculate_asset_portfolio) pass the positive part of their schedule.
     """
-    total_years = defer_years + duration_years
-    years = [start_year + i for i in range(total_years)]
-    
-    # 1. Build Drawdown List
-    drawdowns = []
-    
+    factors = annuity_factors(income_return, growth_return, tax_rate, fee_rate, subtract_fees, len(years))
+    return capital_for_drawdowns(drawdown_schedule, factors)
+
+# --- Cash-Flow Schedules ---
+# The drawdown streams behind each portfolio type, shared by the calculate_* functions below and by
+# batch engines (backtests, stress grids, ledgers) that re-run the same flows under other return paths.
+
+def income_drawdowns(duration_years, initial_drawdown, inflation, defer_years=0, inflation_factors=None):
+    """Zero drawdown while deferred, then the income inflating from the first year of drawdown."""
     # Phase A: Deferral (Zero Drawdown)
-    for i in range(defer_years):
-        drawdowns.append(0.0)
+    drawdowns = [0.0] * defer_years
         
     # Phase B: Active Drawdown (Inflated)
     # Inflation starts from the FIRST YEAR OF DRAWDOWN (Face Value Calculation).
     # If user asks for $60k in Stage 3, they mean $60k in the first year of Stage 3.
     for i in range(duration_years):
-        inflated_amount = initial_drawdown * ((1 + inflation) ** i)
-        drawdowns.append(inflated_amount)
-    
-    if start_capital is None:
-        start_capital = solve_required_capital(years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=True)
-        
-    df = calculate_projection(start_capital, years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=True, p1_age=p1_age, p2_age=p2_age)
-    
-    # Format or ensure columns exist for the detailed table (they are already created in calculate_projection)
-    
-    # Format or ensure columns exist for the detailed table (they are already created in calculate_projection)
-    # columns: Year, Opening Balance, Income Return, Tax, Income Net, Growth, Fees, Drawdown, Closing Balance
-    
-    return start_capital, df.to_dict(orient="records")
-
+        factor = inflation_factors[i] if inflation_factors is not None else (1 + inflation) ** i
+        drawdowns.append(initial_drawdown * factor)
+    return drawdowns
 
-def calculate_asset_portfolio(
-    start_year: int,
-    duration_years: int,
-    purchase_value: float,
-    replacement_cycle: int, # Years between replacements
-    annual_holding_cost: float,
-    trade_in_value: float, # Value of old asset when sold
-    inflation: float, # Inflation for purchase price and holding cost
-    income_return: float,
-    growth_return: float,
-    tax_rate: float,
-    fee_rate: float,
-    p1_age: int,
-    p2_age: int,
-    defer_years: int = 0,
-    sell_at_end: bool = False,
-    start_capital: float = None
-):
+def asset_cash_flows(duration_years, purchase_value, replacement_cycle, annual_holding_cost, trade_in_value,
+                     inflation, defer_years=0, sell_at_end=False, inflation_factors=None):
     """
-    Calculates Asset Portfolio (Car, Boat, etc) with replacement cycles.
-    Fees NOT subtracted from balance.
-    returns: start_capital, list of dicts with detailed columns.
+    Net yearly cash flow of owning an asset (purchase + holding - trade-in/sale proceeds).
+    returns: drawdowns, purchase_costs, trade_in_values, holding_costs (one entry per year).
     """
-    years = [start_year + i for i in range(duration_years + defer_years)]
     drawdowns = []
     
     # Detailed tracking lists
@@ -208,9 +214,10 @@ def calculate_asset_portfolio(
     # 2. Active Phase
     for i in range(duration_years):
         # Current costs adjusted for inflation
-        inflated_holding = annual_holding_cost * ((1 + inflation) ** i)
-        inflated_purchase = purchase_value * ((1 + inflation) ** i)
-        inflated_trade_in = trade_in_value * ((1 + inflation) ** i)
+        factor = inflation_factors[i] if inflation_factors is not None else (1 + inflation) ** i
+        inflated_holding = annual_holding_cost * factor
+        inflated_purchase = purchase_value * factor
+        inflated_trade_in = trade_in_value * factor
         
         current_purchase = 0.0
         current_trade_in = 0.0
@@ -249,31 +256,168 @@ def calculate_asset_portfolio(
         purchase_costs.append(current_purchase)
         trade_in_values.append(current_trade_in)
         holding_costs.append(current_holding)
+    return drawdowns, purchase_costs, trade_in_values, holding_costs
+
+def cost_only(drawdowns):
+    """Positive part of a cash-flow stream.
+    For required capital we ignore the INFLOWS from trade-ins/sales because we cannot use
+    future sale proceeds to fund current holding costs."""
+    return [d if d > 0 else 0 for d in drawdowns]
+
+def holiday_drawdowns(duration_years, daily_cost_total, days_per_trip, trip_frequency_years, inflation,
+                      defer_years=0, inflation_factors=None):
+    """(DailyCost * Days) every trip_frequency_years years, inflated; zero while deferred."""
+    # Deferral
+    drawdowns = [0.0] * defer_years
+
+    base_cost_per_trip = daily_cost_total * days_per_trip
+    
+    for i in range(duration_years):
+        # Inflate the cost
+        factor = inflation_factors[i] if inflation_factors is not None else (1 + inflation) ** i
+        current_year_cost = base_cost_per_trip * factor
         
+        # Trip Logic
+        if trip_frequency_years > 0 and i % trip_frequency_years == 0:
+            drawdowns.append(current_year_cost)
+        else:
+            drawdowns.append(0)
+    return drawdowns
+
+def portfolio_flows(kind, params):
+    """
+    Cash flows and return profile of one calculate_<kind>_portfolio call (kind: income / asset / holiday),
+    given the same keyword arguments. The projection is fully determined by these:
+    closing = opening * (1 + growth + income * (1 - tax) - fee if subtract_fees) - drawdown.
+    funding_drawdowns is the stream the required capital is solved against (cost-only for assets);
+    asset flows also carry their signed purchase / trade_in / holding components.
+    """
+    p = params
+    defer = p.get("defer_years", 0)
+    factors = p.get("inflation_factors")
+    if kind == "income":
+        drawdowns = income_drawdowns(p["duration_years"], p["initial_drawdown"], p["inflation"], defer, factors)
+        funding, subtract_fees = drawdowns, True
+    elif kind == "asset":
+        drawdowns, purchases, trade_ins, holdings = asset_cash_flows(
+            p["duration_years"], p["purchase_value"], p["replacement_cycle"], p["annual_holding_cost"],
+            p["trade_in_value"], p["inflation"], defer, p.get("sell_at_end", False), factors)
+        funding, subtract_fees = cost_only(drawdowns), False
+        # Signed parts of each year's net flow (they sum to drawdowns)
+        components = {"purchase": purchases, "trade_in": [-t for t in trade_ins], "holding": holdings}
+    elif kind == "holiday":
+        drawdowns = holiday_drawdowns(p["duration_years"], p["daily_cost_total"], p["days_per_trip"],
+                                      p["trip_frequency_years"], p["inflation"], defer, factors)
+        funding, subtract_fees = drawdowns, False
+    else:
+        raise ValueError(f"Unknown portfolio kind: {kind}")
+    flows = {
+        "drawdowns": drawdowns,
+        "funding_drawdowns": funding,
+        "defer_years": defer,
+        "income_return": p["income_return"],
+        "growth_return": p["growth_return"],
+        "tax_rate": p["tax_rate"],
+        "fee_rate": p["fee_rate"],
+        "subtract_fees": subtract_fees,
+    }
+    if kind == "asset":
+        flows["components"] = components
+    return flows
+
+def calculate_income_portfolio(
+    start_year: int,
+    duration_years: int,
+    initial_drawdown: float,
+    inflation: float,
+    income_return: float,
+    growth_return: float,
+    tax_rate: float,
+    fee_rate: float,
+    p1_age: int,
+    p2_age: int,
+    defer_years: int = 0,
+    start_capital: float = None,
+    inflation_factors: list = None,
+    with_table: bool = True
+):
+    """
+    Calculates the Income Portfolio (fees subtracted, inflating drawdown).
+    Supports 'Deferral Phase' where capital grows but no drawdown occurs.
+    inflation_factors: optional precomputed (1 + inflation) ** i list (e.g. from a shared timeline).
+    with_table: if False, only the capital is solved and the year-by-year records are None.
+    """
+    total_years = defer_years + duration_years
+    years = [start_year + i for i in range(total_years)]
+    
+    # 1. Build Drawdown List
+    drawdowns = income_drawdowns(duration_years, initial_drawdown, inflation, defer_years, inflation_factors)
+    
     if start_capital is None:
-        # For required capital validation, we ignore the INFLOWS from trade-ins/sales
-        # because we cannot use future sale proceeds to fund current holding costs.
-        # We solve for the capital needed to cover Purchase + Holding Costs only.
+        start_capital = solve_required_capital(years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=True)
+    
+    if not with_table:
+        return start_capital, None
+        
+    records = project_records(start_capital, years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=True, p1_age=p1_age, p2_age=p2_age)
+    
+    # Columns are already created in project_records:
+    # Year, Opening Balance, Income Return, Tax, Income Net, Growth, Fees, Drawdown, Closing Balance, P1 Age, P2 Age
+    
+    return start_capital, records
+
+
+def calculate_asset_portfolio(
+    start_year: int,
+    duration_years: int,
+    purchase_value: float,
+    replacement_cycle: int, # Years between replacements
+    annual_holding_cost: float,
+    trade_in_value: float, # Value of old asset when sold
+    inflation: float, # Inflation for purchase price and holding cost
+    income_return: float,
+    growth_return: float,
+    tax_rate: float,
+    fee_rate: float,
+    p1_age: int,
+    p2_age: int,
+    defer_years: int = 0,
+    sell_at_end: bool = False,
+    start_capital: float = None,
+    inflation_factors: list = None,
+    with_table: bool = True
+):
+    """
+    Calculates Asset Portfolio (Car, Boat, etc) with replacement cycles.
+    Fees NOT subtracted from balance.
+    inflation_factors: optional precomputed (1 + inflation) ** i list (e.g. from a shared timeline).
+    with_table: if False, only the capital is solved and the year-by-year records are None.
+    returns: start_capital, list of dicts with detailed columns.
+    """
+    years = [start_year + i for i in range(duration_years + defer_years)]
+    drawdowns, purchase_costs, trade_in_values, holding_costs = asset_cash_flows(
+        duration_years, purchase_value, replacement_cycle, annual_holding_cost, trade_in_value,
+        inflation, defer_years, sell_at_end, inflation_factors
+    )
         
-        # Create a "cost only" drawdown list
-        cost_only_drawdowns = []
-        for d in drawdowns:
-            if d > 0:
-                cost_only_drawdowns.append(d)
-            else:
-                cost_only_drawdowns.append(0) # Ignore inflow for funding requirement
-                
+    if start_capital is None:
+        # We solve for the capital needed to cover Purchase + Holding Costs only (see cost_only)
+        cost_only_drawdowns = cost_only(drawdowns)
         start_capital = solve_required_capital(years, income_return, growth_return, tax_rate, fee_rate, cost_only_drawdowns, subtract_fees=False)
+    
+    if not with_table:
+        return start_capital, None
         
-    df = calculate_projection(start_capital, years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=False, p1_age=p1_age, p2_age=p2_age)
+    records = project_records(start_capital, years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=False, p1_age=p1_age, p2_age=p2_age)
     
     # Add Detailed Columns
-    # Age columns now added by calculate_projection
-    df["Purchase Cost"] = purchase_costs
-    df["Trade-In Value"] = trade_in_values
-    df["Holding Cost"] = holding_costs
+    # Age columns now added by project_records
+    for record, purchase, trade_in, holding in zip(records, purchase_costs, trade_in_values, holding_costs):
+        record["Purchase Cost"] = purchase
+        record["Trade-In Value"] = trade_in
+        record["Holding Cost"] = holding
     
-    return start_capital, df.to_dict(orient="records")
+    return start_capital, records
 
 
 
@@ -293,35 +437,27 @@ def calculate_holiday_portfolio(
     defer_years: int = 0,
     start_capital: float = None,
     p1_age: int = None,
-    p2_age: int = None
+    p2_age: int = None,
+    inflation_factors: list = None,
+    with_table: bool = True
 ):
     """
     Calculates Holiday Portfolio.
     Fees NOT subtracted.
     Drawdown = (DailyCost * Days) every X years, inflated.
+    inflation_factors: optional precomputed (1 + inflation) ** i list (e.g. from a shared timeline).
+    with_table: if False, only the capital is solved and the year-by-year records are None.
     """
     years = [start_year + i for i in range(duration_years + defer_years)]
-    drawdowns = []
-    
-    # Deferral
-    for i in range(defer_years):
-        drawdowns.append(0.0)
-
-    base_cost_per_trip = daily_cost_total * days_per_trip
-    
-    for i in range(duration_years):
-        # Inflate the cost
-        current_year_cost = base_cost_per_trip * ((1 + inflation) ** i)
-        
-        # Trip Logic
-        if trip_frequency_years > 0 and i % trip_frequency_years == 0:
-            drawdowns.append(current_year_cost)
-        else:
-            drawdowns.append(0)
+    drawdowns = holiday_drawdowns(duration_years, daily_cost_total, days_per_trip, trip_frequency_years,
+                                  inflation, defer_years, inflation_factors)
 
     if start_capital is None:
         start_capital = solve_required_capital(years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=False)
+    
+    if not with_table:
+        return start_capital, None
         
-    df = calculate_projection(start_capital, years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=False, p1_age=p1_age, p2_age=p2_age)
-    return start_capital, df.to_dict(orient="records")
+    records = project_records(start_capital, years, income_return, growth_return, tax_rate, fee_rate, drawdowns, subtract_fees=False, p1_age=p1_age, p2_age=p2_age)
+    return start_capital, records
 
@@ -1,4 +1,4 @@
-from main import process_scenario, CompInput, CompProfile, CompAssumptions, CompItem
+from engine import process_scenario, CompInput, CompProfile, CompAssumptions, CompItem
 
 data = {
     "profile": {
@@ -0,0 +1,680 @@
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from calculations import calculate_income_portfolio, calculate_asset_portfolio, calculate_holiday_portfolio, portfolio_flows
+
+# Scenario engine for the Comprehensive Planner.
+# Deliberately free of FastAPI / LangChain / dotenv so batch jobs, tests and worker processes
+# can `from engine import process_scenario, CompInput` and start in milliseconds.
+
+# "Today" for ages, fund timelines and calendar labels (shared by the batch engines built on this one)
+CURRENT_YEAR = 2026
+
+# --- Comprehensive Planner Models ---
+
+class CompProfile(BaseModel):
+    p1_name: str
+    p1_dob: str
+    p2_name: str
+    p2_dob: str
+    children: List[dict] = []  # [{"name": "Emily", "dob": "2010-05-15"}, ...]
+
+class CompAssumptions(BaseModel):
+    income_return: float
+    growth_return: float
+    tax_rate: float
+    inflation: float
+    fee_load: float
+    tax_free_age: Optional[int] = None  # Age after which tax drops to 0%
+
+class CompItem(BaseModel):
+    name: str
+    income: Optional[float] = 0
+    start: Optional[int] = 0
+    end: Optional[int] = 0
+    cost: Optional[float] = 0
+    cycle: Optional[int] = 0
+    holding: Optional[float] = 0
+    resale: Optional[float] = 0
+    tradein: Optional[float] = 0  # Trade-in value for cars/assets
+    type: Optional[str] = None
+    funding_start: Optional[int] = None # Age to start funding (if different from start age)
+    apply_inflation: Optional[bool] = True
+    portfolio: Optional[str] = None  # "conservative"/"balanced"/"growth"/None=auto
+    # Per-item overrides (None = use global assumption)
+    income_return: Optional[float] = None
+    growth_return: Optional[float] = None
+    tax_rate: Optional[float] = None
+    fee_load: Optional[float] = None
+
+class CompInput(BaseModel):
+    profile: CompProfile
+    assumptions: CompAssumptions
+    incomes: List[CompItem]
+    cars: List[CompItem]
+    assets: List[CompItem]
+    travel: List[CompItem]
+    medical: dict
+    universal_fund_age: Optional[int] = None
+
+# --- Portfolio Presets ---
+PORTFOLIO_PRESETS = {
+    "conservative": {"income_return": 4.5, "growth_return": 0.5},
+    "balanced":     {"income_return": 3.5, "growth_return": 4.5},
+    "growth":       {"income_return": 2.5, "growth_return": 6.5},
+}
+
+def resolve_item_returns(item, global_asm: CompAssumptions, duration: int):
+    """Resolve income_return, growth_return, tax_rate, fee_load for an item.
+    Priority: item-level override > item.portfolio preset > auto-default by duration > global assumptions.
+    Auto-default: >15yr=growth, 5-15yr=balanced, <5yr=conservative
+    """
+    ir = global_asm.income_return
+    gr = global_asm.growth_return
+    tax = global_asm.tax_rate
+    fee = global_asm.fee_load
+
+    # Determine portfolio
+    portfolio = getattr(item, 'portfolio', None) if hasattr(item, 'portfolio') else None
+    if not portfolio:
+        if duration > 14:
+            portfolio = "growth"
+        elif duration >= 6:
+            portfolio = "balanced"
+        else:
+            portfolio = "conservative"
+
+    if portfolio in PORTFOLIO_PRESETS:
+        ir = PORTFOLIO_PRESETS[portfolio]["income_return"]
+        gr = PORTFOLIO_PRESETS[portfolio]["growth_return"]
+
+    # Per-item overrides take highest priority
+    item_ir = getattr(item, 'income_return', None) if hasattr(item, 'income_return') else None
+    item_gr = getattr(item, 'growth_return', None) if hasattr(item, 'growth_return') else None
+    item_tax = getattr(item, 'tax_rate', None) if hasattr(item, 'tax_rate') else None
+    item_fee = getattr(item, 'fee_load', None) if hasattr(item, 'fee_load') else None
+    
+    if item_ir is not None: ir = item_ir
+    if item_gr is not None: gr = item_gr
+    if item_tax is not None: tax = item_tax
+    if item_fee is not None: fee = item_fee
+
+    return ir, gr, tax, fee, portfolio
+
+class ScenarioTimeline:
+    """Per-scenario year/age index, built once and sliced by every item in process_scenario.
+
+    Offset k means "k years from today": Year = current_year + k, P1 Age = p1_current_age + k.
+    Holds ages, chart labels (on demand), cumulative inflation factors, the tax-free mask, and
+    (per rate) tax schedules and discount factors. Grows on demand to the longest item horizon.
+    """
+    def __init__(self, current_year, p1_current_age, p2_current_age, inflation_pct, tax_free_age=None, children_info=None):
+        self.current_year = current_year
+        self.p1_current_age = p1_current_age
+        self.p2_current_age = p2_current_age
+        self.inflation = inflation_pct / 100
+        self.tax_free_age = tax_free_age
+        self.children_info = children_info or []
+
+        self.years = []
+        self.p1_ages = []
+        self.p2_ages = []
+        self.child_ages = [[] for _ in self.children_info]
+        self.labels = []             # "2031 (60/58)", built lazily by slice_labels
+        self.inflation_factors = []  # (1 + inflation) ** k
+        self.tax_free = []           # True where P1 age >= tax_free_age
+
+        self._tax_schedules = {}     # tax_pct -> full per-year schedule (decimals)
+        self._growth_factors = {}    # growth_pct -> [(1 + g) ** k]
+
+    def __len__(self):
+        return len(self.years)
+
+    def extend(self, horizon):
+        """Make sure offsets 0..horizon-1 exist."""
+        if horizon <= len(self.years):
+            return  # hot path: called for every item, almost always already covered
+        for k in range(len(self.years), horizon):
+            year = self.current_year + k
+            p1_age = self.p1_current_age + k
+            p2_age = self.p2_current_age + k
+            self.years.append(year)
+            self.p1_ages.append(p1_age)
+            self.p2_ages.append(p2_age)
+            for ages, child in zip(self.child_ages, self.children_info):
+                ages.append(year - child["birth_year"])
+            self.inflation_factors.append((1 + self.inflation) ** k)
+            self.tax_free.append(self.tax_free_age is not None and p1_age >= self.tax_free_age)
+
+        # Cached per-rate vectors must cover the new horizon too
+        for tax_pct, schedule in self._tax_schedules.items():
+            rate = tax_pct / 100
+            schedule.extend(0.0 if free else rate for free in self.tax_free[len(schedule):])
+        for growth_pct, factors in self._growth_factors.items():
+            factors.extend((1 + growth_pct / 100) ** k for k in range(len(factors), len(self.years)))
+
+    def offset(self, age):
+        """Years from today until P1 reaches `age`."""
+        return age - self.p1_current_age
+
+    def fund_year(self, fund_age):
+        return self.current_year + self.offset(fund_age)
+
+    def inflate(self, amount, age):
+        """Inflate a today's-dollars amount to the year P1 reaches `age` (no deflation for past ages)."""
+        k = self.offset(age)
+        if k > 0:
+            self.extend(k + 1)
+            return amount * self.inflation_factors[k]
+        return amount
+
+    def tax_schedule(self, tax_pct, fund_age, total_years):
+        """Per-year tax rates (decimals) for a projection starting at fund_age.
+        If tax_free_age is set, years where P1 age >= tax_free_age get 0% tax.
+        If tax_free_age is None, returns the flat rate (scalar) — backwards compatible."""
+        rate = tax_pct / 100
+        if self.tax_free_age is None:
+            return rate
+        k = self.offset(fund_age)
+        self.extend(k + total_years)
+        schedule = self._tax_schedules.get(tax_pct)
+        if schedule is None:
+            schedule = [0.0 if free else rate for free in self.tax_free]
+            self._tax_schedules[tax_pct] = schedule
+        return schedule[k:k + total_years]
+
+    def discount(self, amount, growth_pct, fund_age):
+        """Discount an amount needed at fund_age back to today at the item's growth rate."""
+        k = self.offset(fund_age)
+        if k <= 0:
+            return amount
+        factors = self._growth_factors.get(growth_pct)
+        if factors is None:
+            factors = [(1 + growth_pct / 100) ** j for j in range(len(self.years))]
+            self._growth_factors[growth_pct] = factors
+        self.extend(k + 1)
+        return amount / factors[k]
+
+    def cumulative_inflation(self, total_years):
+        """The shared (1 + inflation) ** k vector, long enough for a projection of total_years."""
+        self.extend(total_years)
+        return self.inflation_factors
+
+    def slice_labels(self, fund_age, total_years):
+        """Chart labels, formatted on first use (totals-only runs never need them)."""
+        k = self.offset(fund_age)
+        self.extend(k + total_years)
+        for j in range(len(self.labels), k + total_years):
+            self.labels.append(f"{self.years[j]} ({self.p1_ages[j]}/{self.p2_ages[j]})")
+        return self.labels[k:k + total_years]
+
+
+# Fixed horizon of the car replacement stream (years from the first purchase)
+CAR_HORIZON_YEARS = 30
+
+# Fields kept per item when process_scenario runs with totals_only=True
+TOTALS_FIELDS = ("title", "capital_required", "capital_at_fund_age", "fund_age")
+
+def iter_scenario(data: CompInput, totals_only: bool = False, with_flows: bool = False,
+                  horizon_age: Optional[int] = None):
+    """
+    Central logic to process the CompInput scenario, yielding each item's result as soon as it is solved
+    (incomes, cars, assets, travel, then medical). process_scenario collects these into a list.
+    Now supports: per-item portfolio, inflate-from-current-age, universal fund age, child ages.
+    totals_only: skip year-by-year tables, chart labels and pre-funding rows and yield only
+    TOTALS_FIELDS per item (used for live recalculation while the form is being edited).
+    with_flows: attach each item's cash flows and return profile (calculations.portfolio_flows) plus its
+    timeline offset, for batch engines that re-run the projections (backtest, stress grid, ledger).
+    horizon_age: run the open-ended streams (car replacements, medical buffer) until at least this P1 age
+    instead of stopping at their fixed horizons (used by the mortality weighting, which discounts the tail).
+    Only the cash flows are extended; their portfolios are still chosen from the fixed horizons.
+    """
+    # 1. Parse Profile & Ages
+    p1_birth_year = int(data.profile.p1_dob.split("-")[0]) 
+    p2_birth_year = int(data.profile.p2_dob.split("-")[0]) if data.profile.p2_dob else p1_birth_year
+    current_year = CURRENT_YEAR
+    p1_current_age = current_year - p1_birth_year
+    p2_current_age = current_year - p2_birth_year
+    
+    # Parse children info
+    children_info = []
+    for child in data.profile.children:
+        child_birth_year = int(child.get("dob", "2000-01-01").split("-")[0])
+        children_info.append({
+            "name": child.get("name", "Child"),
+            "birth_year": child_birth_year,
+            "current_age": current_year - child_birth_year
+        })
+    
+    asm = data.assumptions
+
+    # Shared year/age index — every item slices into this instead of rebuilding its own
+    timeline = ScenarioTimeline(current_year, p1_current_age, p2_current_age, asm.inflation,
+                                tax_free_age=asm.tax_free_age, children_info=children_info)
+    
+    # Helper: Resolve fund_age — universal overrides individual
+    def get_fund_age(item_funding_start):
+        # Universal fund age takes priority when set
+        if data.universal_fund_age is not None:
+            return data.universal_fund_age
+        if item_funding_start is not None:
+            return item_funding_start
+        return p1_current_age
+
+    # Helper: Pre-funding offset (years from current age to fund_age) so graphs start from today.
+    # The zero-balance rows themselves are expanded by the report renderer, not stored per item.
+    def prefunding_offset(fund_age_local):
+        """Describe the $0 pre-funding prefix instead of materialising a row per year."""
+        if fund_age_local <= p1_current_age:
+            return None
+        return {
+            "years": fund_age_local - p1_current_age,
+            "start_year": current_year,
+            "p1_age": p1_current_age,
+            "p2_age": p2_current_age if p2_current_age else p1_current_age
+        }
+
+    # Helper: final shape of a yielded item
+    def finish(result, kind, params, fund_age_local, inflates=True, start_priced=()):
+        """start_priced: asset components entered in start-date dollars (inflated only from the item's start);
+        everything else is priced today and inflated up to the start."""
+        if totals_only:
+            result = {k: result[k] for k in TOTALS_FIELDS}
+        if with_flows:
+            flows = portfolio_flows(kind, params)
+            components = flows.get("components", {})
+            flows["start_priced"] = [sum(values) for values in zip(*(components[name] for name in start_priced))] \
+                if start_priced else [0.0] * len(flows["drawdowns"])
+            result["flows"] = {
+                **flows,
+                "offset": timeline.offset(fund_age_local),  # projection year 0 = this many years from today
+                "inflates": inflates,                        # drawdowns follow CPI (False: fixed nominal)
+                "inflation": params["inflation"],
+            }
+        return result
+
+    # Helper for Chart Data - labels come preformatted from the timeline
+    def make_chart_data(df, fund_age_local):
+        if totals_only:
+            return None
+        return {
+            "labels": timeline.slice_labels(fund_age_local, len(df)),
+            "balance": [d['Closing Balance'] for d in df],
+            "drawdown": [d['Drawdown'] for d in df],
+            "table_data": df,
+            "prefund": prefunding_offset(fund_age_local),
+            "children": children_info
+        }
+
+    # --- Process Incomes (Stages) ---
+    for item in data.incomes:
+        duration = item.end - item.start
+        
+        # Resolve per-item portfolio returns
+        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
+        
+        # Funding logic: start projection from fund_age
+        fund_age = get_fund_age(item.funding_start)
+        if fund_age < p1_current_age: fund_age = p1_current_age
+        fund_year = timeline.fund_year(fund_age)
+        
+        # Inflate income from current age to usage age
+        years_to_inflate = timeline.offset(item.start)
+        inflated_income = timeline.inflate(item.income, item.start)
+        
+        # Deferral from fund_age to start_age (capital grows, no drawdown)
+        deferral_years = item.start - fund_age
+        if deferral_years < 0: deferral_years = 0
+        
+        total_years_inc = deferral_years + duration
+        tax_sched = timeline.tax_schedule(tax, fund_age, total_years_inc)
+        
+        params = dict(
+            start_year=fund_year,
+            duration_years=duration,
+            initial_drawdown=inflated_income,
+            inflation=asm.inflation / 100,
+            inflation_factors=timeline.cumulative_inflation(duration),
+            income_return=ir / 100,
+            growth_return=gr / 100,
+            tax_rate=tax_sched,
+            fee_rate=fee / 100,
+            p1_age=fund_age, 
+            p2_age=timeline.p2_current_age + timeline.offset(fund_age),
+            defer_years=deferral_years
+        )
+        cap, df_list = calculate_income_portfolio(**params, with_table=not totals_only)
+        
+        # PV discount to today for total capital calculation
+        pv = timeline.discount(cap, gr, fund_age)
+        
+        # Build details string
+        if years_to_inflate > 0:
+            details = f"${item.income:,.0f}/yr today → ${inflated_income:,.0f}/yr inflated. Start Age {item.start}. Fund Age {fund_age}"
+        else:
+            details = f"${item.income:,.0f}/yr (Start Age {item.start}). Fund Age {fund_age}"
+        
+        yield finish({
+            "title": f"Income Stream: {item.name}",
+            "capital_required": pv,
+            "capital_at_fund_age": cap,
+            "fund_age": fund_age,
+            "chart_data": make_chart_data(df_list, fund_age),
+            "details": details,
+            "portfolio_used": portfolio,
+            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
+        }, "income", params, fund_age)
+
+    # --- Process Cars ---
+    for item in data.cars:
+        duration = CAR_HORIZON_YEARS
+        
+        # Resolve per-item portfolio returns (from the planned horizon, before any extension)
+        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
+        if horizon_age is not None:
+            duration = max(duration, horizon_age - item.start)
+        
+        # Funding Logic: start projection from fund_age
+        fund_age = get_fund_age(item.funding_start)
+        if fund_age < p1_current_age: fund_age = p1_current_age
+        fund_year = timeline.fund_year(fund_age)
+        
+        # Inflation Logic
+        eff_inflation = (asm.inflation / 100) if item.apply_inflation else 0.0
+        
+        # Inflate cost from current age to usage age
+        years_to_inflate = timeline.offset(item.start)
+        inflated_cost = timeline.inflate(item.cost, item.start)
+        
+        # Use tradein if provided, else 30% of inflated cost
+        tradein_val = item.tradein if item.tradein else inflated_cost * 0.3
+        
+        # Deferral from fund_age to item start
+        defer_years_car = item.start - fund_age
+        if defer_years_car < 0: defer_years_car = 0
+        
+        total_years_car = defer_years_car + duration
+        car_tax_sched = timeline.tax_schedule(tax, fund_age, total_years_car)
+        
+        params = dict(
+            start_year=fund_year,
+            duration_years=duration,
+            purchase_value=inflated_cost,
+            replacement_cycle=item.cycle,
+            annual_holding_cost=item.holding,
+            trade_in_value=tradein_val, 
+            inflation=eff_inflation,
+            inflation_factors=timeline.cumulative_inflation(duration) if item.apply_inflation else None,
+            income_return=ir / 100,
+            growth_return=gr / 100,
+            tax_rate=car_tax_sched,
+            fee_rate=fee / 100,
+            p1_age=fund_age,
+            p2_age=timeline.p2_current_age + timeline.offset(fund_age),
+            defer_years=defer_years_car
+        )
+        cap, df_list = calculate_asset_portfolio(**params, with_table=not totals_only)
+        
+        # PV discount to today
+        pv = timeline.discount(cap, gr, fund_age)
+
+        if years_to_inflate > 0:
+            cost_detail = f"${item.cost:,.0f} today → ${inflated_cost:,.0f} inflated"
+        else:
+            cost_detail = f"${item.cost:,.0f}"
+        
+        yield finish({
+            "title": f"Vehicle: {item.name}",
+            "capital_required": pv,
+            "capital_at_fund_age": cap,
+            "fund_age": fund_age,
+            "chart_data": make_chart_data(df_list, fund_age),
+            "details": f"Cost {cost_detail}/{item.cycle}y. Fund Age {fund_age}. Inflation: {item.apply_inflation}",
+            "portfolio_used": portfolio,
+            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
+        }, "asset", params, fund_age, inflates=item.apply_inflation,
+           start_priced=("holding", "trade_in") if item.tradein else ("holding",))
+
+    # --- Process Assets (Toys) ---
+    for item in data.assets:
+        duration = item.end - item.start
+        
+        # Resolve per-item portfolio returns
+        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
+        
+        fund_age = get_fund_age(item.funding_start)
+        if fund_age < p1_current_age: fund_age = p1_current_age
+        fund_year = timeline.fund_year(fund_age)
+        eff_inflation = (asm.inflation / 100) if item.apply_inflation else 0.0
+        
+        # Inflate cost from current age to usage age
+        years_to_inflate = timeline.offset(item.start)
+        inflated_cost = timeline.inflate(item.cost, item.start)
+        
+        # Deferral from fund_age to item start
+        defer_years_asset = item.start - fund_age
+        if defer_years_asset < 0: defer_years_asset = 0
+        
+        total_years_asset = defer_years_asset + duration
+        asset_tax_sched = timeline.tax_schedule(tax, fund_age, total_years_asset)
+        
+        params = dict(
+             start_year=fund_year,
+             duration_years=duration,
+             purchase_value=inflated_cost,
+             replacement_cycle=0, 
+             annual_holding_cost=item.holding,
+             trade_in_value=item.resale,
+             inflation=eff_inflation,
+             inflation_factors=timeline.cumulative_inflation(duration) if item.apply_inflation else None,
+             income_return=ir / 100,
+             growth_return=gr / 100,
+             tax_rate=asset_tax_sched,
+             fee_rate=fee / 100,
+             p1_age=fund_age,
+             p2_age=timeline.p2_current_age + timeline.offset(fund_age),
+             sell_at_end=True,
+             defer_years=defer_years_asset
+        )
+        cap, df_list = calculate_asset_portfolio(**params, with_table=not totals_only)
+        
+        # PV discount to today
+        pv = timeline.discount(cap, gr, fund_age)
+
+        if years_to_inflate > 0:
+            cost_detail = f"${item.cost:,.0f} today → ${inflated_cost:,.0f} inflated"
+        else:
+            cost_detail = f"${item.cost:,.0f}"
+
+        yield finish({
+            "title": f"Asset: {item.name}",
+            "capital_required": pv,
+            "capital_at_fund_age": cap,
+            "fund_age": fund_age,
+            "chart_data": make_chart_data(df_list, fund_age),
+            "details": f"Buy {cost_detail} @ Age {item.start}. Fund Age {fund_age}. Inf: {item.apply_inflation}",
+            "portfolio_used": portfolio,
+            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
+        }, "asset", params, fund_age, inflates=item.apply_inflation, start_priced=("holding", "trade_in"))
+
+    # --- Process Travel ---
+    for item in data.travel:
+        duration = item.end - item.start
+        if duration <= 0: continue
+        
+        # Resolve per-item portfolio returns
+        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
+        
+        fund_age = get_fund_age(item.funding_start)
+        if fund_age < p1_current_age: fund_age = p1_current_age
+        fund_year = timeline.fund_year(fund_age)
+        
+        # Inflate cost from current age to usage age
+        years_to_inflate = timeline.offset(item.start)
+        inflated_cost = timeline.inflate(item.cost, item.start)
+        
+        # Deferral from fund_age to item start
+        defer_years_travel = item.start - fund_age
+        if defer_years_travel < 0: defer_years_travel = 0
+        
+        total_years_travel = defer_years_travel + duration
+        travel_tax_sched = timeline.tax_schedule(tax, fund_age, total_years_travel)
+        
+        params = dict(
+            start_year=fund_year,
+            duration_years=duration,
+            daily_cost_total=inflated_cost,
+            days_per_trip=1,
+            trip_frequency_years=1,
+            inflation=asm.inflation / 100,
+            inflation_factors=timeline.cumulative_inflation(duration),
+            income_return=ir / 100,
+            growth_return=gr / 100,
+            tax_rate=travel_tax_sched,
+            fee_rate=fee / 100,
+            defer_years=defer_years_travel,
+            p1_age=fund_age,
+            p2_age=timeline.p2_current_age + timeline.offset(fund_age)
+        )
+        cap, df_list = calculate_holiday_portfolio(**params, with_table=not totals_only)
+        
+        # PV discount to today
+        pv = timeline.discount(cap, gr, fund_age)
+
+        if years_to_inflate > 0:
+            cost_detail = f"${item.cost:,.0f}/yr today → ${inflated_cost:,.0f}/yr inflated"
+        else:
+            cost_detail = f"${item.cost:,.0f}/yr"
+
+        yield finish({
+            "title": f"Travel: {item.name}",
+            "capital_required": pv,
+            "capital_at_fund_age": cap,
+            "fund_age": fund_age,
+            "chart_data": make_chart_data(df_list, fund_age),
+            "details": f"{cost_detail} from Age {item.start}. Fund Age {fund_age}.",
+            "portfolio_used": portfolio,
+            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
+        }, "holiday", params, fund_age)
+
+    # --- Process Medical ---
+    med = data.medical
+    med_cost = float(med.get('cost', 0))
+    if med_cost > 0:
+        start = int(med.get('start', 70))
+        end = int(med.get('end', 100))
+        duration = end - start
+        
+        # Medical uses the same portfolio logic (chosen from the planned duration, before any extension)
+        med_portfolio = med.get('portfolio', None)
+        if not med_portfolio:
+            if duration > 15: med_portfolio = "growth"
+            elif duration >= 5: med_portfolio = "balanced"
+            else: med_portfolio = "conservative"
+        
+        med_ir = asm.income_return
+        med_gr = asm.growth_return
+        med_tax = asm.tax_rate
+        med_fee = asm.fee_load
+        if med_portfolio in PORTFOLIO_PRESETS:
+            med_ir = PORTFOLIO_PRESETS[med_portfolio]["income_return"]
+            med_gr = PORTFOLIO_PRESETS[med_portfolio]["growth_return"]
+        # Allow per-item overrides from medical dict
+        if med.get('income_return'): med_ir = float(med['income_return'])
+        if med.get('growth_return'): med_gr = float(med['growth_return'])
+        if med.get('tax_rate') is not None: med_tax = float(med['tax_rate'])
+        if med.get('fee_load'): med_fee = float(med['fee_load'])
+        
+        if horizon_age is not None:
+            duration = max(duration, horizon_age - start)
+        
+        fund_age = int(med.get('funding_start', get_fund_age(None)))
+        if fund_age < p1_current_age: fund_age = p1_current_age
+        fund_year = timeline.fund_year(fund_age)
+        
+        # Inflate medical cost from current age to usage age
+        years_to_inflate = timeline.offset(start)
+        inflated_med = timeline.inflate(med_cost, start)
+        
+        # Deferral from fund_age to medical start
+        defer_years_med = start - fund_age
+        if defer_years_med < 0: defer_years_med = 0
+        
+        total_years_med = defer_years_med + duration
+        med_tax_sched = timeline.tax_schedule(med_tax, fund_age, total_years_med)
+        
+        params = dict(
+            start_year=fund_year,
+            duration_years=duration,
+            daily_cost_total=inflated_med,
+            days_per_trip=1,
+            trip_frequency_years=1,
+            inflation=asm.inflation / 100,
+            inflation_factors=timeline.cumulative_inflation(duration),
+            income_return=med_ir / 100, 
+            growth_return=med_gr / 100,
+            tax_rate=med_tax_sched,
+            fee_rate=med_fee / 100,
+            defer_years=defer_years_med,
+            p1_age=fund_age,
+            p2_age=timeline.p2_current_age + timeline.offset(fund_age)
+        )
+        cap, df_list = calculate_holiday_portfolio(**params, with_table=not totals_only)
+        
+        # PV discount to today
+        pv = timeline.discount(cap, med_gr, fund_age)
+        
+        if years_to_inflate > 0:
+            cost_detail = f"${med_cost:,.0f}/yr today → ${inflated_med:,.0f}/yr inflated"
+        else:
+            cost_detail = f"${med_cost:,.0f}/yr"
+             
+        yield finish({
+            "title": "Medical Buffer",
+            "capital_required": pv,
+            "capital_at_fund_age": cap,
+            "fund_age": fund_age,
+            "chart_data": make_chart_data(df_list, fund_age),
+            "details": f"{cost_detail} from Age {start}. Fund Age {fund_age}.",
+            "portfolio_used": med_portfolio,
+            "item_returns": {"income_return": med_ir, "growth_return": med_gr, "tax_rate": med_tax, "fee_load": med_fee}
+        }, "holiday", params, fund_age)
+
+
+def process_scenario(data: CompInput, totals_only: bool = False, with_flows: bool = False,
+                     horizon_age: Optional[int] = None):
+    """Run the whole scenario and return (results, total capital). See iter_scenario."""
+    results = list(iter_scenario(data, totals_only=totals_only, with_flows=with_flows, horizon_age=horizon_age))
+    total_capital = sum(r['capital_required'] for r in results)
+    
+    return results, total_capital
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a CompInput scenario through the capital engine.")
+    parser.add_argument("scenario", help="Path to a CompInput JSON file ('-' for stdin)")
+    parser.add_argument("--json", action="store_true", help="Print full results as JSON instead of a summary")
+    args = parser.parse_args(argv)
+
+    raw = sys.stdin.read() if args.scenario == "-" else open(args.scenario, encoding="utf-8").read()
+    data = CompInput.model_validate_json(raw)
+    results, total_capital = process_scenario(data)
+
+    if args.json:
+        json.dump({"results": results, "total_capital": total_capital}, sys.stdout, default=str)
+        sys.stdout.write("\n")
+        return 0
+
+    for r in results:
+        print(f"{r['title']:<40} ${r['capital_required']:>14,.0f}  (fund age {r['fund_age']}, {r['portfolio_used']})")
+    print(f"{'Total Capital Required':<40} ${total_capital:>14,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+
+from engine import CompInput, iter_scenario
+
+# Year-by-year projection export (CSV / XLSX / Parquet).
+# Rows are generated item by item straight from iter_scenario and handed to a streaming writer, so memory
+# stays flat however many scenarios go into one book: CSV is written as it goes, XLSX uses openpyxl's
+# write-only worksheets and Parquet is written in row groups. openpyxl and pyarrow are in requirements.txt
+# but imported only for their format.
+#
+#   python export.py client.json --format xlsx -o client.xlsx
+#   python export.py clients.jsonl --format parquet -o book.parquet     (one CompInput per line)
+
+# calculate_projection columns, then the asset extras (blank for income / travel / medical items)
+PROJECTION_COLUMNS = (
+    "Year", "P1 Age", "P2 Age", "Opening Balance", "Income Return", "Tax", "Income Net", "Growth", "Fees",
+    "Drawdown", "Closing Balance",
+)
+ASSET_COLUMNS = ("Purchase Cost", "Trade-In Value", "Holding Cost")
+EXPORT_COLUMNS = ("Scenario", "Item", "Portfolio") + PROJECTION_COLUMNS + ASSET_COLUMNS
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+CSV_FLUSH_ROWS = 500          # rows per streamed CSV chunk
+PARQUET_ROW_GROUP = 50_000    # rows buffered per Parquet row group
+SPOOL_BYTES = 8 * 1024 * 1024  # XLSX / Parquet files larger than this spill to a temp file while streaming
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class ExportUnavailable(RuntimeError):
+    """The writer for the requested format needs a package that is not installed."""
+
+
+# --- Rows ---
+def iter_rows(scenarios):
+    """One tuple per projection year (EXPORT_COLUMNS order) for (name, CompInput) pairs, item by item."""
+    for name, data in scenarios:
+        for result in iter_scenario(data):
+            title, portfolio = result["title"], result["portfolio_used"]
+            for record in result["chart_data"]["table_data"]:
+                yield (name, title, portfolio) + tuple(record[c] for c in PROJECTION_COLUMNS) + tuple(
+                    record.get(c) for c in ASSET_COLUMNS)
+
+
+def scenario_name(data: CompInput, fallback: str) -> str:
+    profile = data.profile
+    names = " & ".join(n for n in (profile.p1_name, profile.p2_name) if n)
+    return names or fallback
+
+
+# --- Writers ---
+def iter_csv(rows):
+    """CSV bytes in chunks of CSV_FLUSH_ROWS rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def write_xlsx(rows, target):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ExportUnavailable("XLSX export needs openpyxl (pip install openpyxl)")
+    workbook = Workbook(write_only=True)  # rows go to a temp file as they are appended
+    sheet = workbook.create_sheet("Projections")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(target)
+
+
+def write_parquet(rows, target):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportUnavailable("Parquet export needs pyarrow (pip install pyarrow)")
+    types = [pa.string()] * 3 + [pa.int64()] * 3 + [pa.float64()] * (len(EXPORT_COLUMNS) - 6)
+    schema = pa.schema(list(zip(EXPORT_COLUMNS, types)))
+    columns = [[] for _ in EXPORT_COLUMNS]
+
+    def flush(writer):
+        writer.write_table(pa.Table.from_arrays([pa.array(c, type=t) for c, t in zip(columns, types)], schema=schema))
+        for column in columns:
+            column.clear()
+
+    with pq.ParquetWriter(target, schema) as writer:
+        count = 0
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+            count += 1
+            if count % PARQUET_ROW_GROUP == 0:
+                flush(writer)
+        if columns[0] or count == 0:
+            flush(writer)
+
+
+def write_export(rows, fmt: str, target):
+    """Write rows in `fmt` to a binary file object or path."""
+    if fmt == "csv":
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as f:
+                return write_export(rows, fmt, f)
+        for chunk in iter_csv(rows):
+            target.write(chunk)
+    elif fmt == "xlsx":
+        write_xlsx(rows, target)
+    elif fmt == "parquet":
+        write_parquet(rows, target)
+    else:
+        raise ValueError(f"Unknown export format '{fmt}' (use {', '.join(FORMATS)})")
+
+
+def check_format(fmt: str):
+    """Fail before any work if the format is unknown or its writer is not installed."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}' (use {', '.join(FORMATS)})")
+    module = {"xlsx": "openpyxl", "parquet": "pyarrow"}.get(fmt)
+    if module:
+        try:
+            __import__(module)
+        except ImportError:
+            raise ExportUnavailable(f"{fmt.upper()} export needs {module} (pip install {module})")
+
+
+def iter_export(rows, fmt: str):
+    """Export bytes in chunks, for a streaming HTTP response. CSV is produced row by row; XLSX and Parquet
+    are binary containers finished at the end, so they are written to a spooled temp file and then streamed."""
+    if fmt == "csv":
+        yield from iter_csv(rows)
+        return
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+        write_export(rows, fmt, spool)
+        spool.seek(0)
+        while chunk := spool.read(STREAM_CHUNK_BYTES):
+            yield chunk
+
+
+# --- CLI ---
+def load_scenarios(paths):
+    """(name, CompInput) for each .json file, or each line of a .jsonl file, read lazily."""
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for n, line in enumerate(f, 1):
+                    if line.strip():
+                        data = CompInput.model_validate_json(line)
+                        yield scenario_name(data, f"{stem}:{n}"), data
+        else:
+            with open(path, encoding="utf-8") as f:
+                data = CompInput.model_validate_json(f.read())
+            yield scenario_name(data, stem), data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export year-by-year projections of CompInput scenarios.")
+    parser.add_argument("scenarios", nargs="+", help="CompInput .json files or .jsonl books (one per line)")
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout for CSV)")
+    args = parser.parse_args(argv)
+
+    if args.output is None and args.format != "csv":
+        parser.error(f"--output is required for {args.format}")
+    try:
+        check_format(args.format)
+    except ExportUnavailable as e:
+        parser.error(str(e))
+
+    rows = iter_rows(load_scenarios(args.scenarios))
+    write_export(rows, args.format, args.output or sys.stdout.buffer)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
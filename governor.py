@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import math
+import os
+import random
+from contextlib import asynccontextmanager
+
+# Admission control for LLM-bound work.
+# Every model call goes through one LLMGovernor per worker: a global concurrency limit plus a limit per
+# endpoint, with callers beyond that waiting in a bounded priority queue (interactive chat ahead of batch
+# analyze). Provider rate-limit / transient errors are retried with capped exponential backoff and full jitter,
+# and identical requests already in flight are coalesced (SingleFlight) so a double-clicked "Generate" costs
+# one analysis. When the queue is full or a caller waits too long, Overloaded is raised and the route answers
+# 503 with Retry-After instead of piling more load onto the provider.
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))  # seconds a caller may wait for a slot
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "4"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))       # seconds, doubled per attempt
+LLM_RETRY_CAP = float(os.getenv("LLM_RETRY_CAP", "8"))
+
+# Retry-After sent with a 503 when neither the governor nor the provider gives a better estimate
+DEFAULT_RETRY_AFTER = 5
+
+# Concurrent model calls per endpoint (each also counts against LLM_MAX_CONCURRENCY)
+ENDPOINT_LIMITS = {
+    "chat": int(os.getenv("LLM_LIMIT_CHAT", "6")),
+    "agent": int(os.getenv("LLM_LIMIT_AGENT", "4")),
+    "analyze": int(os.getenv("LLM_LIMIT_ANALYZE", "2")),
+}
+
+# Lower runs first: people waiting on a chat reply go ahead of plan generation
+PRIORITIES = {"chat": 0, "agent": 0, "analyze": 1}
+
+try:
+    import openai
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                        openai.InternalServerError, asyncio.TimeoutError)
+except ImportError:
+    RETRYABLE_ERRORS = (asyncio.TimeoutError,)
+
+
+class Overloaded(Exception):
+    """No model slot available (queue full or queue timeout); retry_after is a hint in seconds."""
+    def __init__(self, message, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE, cap: float = LLM_RETRY_CAP) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_hint(error, cap: float = LLM_RETRY_CAP):
+    """Seconds from a provider Retry-After header, if the error carries one, clamped to [0, cap] so a
+    provider asking for minutes (or garbage) can't stall a retry loop or be passed on to clients as is."""
+    response = getattr(error, "response", None)
+    try:
+        seconds = float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if math.isnan(seconds):
+        return None
+    return min(max(seconds, 0.0), cap)
+
+
+class LLMGovernor:
+    """Global + per-endpoint concurrency limits with a bounded priority wait queue (one per event loop)."""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, limits=None, max_queue=LLM_QUEUE_MAX,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, priorities=None):
+        self.max_concurrency = max_concurrency
+        self.limits = dict(ENDPOINT_LIMITS if limits is None else limits)
+        self.priorities = dict(PRIORITIES if priorities is None else priorities)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.active_by_endpoint = {}
+        self._waiters = []  # [priority, seq, endpoint, future]
+        self._seq = itertools.count()
+        self.rejected = 0
+        self.retries = 0
+
+    def _has_capacity(self, endpoint):
+        limit = self.limits.get(endpoint, self.max_concurrency)
+        return self.active < self.max_concurrency and self.active_by_endpoint.get(endpoint, 0) < limit
+
+    def _grant(self, endpoint):
+        self.active += 1
+        self.active_by_endpoint[endpoint] = self.active_by_endpoint.get(endpoint, 0) + 1
+
+    def _dispatch(self):
+        """Hand freed slots to the best waiting callers whose endpoint still has room."""
+        while self.active < self.max_concurrency:
+            eligible = [w for w in self._waiters if self._has_capacity(w[2])]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (w[0], w[1]))
+            self._waiters.remove(waiter)
+            self._grant(waiter[2])
+            waiter[3].set_result(None)
+
+    async def acquire(self, endpoint: str):
+        future = asyncio.get_running_loop().create_future()
+        waiter = [self.priorities.get(endpoint, 1), next(self._seq), endpoint, future]
+        self._waiters.append(waiter)
+        self._dispatch()
+        if future.done():
+            return  # a slot was free and nobody more urgent was waiting for it
+        if len(self._waiters) > self.max_queue:
+            self._waiters.remove(waiter)
+            self.rejected += 1
+            raise Overloaded(f"LLM queue full ({self.max_queue} waiting)")
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self.release(endpoint)  # granted just as we gave up
+            else:
+                future.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise Overloaded(f"No LLM slot within {self.queue_timeout:g}s") from None
+            raise
+
+    def release(self, endpoint: str):
+        self.active -= 1
+        self.active_by_endpoint[endpoint] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str):
+        await self.acquire(endpoint)
+        try:
+            yield
+        finally:
+            self.release(endpoint)
+
+    async def call(self, endpoint: str, fn, attempts: int = LLM_RETRY_ATTEMPTS):
+        """Await fn() inside a slot, retrying provider rate-limit / transient errors with backoff + jitter.
+        The slot is given back while backing off so other callers can use it."""
+        for attempt in range(attempts):
+            async with self.slot(endpoint):
+                try:
+                    return await fn()
+                except RETRYABLE_ERRORS as e:
+                    if attempt == attempts - 1:
+                        raise
+                    delay = retry_after_hint(e) or backoff_delay(attempt)
+                    self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"active": self.active, "active_by_endpoint": dict(self.active_by_endpoint),
+                "waiting": len(self._waiters), "rejected": self.rejected, "retries": self.retries}
+
+
+class SingleFlight:
+    """Coalesce identical in-flight calls: followers await the leader's result instead of repeating the work."""
+
+    def __init__(self):
+        self._calls = {}  # key -> Task
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        # A follower (or the leader) disconnecting must not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # consumed here so an unawaited failure is not logged as "never retrieved"
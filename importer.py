@@ -0,0 +1,345 @@
+import argparse
+import csv
+import os
+import re
+import sys
+
+import orjson
+from pydantic import TypeAdapter, ValidationError
+
+from engine import CURRENT_YEAR, CompInput, process_scenario
+
+# Bulk import of legacy client workbooks (the "Life Line Calculation.xlsx" layout) into CompInput.
+# Each worksheet is one item: a label/value header (column B / column C) followed by its year-by-year table.
+# Workbooks are opened read-only (rows are streamed, never loaded as a whole) and only the first
+# MAX_BLOCK_ROWS rows of each sheet are read. The mapped documents are validated in batches and run through
+# the scenario engine. Problems are collected per client as {file, sheet, row, field, message} records
+# instead of being raised, so one bad workbook never stops the run.
+#
+#   python importer.py clients/*.xlsx --jsonl clients.jsonl --errors errors.csv
+#   python export.py clients.jsonl --format xlsx -o book.xlsx
+
+BATCH_SIZE = 200
+MAX_BLOCK_ROWS = 70  # header + the table rows that carry purchase / trade-in / holding costs
+
+# Sheet title pattern -> item kind (first match wins; other sheets, e.g. Summary, are skipped)
+SHEET_KINDS = (
+    (re.compile(r"^income\b", re.I), "income"),
+    (re.compile(r"^car\b", re.I), "car"),
+    (re.compile(r"^(carvan|caravan|boat)", re.I), "asset"),
+    (re.compile(r"holiday|travel", re.I), "travel"),
+    (re.compile(r"^medical", re.I), "medical"),
+)
+
+# Normalized label -> field. Several spellings occur across the sheets.
+LABELS = {
+    "calander year at stage": "calendar_year",
+    "stage length": "length",
+    "partner 1 age": "p1_age",
+    "partner 1 age at start of stage": "p1_age",
+    "partner 2 age": "p2_age",
+    "partner 2 age at stage of stage": "p2_age",
+    "tax rate (%)": "tax_rate",
+    "fees %": "fee_load",
+    "inflation": "inflation",
+    "portfolio": "portfolio",
+    "income return (%)": "income_return",
+    "growth (%)": "growth_return",
+    "income needed ex fees": "income",
+    "hollding costs - total": "holding",
+    "frequence of years between trips": "frequency",
+}
+# Table rows kept whole (one value per year)
+SERIES = {"capital needed - purchase price": "purchases", "trade in value": "trade_ins"}
+
+# Sheet rates are fractions (0.15); CompInput takes percentage points (15)
+PERCENT_FIELDS = ("tax_rate", "fee_load", "inflation", "income_return", "growth_return")
+
+_comp_inputs = TypeAdapter(list[CompInput])
+
+
+class ImportUnavailable(RuntimeError):
+    """openpyxl, which reads the workbooks, is not installed."""
+
+
+def _label(value) -> str:
+    return re.sub(r"\s+", " ", str(value)).strip().lower()
+
+
+def sheet_kind(title: str):
+    for pattern, kind in SHEET_KINDS:
+        if pattern.search(title.strip()):
+            return kind
+    return None
+
+
+def read_block(rows):
+    """First label/value block of a sheet: {field: (value, row)} plus whole rows for SERIES labels.
+    A label's value is column C, or the first table year (column D) when C is empty."""
+    fields, series = {}, {}
+    for row_no, row in enumerate(rows, 1):
+        if row_no > MAX_BLOCK_ROWS or len(row) < 3:
+            break
+        if not isinstance(row[1], str):
+            continue
+        label = _label(row[1])
+        value = row[2] if row[2] is not None else (row[3] if len(row) > 3 else None)
+        if label in SERIES:
+            series.setdefault(SERIES[label], [v or 0 for v in row[3:]])
+            continue
+        field = LABELS.get(label)
+        if field == "calendar_year" and field in fields:
+            break  # the next stage's block starts here
+        if field is not None:
+            fields.setdefault(field, (value, row_no))
+    return fields, series
+
+
+class SheetReader:
+    """Typed access to one sheet's fields; missing or invalid values become error records."""
+
+    def __init__(self, source, sheet, fields, series, errors):
+        self.source, self.sheet, self.fields, self.series, self.errors = source, sheet, fields, series, errors
+
+    def error(self, field, message, row=None):
+        self.errors.append({"file": self.source, "sheet": self.sheet, "row": row, "field": field, "message": message})
+
+    def number(self, field, default=None, required=True):
+        value, row = self.fields.get(field, (None, None))
+        if value is None or value == "":
+            if required and default is None:
+                self.error(field, "missing value", row)
+            return default
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            self.error(field, f"not a number: {value!r}", row)
+            return default
+        return round(number * 100, 10) if field in PERCENT_FIELDS else number
+
+    def text(self, field):
+        value, _ = self.fields.get(field, (None, None))
+        return str(value).strip().lower() if value else None
+
+
+def _cycle(purchases):
+    """Years between the first two purchases (0 = bought once)."""
+    years = [i for i, v in enumerate(purchases) if isinstance(v, (int, float)) and v]
+    return years[1] - years[0] if len(years) > 1 else 0
+
+
+def map_sheet(kind, sheet: SheetReader, doc):
+    """Add one sheet's item to the CompInput document being built."""
+    calendar_year = sheet.number("calendar_year", default=CURRENT_YEAR)
+    p1_age = sheet.number("p1_age")
+    length = sheet.number("length")
+    if p1_age is None or length is None:
+        return
+    start = int(p1_age)  # P1's age when the stage starts
+    end = start + int(length)
+    years_ahead = max(0, int(calendar_year - CURRENT_YEAR))
+    inflation = sheet.number("inflation", default=doc["assumptions"].get("inflation", 0.0), required=False)
+
+    if "p1_current_age" not in doc:
+        doc["p1_current_age"] = int(p1_age - years_ahead)
+        p2_age = sheet.number("p2_age", required=False)
+        doc["p2_current_age"] = int(p2_age - years_ahead) if p2_age is not None else None
+
+    item = {"name": sheet.sheet, "start": start, "end": end, "portfolio": sheet.text("portfolio")}
+    for field in ("income_return", "growth_return", "tax_rate", "fee_load"):
+        value = sheet.number(field, required=False)
+        if value is not None:
+            item[field] = value
+
+    if kind == "income":
+        income = sheet.number("income")
+        if income is None:
+            return
+        item["income"] = income
+        doc["incomes"].append(item)
+        if not doc["assumptions"]:
+            doc["assumptions"] = {"income_return": item.get("income_return", 0.0),
+                                  "growth_return": item.get("growth_return", 0.0),
+                                  "tax_rate": item.get("tax_rate", 0.0),
+                                  "inflation": inflation, "fee_load": item.get("fee_load", 0.0)}
+    elif kind in ("car", "asset"):
+        purchases = sheet.series.get("purchases") or []
+        trade_ins = [v for v in sheet.series.get("trade_ins") or [] if isinstance(v, (int, float)) and v]
+        cost = next((v for v in purchases if isinstance(v, (int, float)) and v), None)
+        if cost is None:
+            sheet.error("purchase", "no purchase price in the table")
+            return
+        holding = sheet.number("holding", default=0.0, required=False)
+        # The sheets keep replacement and holding costs flat in nominal terms, and apply_inflation=False does the
+        # same in the engine (the first purchase is still inflated to the start age, see to_todays_dollars)
+        item.update(cost=cost, holding=holding, apply_inflation=False)
+        if kind == "car":
+            item.update(cycle=_cycle(purchases), tradein=trade_ins[0] if trade_ins else 0)
+            doc["cars"].append(item)
+        else:
+            item.update(resale=trade_ins[-1] if trade_ins else 0)
+            doc["assets"].append(item)
+    elif kind == "travel":
+        trip = sheet.number("holding")
+        if trip is None:
+            return
+        frequency = sheet.number("frequency", default=1.0, required=False) or 1.0
+        item["cost"] = trip / frequency  # CompInput travel is an annual cost
+        doc["travel"].append(item)
+    elif kind == "medical":
+        cost = sheet.number("holding", required=False) or sheet.number("income")
+        if cost is None:
+            return
+        doc["medical"] = {"cost": cost, "start": start, "end": end,
+                          **{k: v for k, v in item.items() if k not in ("name", "start", "end") and v is not None}}
+
+
+def to_todays_dollars(doc, p1_current_age):
+    """Sheet amounts are nominal at their stage start, while CompInput amounts are in today's dollars that the
+    engine inflates to the item's start age at the scenario inflation (Timeline.inflate, for cars and assets
+    whatever apply_inflation says). Divide by exactly that factor so the engine gets the sheet amount back."""
+    rate = doc["assumptions"].get("inflation", 0.0) / 100
+
+    def factor(start):
+        return (1 + rate) ** max(0, start - p1_current_age)
+
+    for item in doc["incomes"]:
+        item["income"] /= factor(item["start"])
+    for category in ("cars", "assets", "travel"):
+        for item in doc[category]:
+            item["cost"] /= factor(item["start"])
+    if doc["medical"]:
+        doc["medical"]["cost"] /= factor(doc["medical"]["start"])
+
+
+def read_workbook(source, name=None):
+    """(client name, CompInput document dict, errors) for one workbook path or binary file object."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportUnavailable("Spreadsheet import needs openpyxl (pip install openpyxl)")
+    label = name or (os.path.basename(source) if isinstance(source, (str, os.PathLike)) else "upload.xlsx")
+    client = os.path.splitext(label)[0]
+    errors = []
+    doc = {"incomes": [], "cars": [], "assets": [], "travel": [], "medical": {}, "assumptions": {}}
+    try:
+        workbook = load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        errors.append({"file": label, "sheet": None, "row": None, "field": None, "message": f"unreadable workbook: {e}"})
+        return client, None, errors
+    try:
+        for ws in workbook.worksheets:
+            kind = sheet_kind(ws.title)
+            if kind is None:
+                continue
+            fields, series = read_block(ws.iter_rows(values_only=True))
+            if not fields:
+                continue  # placeholder sheet with no data
+            map_sheet(kind, SheetReader(label, ws.title, fields, series, errors), doc)
+    finally:
+        workbook.close()
+
+    if not doc["incomes"]:
+        errors.append({"file": label, "sheet": None, "row": None, "field": "incomes", "message": "no income stage found"})
+        return client, None, errors
+    p1_age, p2_age = doc.pop("p1_current_age"), doc.pop("p2_current_age")
+    to_todays_dollars(doc, p1_age)
+    doc["profile"] = {"p1_name": client, "p1_dob": f"{CURRENT_YEAR - p1_age}-01-01", "p2_name": "",
+                      "p2_dob": f"{CURRENT_YEAR - p2_age}-01-01" if p2_age is not None else ""}
+    return client, doc, errors
+
+
+def validate_batch(batch):
+    """Validate [(client, doc, errors)] in one pydantic call; documents that fail get their errors recorded
+    and None as their scenario."""
+    docs = [doc for _, doc, _ in batch]
+    try:
+        return _comp_inputs.validate_python(docs)
+    except ValidationError as e:
+        failed = {}
+        for err in e.errors():
+            failed.setdefault(err["loc"][0], []).append(err)
+    scenarios = []
+    for index, (client, doc, errors) in enumerate(batch):
+        if index in failed:
+            for err in failed[index]:
+                errors.append({"file": client, "sheet": None, "row": None,
+                               "field": ".".join(str(p) for p in err["loc"][1:]), "message": err["msg"]})
+            scenarios.append(None)
+        else:
+            scenarios.append(CompInput.model_validate(doc))
+    return scenarios
+
+
+def import_workbooks(sources, batch_size: int = BATCH_SIZE):
+    """Yield one result per workbook (a path or a (file object, name) pair):
+    {"client", "scenario" (CompInput or None), "total_capital", "errors"}.
+    Workbooks are read one at a time; at most batch_size mapped documents are held before validation."""
+    batch = []
+
+    def flush():
+        mapped = [i for i, (_, doc, _) in enumerate(batch) if doc is not None]
+        scenarios = [None] * len(batch)
+        for i, scenario in zip(mapped, validate_batch([batch[i] for i in mapped]) if mapped else []):
+            scenarios[i] = scenario
+        for (client, _, errors), scenario in zip(batch, scenarios):
+            total = None
+            if scenario is not None:
+                try:
+                    total = process_scenario(scenario, totals_only=True)[1]
+                except Exception as e:
+                    errors.append({"file": client, "sheet": None, "row": None, "field": None,
+                                   "message": f"engine error: {e}"})
+                    scenario = None
+            yield {"client": client, "scenario": scenario, "total_capital": total, "errors": errors}
+        batch.clear()
+
+    for source in sources:
+        client, doc, errors = read_workbook(*source) if isinstance(source, tuple) else read_workbook(source)
+        batch.append((client, doc, errors))
+        if len(batch) >= batch_size:
+            yield from flush()
+    yield from flush()
+
+
+# --- CLI ---
+ERROR_COLUMNS = ("file", "sheet", "row", "field", "message")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import client workbooks (Life Line Calculation layout) as CompInput.")
+    parser.add_argument("workbooks", nargs="+", help=".xlsx files")
+    parser.add_argument("--jsonl", help="Write valid CompInput documents here, one per line (export.py reads this)")
+    parser.add_argument("--errors", help="Write collected errors here as CSV")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    out = open(args.jsonl, "wb") if args.jsonl else None
+    err_file = open(args.errors, "w", newline="", encoding="utf-8") if args.errors else None
+    err_writer = csv.DictWriter(err_file, ERROR_COLUMNS) if err_file else None
+    if err_writer:
+        err_writer.writeheader()
+    imported = failed = 0
+    try:
+        for result in import_workbooks(args.workbooks, args.batch_size):
+            if result["scenario"] is not None:
+                imported += 1
+                if out:
+                    out.write(orjson.dumps(result["scenario"].model_dump(mode="json")) + b"\n")
+                print(f"{result['client']:<40} ${result['total_capital']:>14,.0f}  ({len(result['errors'])} warnings)")
+            else:
+                failed += 1
+                print(f"{result['client']:<40} {'FAILED':>15}  ({len(result['errors'])} errors)")
+            if err_writer:
+                err_writer.writerows(result["errors"])
+    finally:
+        if out:
+            out.close()
+        if err_file:
+            err_file.close()
+    print(f"Imported {imported}, failed {failed}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import orjson
+
+from governor import backoff_delay, retry_after_hint
+
+# Persistent background job queue.
+# Long model pipelines (/api/analyze) are submitted as jobs: the request returns a job id at once, worker tasks
+# claim queued jobs from a SQLite table, record their stage as they go and store the finished result, which
+# stays downloadable until JOB_RESULT_TTL. A job whose handler raises one of the queue's `retryable` errors
+# (provider overloaded / still failing after the governor's retries) goes back to "queued" with a backoff and is
+# only marked "error" after JOB_MAX_ATTEMPTS. Several uvicorn workers can share one database file: jobs are
+# claimed in an IMMEDIATE transaction under a lease (owner + lease_until) that the running worker renews, and
+# only jobs whose lease has run out (their process died or hung) are re-queued, never a live sibling's.
+# SQLite calls run in a thread (never on the event loop) with a short busy timeout; a worker that hits a
+# locked database logs it, backs off and carries on.
+
+JOB_DB = os.getenv("JOB_DB", "data/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(7 * 24 * 3600)))  # seconds a finished job is kept
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))  # idle workers / event streams re-check
+JOB_PRUNE_INTERVAL = float(os.getenv("JOB_PRUNE_INTERVAL", "600"))  # seconds between expired-job sweeps
+JOB_DB_TIMEOUT = float(os.getenv("JOB_DB_TIMEOUT", "2.0"))  # SQLite busy timeout; callers retry on "locked"
+
+# Worker backoff after a database error (doubles per consecutive failure)
+JOB_RETRY_BASE = 0.5
+JOB_RETRY_MAX = 30.0
+# Runs of a job that fails with a retryable error before it is marked "error", and the delay before each re-run
+# (full-jitter backoff doubling per attempt, never shorter than the error's own Retry-After hint)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_REQUEUE_BASE = float(os.getenv("JOB_REQUEUE_BASE", "10"))
+JOB_REQUEUE_CAP = float(os.getenv("JOB_REQUEUE_CAP", "300"))
+# Attempts to record a finished job before leaving it "running" until its lease expires and it is re-queued
+JOB_FINISH_ATTEMPTS = 5
+# Seconds a claimed job stays owned without a renewal; the running worker renews it every third of that
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
+
+TERMINAL = ("done", "error")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    payload BLOB,
+    result BLOB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (kind, key);
+"""
+
+# Columns added after the first release, for databases created before them
+_MIGRATIONS = {
+    "attempts": "ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+    "not_before": "ALTER TABLE jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0",
+    "owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+    "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0",
+}
+
+_STATUS_COLUMNS = "id, kind, status, stage, error, attempts, created, updated"
+
+# Unfinished jobs, or finished ones still within the result TTL (expired rows may not be pruned yet)
+_LIVE = "(status NOT IN ('done', 'error') OR updated >= ?)"
+
+
+def _status_row(row):
+    if row is None:
+        return None
+    job_id, kind, status, stage, error, attempts, created, updated = row
+    job = {"job_id": job_id, "kind": kind, "status": status, "stage": stage, "attempts": attempts,
+           "created": created, "updated": updated}
+    if error:
+        job["error"] = error
+    return job
+
+
+class JobQueue:
+    """SQLite-backed job queue; handlers[kind] is `async fn(payload, progress) -> bytes` (progress(stage) is async).
+    Exceptions in `retryable` re-queue the job (up to max_attempts runs) instead of failing it.
+    The public methods are coroutines; the underscore-prefixed ones block and run in a worker thread."""
+
+    def __init__(self, handlers: dict, path: str = JOB_DB, workers: int = JOB_WORKERS,
+                 result_ttl: float = JOB_RESULT_TTL, poll_interval: float = JOB_POLL_INTERVAL,
+                 retryable: tuple = (), max_attempts: int = JOB_MAX_ATTEMPTS, lease: float = JOB_LEASE):
+        self.handlers = handlers
+        self.lease = lease
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"  # this queue instance, on the rows it claims
+        self.retryable = tuple(retryable)
+        self.max_attempts = max_attempts
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=JOB_DB_TIMEOUT)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, ddl in _MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(ddl)
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._pruned = 0.0
+        self._requeued = 0.0
+        self._wakeup = None   # asyncio.Event, created on start()
+        self._changed = None  # asyncio.Condition, notified on every stage change in this process
+
+    # --- Storage ---
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def _cutoff(self):
+        return time.time() - self.result_ttl
+
+    def _submit(self, kind, payload, key):
+        now = time.time()
+        with self._lock:
+            if key is not None:
+                row = self._db.execute(
+                    f"SELECT {_STATUS_COLUMNS} FROM jobs WHERE kind = ? AND key = ? AND status != 'error' "
+                    f"AND {_LIVE} ORDER BY created DESC LIMIT 1", (kind, key, now - self.result_ttl)).fetchone()
+                if row is not None:
+                    return _status_row(row), False
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, key, status, stage, payload, created, updated) "
+                "VALUES (?, ?, ?, 'queued', NULL, ?, ?, ?)", (job_id, kind, key, orjson.dumps(payload), now, now))
+        return self._get(job_id), True
+
+    def _get(self, job_id):
+        return _status_row(self._execute(f"SELECT {_STATUS_COLUMNS} FROM jobs WHERE id = ? AND {_LIVE}",
+                                         (job_id, self._cutoff())).fetchone())
+
+    def _result(self, job_id):
+        row = self._execute("SELECT result FROM jobs WHERE id = ? AND status = 'done' AND updated >= ?",
+                            (job_id, self._cutoff())).fetchone()
+        return row[0] if row is not None else None
+
+    async def submit(self, kind: str, payload: dict, key: str = None):
+        """Queue a job and return (status, created). A live job, or a finished one within the result TTL,
+        with the same key is reused."""
+        job, created = await asyncio.to_thread(self._submit, kind, payload, key)
+        if created and self._wakeup is not None:
+            self._wakeup.set()
+        return job, created
+
+    async def get(self, job_id: str):
+        """Job status, or None when unknown or expired."""
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def result(self, job_id: str):
+        """Stored result bytes of a finished, unexpired job."""
+        return await asyncio.to_thread(self._result, job_id)
+
+    def _claim(self):
+        """Atomically move the oldest queued job that is due to running and count the attempt;
+        returns (id, kind, payload, attempts) or None."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, kind, payload, attempts + 1 FROM jobs WHERE status = 'queued' AND not_before <= ? "
+                    "ORDER BY created LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status = 'running', stage = 'started', attempts = ?, owner = ?, "
+                                     "lease_until = ?, updated = ? WHERE id = ?",
+                                     (row[3], self.owner, now + self.lease, now, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return row
+
+    def _update(self, job_id, owned=False, **fields):
+        """Update a job row; owned=True only touches it while this queue still holds its lease.
+        Returns whether a row was updated."""
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        if owned:
+            cursor = self._execute(f"UPDATE jobs SET {columns} WHERE id = ? AND owner = ?",
+                                   (*fields.values(), job_id, self.owner))
+        else:
+            cursor = self._execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        return cursor.rowcount > 0
+
+    def _prune(self):
+        """Drop finished jobs older than the result TTL."""
+        self._execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND updated < ?", (self._cutoff(),))
+        self._pruned = time.time()
+
+    def requeue_expired(self):
+        """Running jobs whose lease ran out (their process died or stopped renewing) are picked up again."""
+        now = time.time()
+        self._execute("UPDATE jobs SET status = 'queued', stage = NULL, owner = NULL, updated = ? "
+                      "WHERE status = 'running' AND lease_until < ?", (now, now))
+        self._requeued = now
+
+    # --- Workers ---
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _finish(self, job_id, **fields):
+        """Record a job's outcome and release its lease, retrying on database errors; a job that still cannot be
+        recorded stays "running" until its lease expires and it is re-queued. Nothing is written if the lease
+        was already lost (the job was re-queued and may be running elsewhere)."""
+        fields.update(owner=None, lease_until=0)
+        for attempt in range(JOB_FINISH_ATTEMPTS):
+            try:
+                if not await asyncio.to_thread(self._update, job_id, True, **fields):
+                    print(f"Job {job_id}: lease lost, {fields.get('status')} not recorded")
+                return
+            except sqlite3.Error as e:
+                print(f"Job {job_id}: could not record {fields.get('status')} ({e}), attempt {attempt + 1}")
+                await asyncio.sleep(min(JOB_RETRY_BASE * 2 ** attempt, JOB_RETRY_MAX))
+
+    def _requeue_delay(self, error, attempt):
+        hint = getattr(error, "retry_after", None) or retry_after_hint(error, JOB_REQUEUE_CAP) or 0
+        return max(hint, backoff_delay(attempt - 1, JOB_REQUEUE_BASE, JOB_REQUEUE_CAP))
+
+    async def _renew(self, job_id):
+        """Keep the lease of a running job alive until cancelled."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self._update, job_id, True, lease_until=time.time() + self.lease)
+            except sqlite3.Error as e:
+                print(f"Job {job_id}: could not renew lease ({e})")  # retried at the next renewal
+
+    async def _run(self, job_id, kind, payload, attempt):
+        async def progress(stage):
+            try:
+                await asyncio.to_thread(self._update, job_id, True, stage=stage)
+            except sqlite3.Error as e:
+                print(f"Job {job_id}: could not record stage {stage} ({e})")  # cosmetic; the job carries on
+            await self._notify()
+
+        await self._notify()
+        renewal = asyncio.create_task(self._renew(job_id))
+        try:
+            handler = self.handlers[kind]
+            result = await handler(orjson.loads(payload), progress)
+            await self._finish(job_id, status="done", stage="done", result=result, payload=None, error=None)
+        except self.retryable as e:
+            message = str(e) or type(e).__name__
+            if attempt >= self.max_attempts:
+                print(f"Job {job_id} ({kind}) failed after {attempt} attempts: {message}")
+                await self._finish(job_id, status="error", error=message)
+            else:
+                delay = self._requeue_delay(e, attempt)
+                print(f"Job {job_id} ({kind}) attempt {attempt} failed: {message}; re-queued in {delay:.1f}s")
+                await self._finish(job_id, status="queued", stage="retrying", error=message,
+                                   not_before=time.time() + delay)
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            await self._finish(job_id, status="error", error=str(e) or type(e).__name__)
+        finally:
+            renewal.cancel()
+        await self._notify()
+
+    async def _idle(self):
+        if time.time() - self._pruned >= JOB_PRUNE_INTERVAL:
+            await asyncio.to_thread(self._prune)
+        if time.time() - self._requeued >= self.lease / 3:
+            await asyncio.to_thread(self.requeue_expired)
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self):
+        failures = 0
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+                if job is None:
+                    await self._idle()
+                else:
+                    await self._run(*job)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. "database is locked" while another process holds the write lock
+                delay = min(JOB_RETRY_BASE * 2 ** failures, JOB_RETRY_MAX)
+                failures += 1
+                print(f"Job worker error: {e}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def start(self):
+        """Re-queue jobs whose lease expired, prune expired results and start the worker tasks (call from app
+        startup). With several processes sharing the database, set JOB_WORKERS per process; idle workers keep
+        re-queueing jobs whose owner stopped renewing."""
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Condition()
+        await asyncio.to_thread(self.requeue_expired)
+        await asyncio.to_thread(self._prune)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def events(self, job_id: str):
+        """Yield the job status each time it changes, ending with the terminal status."""
+        last = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if (job["status"], job["stage"]) != last:
+                last = (job["status"], job["stage"])
+                yield job
+            if job["status"] in TERMINAL:
+                return
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(self._changed.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass  # another process may own the job: re-read from the database
@@ -0,0 +1,152 @@
+import numpy as np
+
+from calculations import flow_multipliers, tax_schedule
+from engine import CURRENT_YEAR, CompInput, process_scenario
+
+# Household ledger.
+# Every item is laid out on one calendar axis (years from today) and each ledger column is a dense
+# (years x items) matrix built in one pass: closing balances come from the closed form
+# B_j = P_j * (C - sum_{i<=j} d_i / P_i) instead of a per-row loop, and the other columns follow from the
+# opening balances. Before an item's fund age its capital sits in the growth component only — the same
+# assumption the engine uses to discount it to today — so the ledger starts from the capital held today.
+
+LEDGER_COLUMNS = ("drawdown", "balance", "fees", "tax")
+
+# Horizon of FeeRelativity.total_estimated_fees_10y
+FEE_SUMMARY_YEARS = 10
+
+
+def _item_columns(flows, horizon):
+    """One item's ledger columns over `horizon` calendar years, plus its capital today."""
+    k = max(flows.get("offset", 0), 0)
+    funding = np.asarray(flows["funding_drawdowns"], dtype=float)
+    drawdowns = np.asarray(flows["drawdowns"], dtype=float)  # actual flows (incl. trade-in / resale inflows)
+    n = len(funding)
+    columns = {name: np.zeros(horizon) for name in LEDGER_COLUMNS}
+    if n == 0:
+        return columns, 0.0
+
+    tax_rates = np.asarray(tax_schedule(flows["tax_rate"], n), dtype=float)
+    fee = flows["fee_rate"]
+    multipliers = np.asarray(flow_multipliers(flows, n))
+    growth_paths = np.cumprod(multipliers)
+    capital = float(np.sum(funding / growth_paths))  # capital at fund age (solved on funding drawdowns)
+
+    closing = growth_paths * (capital - np.cumsum(drawdowns / growth_paths))
+    opening = np.concatenate([[capital], closing[:-1]])
+
+    # Pre-funding years: capital today grows in the growth component up to the fund age
+    discount_rate = flows.get("discount_rate", flows["growth_return"])
+    capital_today = capital / (1 + discount_rate) ** k
+    end = min(k + n, horizon)
+    columns["balance"][:min(k, horizon)] = capital_today * (1 + discount_rate) ** np.arange(1, min(k, horizon) + 1)
+    columns["balance"][k:end] = closing[:end - k]
+    columns["drawdown"][k:end] = drawdowns[:end - k]
+    columns["fees"][k:end] = (opening * fee)[:end - k]  # as in the per-item tables (shown even when not deducted)
+    columns["tax"][k:end] = (opening * flows["income_return"] * tax_rates)[:end - k]
+    return columns, capital_today
+
+
+def _calendar_vector(values, k, horizon, before):
+    """Per-year item parameter on the calendar axis: `before` until the fund age, last value after the end."""
+    values = np.asarray(values, dtype=float)
+    out = np.empty(horizon)
+    out[:k] = before
+    out[k:k + len(values)] = values[:max(0, horizon - k)]
+    out[k + len(values):] = values[-1]
+    return out
+
+
+def pooled_fund(items, drawdowns, capital_today, horizon):
+    """
+    All items in one portfolio: a capital-weighted blend of the item return profiles (per calendar year,
+    so tax-free ages still apply), funding the household drawdowns from a single pot. Before its fund age an
+    item's share grows at its discount rate, exactly as in the per-item columns, so pooling a single item
+    changes nothing.
+    Returns the capital that pot needs today and its closing balances.
+    """
+    weights = capital_today / capital_today.sum() if capital_today.sum() > 0 else np.zeros(len(items))
+    multipliers = np.zeros(horizon)
+    for w, item in zip(weights, items):
+        flows = item["flows"]
+        k = max(flows.get("offset", 0), 0)
+        n = max(len(flows["funding_drawdowns"]), 1)
+        discount_rate = flows.get("discount_rate", flows["growth_return"])
+        multipliers += w * _calendar_vector(flow_multipliers(flows, n), min(k, horizon), horizon, 1 + discount_rate)
+    if not weights.any():
+        multipliers[:] = 1.0
+
+    growth_paths = np.cumprod(multipliers)
+    household_drawdowns = drawdowns.sum(axis=1)
+    # Solve on costs only (inflows are not pre-funded), project with the actual flows
+    capital = float(np.sum(np.maximum(household_drawdowns, 0) / growth_paths))
+    balance = growth_paths * (capital - np.cumsum(household_drawdowns / growth_paths))
+    return {
+        "capital_required": capital,
+        "separate_capital": float(capital_today.sum()),
+        "pooling_difference": float(capital_today.sum()) - capital,
+        "blended_return": multipliers - 1,
+        "balance": balance,
+    }
+
+
+def build_ledger(items):
+    """
+    Consolidated ledger for a list of {"title", "flows"} items (flows as from iter_scenario(with_flows=True)).
+    Returns the (years x items) matrices, household totals per year, the fees actually deducted (per year,
+    cumulative and over FEE_SUMMARY_YEARS) and the pooled fund.
+    """
+    horizon = max((max(i["flows"].get("offset", 0), 0) + len(i["flows"]["funding_drawdowns"]) for i in items), default=0)
+    matrices = {name: np.zeros((horizon, len(items))) for name in LEDGER_COLUMNS}
+    capital_today = np.zeros(len(items))
+    # Asset and holiday tables show fees without taking them out of the balance; only deducted fees are paid
+    deducted = np.array([bool(item["flows"]["subtract_fees"]) for item in items], dtype=float)
+    for j, item in enumerate(items):
+        columns, capital_today[j] = _item_columns(item["flows"], horizon)
+        for name in LEDGER_COLUMNS:
+            matrices[name][:, j] = columns[name]
+
+    household = {name: matrices[name].sum(axis=1) for name in LEDGER_COLUMNS}
+    household["deducted_fees"] = matrices["fees"] @ deducted
+    household["cumulative_fees"] = np.cumsum(household["deducted_fees"])
+    return {
+        "years": CURRENT_YEAR + np.arange(horizon),
+        "titles": [item["title"] for item in items],
+        "capital_today": capital_today,
+        "matrices": matrices,
+        "household": household,
+        "fees_10y": float(household["deducted_fees"][:FEE_SUMMARY_YEARS].sum()),
+        "lifetime_drawdowns": float(np.maximum(household["drawdown"], 0).sum()),
+        "pooled": pooled_fund(items, matrices["drawdown"], capital_today, horizon),
+    }
+
+
+def _rounded(values):
+    return np.round(values, 2).tolist()
+
+
+def ledger_response(ledger):
+    """Compact JSON section: one row per year for each matrix, columns in `titles` order."""
+    pooled = ledger["pooled"]
+    return {
+        "years": ledger["years"].tolist(),
+        "titles": ledger["titles"],
+        "capital_today": _rounded(ledger["capital_today"]),
+        "columns": {name: _rounded(ledger["matrices"][name]) for name in LEDGER_COLUMNS},
+        "household": {name: _rounded(values) for name, values in ledger["household"].items()},
+        "fees_10y": round(ledger["fees_10y"], 2),
+        "lifetime_drawdowns": round(ledger["lifetime_drawdowns"], 2),
+        "pooled": {
+            "capital_required": round(pooled["capital_required"], 2),
+            "separate_capital": round(pooled["separate_capital"], 2),
+            "pooling_difference": round(pooled["pooling_difference"], 2),
+            "blended_return": np.round(pooled["blended_return"], 6).tolist(),
+            "balance": _rounded(pooled["balance"]),
+        },
+    }
+
+
+def scenario_ledger(data: CompInput):
+    """Ledger for every item of a CompInput scenario."""
+    results, _ = process_scenario(data, totals_only=True, with_flows=True)
+    return build_ledger(results)
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import typing
+from typing import Any, List, Optional
+
+import orjson
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, convert_to_messages
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel
+
+from result_cache import canonical_hash
+
+# Pluggable chat model provider.
+# LLM_PROVIDER=openai (default) returns ChatOpenAI. LLM_PROVIDER=replay returns a local deterministic stand-in
+# that answers from recorded responses (LLM_RECORDINGS, JSONL keyed on the prompt) with configurable latency,
+# so the service can be load-tested offline and for free. LLM_PROVIDER=record wraps ChatOpenAI and appends
+# every response to the recordings file.
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+LLM_RECORDINGS = os.getenv("LLM_RECORDINGS", "data/llm_recordings.jsonl")
+LLM_REPLAY_LATENCY_MS = float(os.getenv("LLM_REPLAY_LATENCY_MS", "800"))
+LLM_REPLAY_JITTER_MS = float(os.getenv("LLM_REPLAY_JITTER_MS", "200"))
+LLM_REPLAY_TOKEN_MS = float(os.getenv("LLM_REPLAY_TOKEN_MS", "5"))  # per streamed chunk
+LLM_REPLAY_SEED = int(os.getenv("LLM_REPLAY_SEED", "0"))
+
+# Unrecorded prompts get this reply (a valid /api/chat_interactive action list)
+REPLAY_DEFAULT_CONTENT = os.getenv(
+    "LLM_REPLAY_DEFAULT", '[{"action": "reply", "text": "(replay) No recorded response for this prompt."}]')
+
+STREAM_CHUNK_CHARS = 16
+
+_rng = random.Random(LLM_REPLAY_SEED)  # latency jitter only; replies are deterministic
+
+
+def llm_configured(api_key: Optional[str]) -> bool:
+    """True when chat models can be created (the replay provider needs no API key)."""
+    return LLM_PROVIDER == "replay" or bool(api_key)
+
+
+def get_chat_model(model: str, temperature: float = 0.0, api_key: Optional[str] = None, **kwargs):
+    """Chat model for `model` from the configured provider."""
+    if LLM_PROVIDER == "replay":
+        return ReplayChatModel(model_name=model)
+    from langchain_openai import ChatOpenAI
+    llm = ChatOpenAI(model=model, temperature=temperature, api_key=api_key, **kwargs)
+    if LLM_PROVIDER == "record":
+        return RecordingChatModel(inner=llm, model_name=model)
+    return llm
+
+
+# --- Recordings ---
+def prompt_key(messages, schema=None) -> str:
+    """Recording key: message roles and contents (plus the structured-output schema name)."""
+    parts = [(m.type, m.content) for m in convert_to_messages(messages)]
+    return canonical_hash(parts, getattr(schema, "__name__", None))
+
+
+_recordings = {}  # path -> (mtime, {key: entry})
+_recordings_lock = threading.Lock()
+
+def load_recordings(path: str = None) -> dict:
+    """{key: entry} from a JSONL recordings file (reloaded when it changes; empty if missing)."""
+    path = path or LLM_RECORDINGS
+    if not os.path.exists(path):
+        return {}
+    mtime = os.path.getmtime(path)
+    cached = _recordings.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    entries = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                entry = orjson.loads(line)
+                entries[entry["key"]] = entry
+    _recordings[path] = (mtime, entries)
+    return entries
+
+
+def append_recording(entry: dict, path: str = None):
+    path = path or LLM_RECORDINGS
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _recordings_lock, open(path, "ab") as f:
+        f.write(orjson.dumps(entry) + b"\n")
+
+
+def placeholder(annotation):
+    """Deterministic filler value for a schema field type (used for unrecorded structured prompts)."""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        return placeholder(args[0]) if args else None
+    if origin in (list, List):
+        return []
+    if origin is dict:
+        return {}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {name: placeholder(field.annotation) for name, field in annotation.model_fields.items()}
+    if annotation is bool:
+        return False
+    if annotation in (int, float):
+        return 0
+    return "(replay)"
+
+
+# --- Replay ---
+class ReplayChatModel(BaseChatModel):
+    """Deterministic stand-in: recorded response for the prompt (or a fixed default) after a simulated latency."""
+    model_name: str = "replay"
+    latency_ms: float = LLM_REPLAY_LATENCY_MS
+    jitter_ms: float = LLM_REPLAY_JITTER_MS
+    token_ms: float = LLM_REPLAY_TOKEN_MS
+    recordings_path: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _delay(self) -> float:
+        jitter = _rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _message(self, messages) -> AIMessage:
+        entry = load_recordings(self.recordings_path).get(prompt_key(messages))
+        if entry is None:
+            return AIMessage(content=REPLAY_DEFAULT_CONTENT)
+        return AIMessage(content=entry.get("content", ""), tool_calls=entry.get("tool_calls") or [])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        content = self._message(messages).content
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            if i and self.token_ms:
+                await asyncio.sleep(self.token_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content[i:i + STREAM_CHUNK_CHARS]))
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        def structured(messages):
+            entry = load_recordings(self.recordings_path).get(prompt_key(messages, schema))
+            data = entry["structured"] if entry else placeholder(schema)
+            return schema.model_validate(data)
+
+        def invoke(messages):
+            time.sleep(self._delay())
+            return structured(messages)
+
+        async def ainvoke(messages):
+            await asyncio.sleep(self._delay())
+            return structured(messages)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+
+# --- Record ---
+class RecordingChatModel(BaseChatModel):
+    """Pass-through to a real chat model that appends every response to the recordings file."""
+    inner: Any
+    model_name: str = "record"
+    recordings_path: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "record"
+
+    def _record(self, messages, message, schema=None, structured=None):
+        entry = {"key": prompt_key(messages, schema), "model": self.model_name}
+        if structured is not None:
+            entry["structured"] = structured
+        else:
+            entry["content"] = message.content
+            if getattr(message, "tool_calls", None):
+                entry["tool_calls"] = message.tool_calls
+        append_recording(entry, self.recordings_path)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = self.inner._generate(messages, stop=stop, **kwargs)
+        self._record(messages, result.generations[0].message)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = await self.inner._agenerate(messages, stop=stop, **kwargs)
+        self._record(messages, result.generations[0].message)
+        return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        parts = []
+        async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+            parts.append(chunk.message.content if isinstance(chunk.message.content, str) else "")
+            yield chunk
+        self._record(messages, AIMessage(content="".join(parts)))
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        runnable = self.inner.with_structured_output(schema, **kwargs)
+
+        def invoke(messages):
+            result = runnable.invoke(messages)
+            self._record(messages, None, schema, result.model_dump(mode="json"))
+            return result
+
+        async def ainvoke(messages):
+            result = await runnable.ainvoke(messages)
+            self._record(messages, None, schema, result.model_dump(mode="json"))
+            return result
+
+        return RunnableLambda(invoke, afunc=ainvoke)
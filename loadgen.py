@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import copy
+import json
+import sys
+import time
+
+import httpx
+import numpy as np
+
+# Open-loop load generator.
+# Fires requests at a fixed arrival rate (not "next request when the last one returns", which hides queueing)
+# across /api/analyze, /api/chat_interactive and /api/generate_comprehensive_report, then reports achieved
+# throughput and latency percentiles per endpoint. Run the server with LLM_PROVIDER=replay to measure the
+# per-worker ceiling without calling OpenAI. Every request carries a slightly different payload (a numbered
+# question, a few dollars more income), so the response / result caches and request coalescing cannot answer
+# it; --repeat sends identical payloads instead, to measure the cache-hit path.
+#
+#   LLM_PROVIDER=replay uvicorn main:app --workers 1
+#   python loadgen.py --rps 20 --duration 30 --mix analyze=1,chat=2,report=2
+
+PERCENTILES = (50, 90, 95, 99)
+
+SCENARIO_PAYLOAD = {
+    "profile": {"p1_name": "Alex", "p1_dob": "1980-01-01", "p2_name": "Sam", "p2_dob": "1982-01-01",
+                "children": [{"name": "Emily", "dob": "2010-05-15"}]},
+    "assumptions": {"income_return": 3.5, "growth_return": 4.5, "tax_rate": 15, "inflation": 3, "fee_load": 1.1,
+                    "tax_free_age": 60},
+    "incomes": [{"name": "Stage 1", "income": 80000, "start": 60, "end": 70},
+                {"name": "Stage 2", "income": 60000, "start": 70, "end": 85, "funding_start": 55}],
+    "cars": [{"name": "Car 1", "cost": 60000, "start": 60, "cycle": 5, "holding": 2500, "apply_inflation": True}],
+    "assets": [{"name": "Boat", "cost": 100000, "start": 65, "end": 75, "holding": 5000, "resale": 30000}],
+    "travel": [{"name": "Europe", "cost": 20000, "start": 60, "end": 70}],
+    "medical": {"cost": 5000, "start": 75, "end": 95},
+}
+
+ANALYZE_PAYLOAD = {
+    "profile": {
+        "partner1_name": "Alex", "partner1_dob": "1965-05-15", "partner2_name": "Sam", "partner2_dob": "1968-08-20",
+        "wants": ["Travel Europe", "New Boat"], "dont_wants": ["Run out of money", "Be a burden"],
+        "barriers": [{"description": "Fear of market crash", "impact_percentage": 80}],
+        "eulogy_partner": "Kind.", "eulogy_child": "Present.", "eulogy_friend": "Generous.",
+    },
+    "context": {"super_balance": 800000, "cash_savings": 150000, "shares_investments": 300000},
+    "lifestyle": {
+        "life_stages": [{"name": "Early Active", "start_age": 60, "end_age": 70, "annual_income": 100000},
+                        {"name": "Late Passive", "start_age": 70, "end_age": 90, "annual_income": 80000}],
+        "cars": [{"name": "Toyota Prado", "purchase_value": 70000, "start_age": 60, "replacement_cycle": 10,
+                  "holding_cost": 2000, "end_age": 80}],
+        "travel_international": {"name": "Europe", "duration_days": 20, "cost_accom_daily": 500,
+                                 "cost_food_daily": 200, "cost_fun_daily": 200, "start_age": 65, "end_age": 75,
+                                 "flight_cost_per_person": 3000},
+        "health_buffer": {"name": "Health Buffer", "purchase_value": 5000, "purchase_timing": 60, "holding_cost": 0,
+                          "disposal_timing": 100, "disposal_value": 0},
+        "emergency_reserve": 50000,
+    },
+    "big_rocks": {
+        "primary_residence": {"current_value": 1500000, "outstanding_mortgage": 0, "holding_cost": 8000,
+                              "strategy": "Keep", "dwelling_type": "House", "location_type": "Metro",
+                              "growth_assumption": "Average"},
+        "aged_care": {"entry_age": 85, "rad_deposit": 550000, "daily_fees": 0},
+    },
+    "family": {},
+}
+
+
+def build_requests(scenario, analyze):
+    """endpoint name -> (method, path, json body)"""
+    return {
+        "analyze": ("POST", "/api/analyze", analyze),
+        "chat": ("POST", "/api/chat_interactive",
+                 {"scenario": scenario, "message": "What if we retire two years later?", "chat_history": []}),
+        "report": ("POST", "/api/generate_comprehensive_report", scenario),
+    }
+
+
+def vary(name, body, n):
+    """Copy of an endpoint body made unique by request number n (0 = unchanged)."""
+    if n == 0:
+        return body
+    body = copy.deepcopy(body)
+    if name == "chat":
+        body["message"] = f"{body['message']} (request {n})"
+    elif name == "analyze":
+        stages = body["lifestyle"]["life_stages"]
+        if stages:
+            stages[0]["annual_income"] += n
+    elif name == "report":
+        if body.get("incomes"):
+            body["incomes"][0]["income"] += n
+        else:
+            body["assumptions"]["inflation"] += n * 1e-6
+    return body
+
+
+def parse_mix(text):
+    """'analyze=1,chat=2' -> {"analyze": 1.0, "chat": 2.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def schedule(mix, rps, duration):
+    """Deterministic arrival plan: (offset seconds, endpoint) at a constant rate, endpoints interleaved by weight."""
+    names = list(mix)
+    weights = np.array([mix[n] for n in names], dtype=float)
+    weights /= weights.sum()
+    total = int(rps * duration)
+    credit = np.zeros(len(names))
+    plan = []
+    for i in range(total):
+        credit += weights
+        j = int(np.argmax(credit))
+        credit[j] -= 1
+        plan.append((i / rps, names[j]))
+    return plan
+
+
+async def run_load(base_url, mix, rps, duration, max_inflight, timeout, requests, repeat=False):
+    results = {name: {"latency": [], "errors": 0, "status": {}} for name in mix}
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+    inflight = asyncio.Semaphore(max_inflight)
+    dropped = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def fire(name, n):
+            method, path, body = requests[name]
+            body = body if repeat else vary(name, body, n)
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body)
+                status = resp.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            finally:
+                inflight.release()
+            elapsed = time.perf_counter() - start
+            r = results[name]
+            r["status"][str(status)] = r["status"].get(str(status), 0) + 1
+            if status == 200:
+                r["latency"].append(elapsed)
+            else:
+                r["errors"] += 1
+
+        tasks = []
+        t0 = time.perf_counter()
+        for n, (offset, name) in enumerate(schedule(mix, rps, duration), 1):
+            delay = t0 + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if inflight.locked():
+                dropped += 1  # client-side cap reached: the server is not keeping up
+                continue
+            await inflight.acquire()
+            tasks.append(asyncio.create_task(fire(name, n)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+
+    return {"wall_seconds": wall, "dropped": dropped, "endpoints": results}
+
+
+def summarize(run, rps):
+    rows = []
+    for name, r in run["endpoints"].items():
+        lat = np.array(r["latency"]) * 1000
+        ok = len(lat)
+        row = {"endpoint": name, "ok": ok, "errors": r["errors"], "status": r["status"],
+               "throughput_rps": ok / run["wall_seconds"] if run["wall_seconds"] else 0.0}
+        for p in PERCENTILES:
+            row[f"p{p}_ms"] = float(np.percentile(lat, p)) if ok else None
+        row["max_ms"] = float(lat.max()) if ok else None
+        rows.append(row)
+    total_ok = sum(r["ok"] for r in rows)
+    return {"target_rps": rps, "achieved_rps": total_ok / run["wall_seconds"] if run["wall_seconds"] else 0.0,
+            "dropped": run["dropped"], "wall_seconds": run["wall_seconds"], "endpoints": rows}
+
+
+def print_report(report):
+    print(f"target {report['target_rps']:.1f} rps  achieved {report['achieved_rps']:.1f} rps  "
+          f"dropped {report['dropped']}  wall {report['wall_seconds']:.1f}s")
+    header = f"{'endpoint':<10}{'ok':>7}{'err':>6}{'rps':>8}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'max':>9}"
+    print(header)
+    for row in report["endpoints"]:
+        cells = "".join(f"{row[f'p{p}_ms']:>9.0f}" if row[f"p{p}_ms"] is not None else f"{'-':>9}" for p in PERCENTILES)
+        top = f"{row['max_ms']:>9.0f}" if row["max_ms"] is not None else f"{'-':>9}"
+        print(f"{row['endpoint']:<10}{row['ok']:>7}{row['errors']:>6}{row['throughput_rps']:>8.1f}{cells}{top}")
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load test of the planner API (latencies in ms).")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target arrival rate (requests/second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of arrivals")
+    parser.add_argument("--mix", default="analyze=1,chat=2,report=2", help="Endpoint weights")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Client-side concurrency cap")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--scenario", help="CompInput JSON for chat/report (default: built-in sample)")
+    parser.add_argument("--analyze-payload", help="SystemInput JSON for analyze (default: built-in sample)")
+    parser.add_argument("--repeat", action="store_true",
+                        help="Send identical payloads (measures cache hits; default: every request is unique)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    scenario = json.load(open(args.scenario, encoding="utf-8")) if args.scenario else SCENARIO_PAYLOAD
+    analyze = json.load(open(args.analyze_payload, encoding="utf-8")) if args.analyze_payload else ANALYZE_PAYLOAD
+    requests = build_requests(scenario, analyze)
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(requests)
+    if unknown:
+        parser.error(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+    run = asyncio.run(run_load(args.base_url, mix, args.rps, args.duration, args.max_inflight, args.timeout, requests,
+                             args.repeat))
+    report = summarize(run, args.rps)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
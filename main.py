@@ -1,59 +1,88 @@
 
 import os
 import json
-from fastapi import FastAPI, Request, HTTPException, Body
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+import math
+from fastapi import FastAPI, Request, HTTPException, Body, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, ValidationError
 from typing import List, Optional
 import io
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from llm_provider import get_chat_model, llm_configured
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 import warnings
-# from weasyprint import HTML, CSS
 
-from schemas import SystemInput, SystemOutput
+from schemas import SystemInput, SystemOutput, NarrativeOutput
+from plan_builder import build_numeric_sections, numeric_summary, assemble_output
+from responses import FastJSONResponse, dumps, dumps_html, etag_matches, round_results
+from web_assets import CachedStaticFiles, StaticFingerprints, StaticPageCache, build_templates
+from result_cache import ResultCache, canonical_hash
+from governor import DEFAULT_RETRY_AFTER, LLMGovernor, Overloaded, RETRYABLE_ERRORS, SingleFlight, retry_after_hint
 
 # Load environment variables
 load_dotenv()
 
 # Initialize API Key
 api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
+if not llm_configured(api_key):
     print("WARNING: OPENAI_API_KEY not found. /api/analyze endpoint will fail.")
 
-app = FastAPI(title="Beresfords Life-First Planner")
+# Model calls are admitted by the governor (per-endpoint limits, chat ahead of analyze, retry with backoff);
+# identical requests already in flight share one result. Retries happen there, so clients use max_retries=0.
+llm_governor = LLMGovernor()
+llm_inflight = SingleFlight()
 
-# Mount Static Files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+def overloaded_error(e: Exception) -> HTTPException:
+    """503 + Retry-After for Overloaded, or for a provider error (RETRYABLE_ERRORS) still failing after the
+    governor's retries."""
+    retry_after = getattr(e, "retry_after", None) or retry_after_hint(e) or DEFAULT_RETRY_AFTER
+    detail = str(e) if isinstance(e, Overloaded) else f"The model provider is busy, please retry shortly. ({e})"
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
 
-# Setup Templates
-templates = Jinja2Templates(directory="templates")
+app = FastAPI(title="Beresfords Life-First Planner", default_response_class=FastJSONResponse)
+
+# Compress HTML/JSON/JS/CSS responses (Brotli when brotli-asgi is installed, else gzip)
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=1000, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# Mount Static Files (fingerprinted URLs are cached as immutable by browsers)
+static_fingerprints = StaticFingerprints("static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+
+# Setup Templates (bytecode cache + static_url() helper)
+templates = build_templates("templates", static_fingerprints)
+
+# Pages with no request data are rendered once and served from memory
+static_pages = StaticPageCache(templates, static_fingerprints)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.TemplateResponse("comprehensive_input.html", {"request": request})
+    return HTMLResponse(static_pages.render("comprehensive_input.html"))
 
-@app.post("/api/analyze", response_model=SystemOutput)
-async def analyze_life_plan(data: SystemInput):
+async def run_analysis(data: SystemInput, progress=None) -> SystemOutput:
     """
     The Core Logic Engine.
     Takes structured user input, injects specific Beresfords Doctrine + Dynamic Assumptions,
-    and returns a valid JSON Life Plan.
+    and returns a valid JSON Life Plan. `progress(stage)` (async, optional) is awaited as each stage starts.
     """
-    
+    async def report_stage(name):
+        if progress is not None:
+            await progress(name)
+
     # 1. Extract Dynamic Assumptions
     asm = data.assumptions
-    
-    if not api_key:
-         raise HTTPException(status_code=500, detail="Server Error: OPENAI_API_KEY not configured in .env file.")
+
+    await report_stage("pre_calc")
 
     # --- PRE-CALCULATIONS (Engineering Truth) ---
     # 1. Income Capital (Life Stages Multi-Layer)
     total_income_capital = 0
     income_details = []
+    stress_inputs = []  # cash flows of every item below, for the shock grid and household ledger
     
     # We estimate Start Year = 2026.
     p1_current_age_est = 2026 - data.profile.partner1_dob.year # Approx
@@ -63,7 +92,7 @@ async def analyze_life_plan(data: SystemInput):
         if deferral < 0: deferral = 0 
         duration = stage.end_age - stage.start_age
         
-        cap, _ = calculate_income_portfolio(
+        params = dict(
             start_year=2026, 
             duration_years=duration, 
             initial_drawdown=stage.annual_income, 
@@ -73,6 +102,8 @@ async def analyze_life_plan(data: SystemInput):
             p1_age=stage.start_age, 
             p2_age=stage.start_age 
         )
+        cap, _ = calculate_income_portfolio(**params)
+        stress_inputs.append(flow_item(stage.name, "income", params))
         total_income_capital += cap
         income_details.append(f"{stage.name}: ${cap:,.0f}")
     
@@ -80,7 +111,7 @@ async def analyze_life_plan(data: SystemInput):
     total_car_capital = 0
     car_details = []
     for car in data.lifestyle.cars:
-        cap, _ = calculate_asset_portfolio(
+        params = dict(
             start_year=2026,
             duration_years=30, # Life expectancy duration
             purchase_value=car.purchase_value,
@@ -91,6 +122,8 @@ async def analyze_life_plan(data: SystemInput):
             income_return=0.035, growth_return=0.045, tax_rate=0.15, fee_rate=0.011,
             p1_age=p1_current_age_est, p2_age=0
         )
+        cap, _ = calculate_asset_portfolio(**params)
+        stress_inputs.append(flow_item(car.name, "asset", params))
         total_car_capital += cap
         car_details.append(f"{car.name}: ${cap:,.0f}")
         
@@ -105,7 +138,7 @@ async def analyze_life_plan(data: SystemInput):
             start_delay = toy.purchase_timing - p1_current_age_est
             if start_delay < 0: start_delay = 0
             
-            cap, _ = calculate_asset_portfolio(
+            params = dict(
                 start_year=2026 + start_delay,
                 duration_years=duration,
                 purchase_value=toy.purchase_value,
@@ -117,6 +150,8 @@ async def analyze_life_plan(data: SystemInput):
                 p1_age=toy.purchase_timing, p2_age=0,
                 sell_at_end=True
             )
+            cap, _ = calculate_asset_portfolio(**params)
+            stress_inputs.append(flow_item(name, "asset", params, offset=start_delay, discount_rate=0.06))
             # Discount back to 2026
             pv_factor = (1.06) ** -start_delay
             cap_pv = cap * pv_factor
@@ -141,7 +176,7 @@ async def analyze_life_plan(data: SystemInput):
         if delay < 0: delay = 0
         
         # Calculate for that future block
-        cap_fut, _ = calculate_holiday_portfolio(
+        params = dict(
             start_year=2026 + delay,
             duration_years=dur,
             daily_cost_total=total_trip,
@@ -150,6 +185,9 @@ async def analyze_life_plan(data: SystemInput):
             inflation=asm.general_inflation / 100.0,
             income_return=0.035, growth_return=0.045, tax_rate=0.15, fee_rate=0.011
         )
+        cap_fut, _ = calculate_holiday_portfolio(**params)
+        if cap_fut > 0:
+            stress_inputs.append(flow_item(t_obj.name, "holiday", params, offset=delay, discount_rate=0.06))
         # Discount PV
         pv = cap_fut * ((1.06) ** -delay)
         return pv, f"{t_obj.name}: ${pv:,.0f}"
@@ -177,7 +215,7 @@ async def analyze_life_plan(data: SystemInput):
         delay = med.purchase_timing - p1_current_age_est
         if delay < 0: delay = 0
         
-        cap_fut, _ = calculate_holiday_portfolio(
+        params = dict(
             start_year=2026 + delay,
             duration_years=dur,
             daily_cost_total=med.purchase_value, # Annual cost
@@ -185,9 +223,45 @@ async def analyze_life_plan(data: SystemInput):
             inflation=asm.general_inflation / 100.0,
             income_return=0.045, growth_return=0.005, tax_rate=0.15, fee_rate=0.011 # Conservative for health
         )
+        cap_fut, _ = calculate_holiday_portfolio(**params)
+        stress_inputs.append(flow_item("Medical", "holiday", params, offset=delay, discount_rate=0.05))
         pv = cap_fut * ((1.05) ** -delay) # Lower discount for health
         total_health_capital += pv
 
+    # 6. Sustainable Spend: income capital is linear in annual_income, so what the investable assets
+    # can actually fund is a closed-form scale of the planned stage incomes
+    sustainable_spend_line = ""
+    available_capital = data.context.total_investable
+    if available_capital > 0 and total_income_capital > 0:
+        other_capital = total_car_capital + total_toy_capital + total_hol_capital + total_health_capital
+        spend_scale = scale_for_budget(available_capital, other_capital, total_income_capital)
+        stage_incomes = ', '.join(f"{st.name}: ${st.annual_income * spend_scale:,.0f}/yr" for st in data.lifestyle.life_stages)
+        sustainable_spend_line = (
+            f"- **Available Capital (Investable):** ${available_capital:,.2f}\n"
+            f"    - **Max Sustainable Life-Stage Income:** {spend_scale:.0%} of planned ({stage_incomes})\n"
+        )
+
+    # 7. Shock Grid: a -30% market drop / 3-year growth stall placed at every possible year
+    shock_report = stress_items(stress_inputs, p1_current_age=p1_current_age_est)
+    shock_lines = "\n".join(
+        f"      - **{entry['label'].capitalize()}:** worst in {entry['household']['worst_year']} "
+        f"(age {entry['household']['worst_age']}), +${entry['household']['worst_extra_capital']:,.2f} capital needed"
+        for entry in shock_report
+    )
+
+    # 8. Household Ledger: fees and funded spending summed over the same cash flows
+    household_ledger = build_ledger(stress_inputs)
+
+    # 9. Numeric Output Sections: built in code, the LLM only writes the narrative
+    precalc = {
+        "income": total_income_capital, "income_details": income_details,
+        "cars": total_car_capital, "cars_details": car_details,
+        "toys": total_toy_capital, "toys_details": toy_details,
+        "travel": total_hol_capital, "travel_details": hol_details,
+        "health": total_health_capital,
+    }
+    numeric_sections = build_numeric_sections(data, precalc, stress_inputs, household_ledger)
+
     pre_calc_summary = f"""
     ### ENGINEERED FINANCIAL TRUTH (PRE-CALCULATED):
     - **Income Capital (Life Stages):** ${total_income_capital:,.2f}
@@ -198,8 +272,16 @@ async def analyze_life_plan(data: SystemInput):
     - **Health & Medical Capital:** ${total_health_capital:,.2f}
     
     - **Total Core Capital Needed:** ${(total_income_capital + total_car_capital + total_toy_capital + total_hol_capital + total_health_capital):,.2f}
-    
-    USE THESE EXACT NUMBERS in the 'Capital Requirements' section of the output. 
+    {sustainable_spend_line}
+    - **Market Shock Resilience (Deterministic Grid):**
+{shock_lines}
+    - **Estimated Fees Deducted (first {FEE_SUMMARY_YEARS} years):** ${household_ledger['fees_10y']:,.2f}
+    - **Total Life Funded Value (lifetime spending):** ${household_ledger['lifetime_drawdowns']:,.2f}
+
+    USE THESE EXACT NUMBERS in the narrative.
+
+    ### COMPUTED PLAN SECTIONS (already final, attached to the plan in code):
+{numeric_summary(numeric_sections)}
     """
 
 
@@ -225,11 +307,11 @@ async def analyze_life_plan(data: SystemInput):
         - This summary will be passed to the Strategist to design the financial solution.
         """
         
-        llm = ChatOpenAI(model="gpt-4-turbo", temperature=0.7, api_key=api_key) # Use fast/smart model for reasoning
-        # llm = ChatOpenAI(model="gpt-5.2-2025-12-11", temperature=0.7, api_key=api_key) # Using user's pref model
+        llm = get_chat_model("gpt-4-turbo", temperature=0.7, api_key=api_key, max_retries=0) # Use fast/smart model for reasoning
+        # llm = get_chat_model("gpt-5.2-2025-12-11", temperature=0.7, api_key=api_key) # Using user's pref model
         
         msg = [SystemMessage(content="You are an empathetic expert human profiler."), HumanMessage(content=theme_prompt)]
-        resp = llm.invoke(msg)
+        resp = await llm_governor.call("analyze", lambda: llm.ainvoke(msg))
         return resp.content
 
 
@@ -264,75 +346,171 @@ You are not a financial planner; you are a Life Architect.
 1.  **Synthesize:** Combine the emotional "Life Theme" with the cold "Engineered Truth". 
     *   *Example:* "Your desire for 'Freedom' (Theme) is currently underfunded by $200k (Truth). We must adjust the Boat purchase..."
 2.  **Gap Analysis:** If Starting Capital < Required Capital, be BRUTALLY HONEST but provide the trade-off.
-3.  **Tables:** You MUST populate the `lifeline_register` with the exact items from the Engineered Truth.
+3.  **Numbers:** Capital requirements, the Two Numbers, bucket targets/funding/gaps, fees and the assumptions log are
+    already computed (see COMPUTED PLAN SECTIONS). Do not restate them as new figures; explain them.
 
 ### OUTPUT FORMAT
-Strictly `SystemOutput` schema.
+Strictly `NarrativeOutput` schema (narrative fields only).
 """
 
-    try:
-        # EXECUTE PIPELINE
-        
-        # Step 1: Why
-        life_theme = await run_life_theme_analysis(data)
-        
-        # Step 2: What (Done above in Pre-Calc)
-        
-        # Step 3: How (Synthesis)
-        final_prompt = system_prompt.replace("{life_theme}", life_theme)
-        
-        # Using specific model version for stability
-        llm = ChatOpenAI(model="gpt-5.2-2025-12-11", temperature=0.7, api_key=api_key)
-        
-        # Enforce Structured Output
-        structured_llm = llm.with_structured_output(SystemOutput)
-        
-        # Invoke the chain
-        messages = [
-            SystemMessage(content=final_prompt),
-            HumanMessage(content=f"Generate the Beresfords Life-First Plan based on the PROCESSED data below:\n\nUser JSON:\n{data.model_dump_json()}")
-        ]
-        
-        result_parsed = structured_llm.invoke(messages)
+    # EXECUTE PIPELINE
+    
+    # Step 1: Why
+    await report_stage("life_theme")
+    life_theme = await run_life_theme_analysis(data)
+    
+    # Step 2: What (Done above in Pre-Calc)
+    
+    # Step 3: How (Synthesis)
+    await report_stage("synthesis")
+    final_prompt = system_prompt.replace("{life_theme}", life_theme)
+    
+    # Using specific model version for stability
+    llm = get_chat_model("gpt-5.2-2025-12-11", temperature=0.7, api_key=api_key, max_retries=0)
+    
+    # Enforce Structured Output (narrative only; numeric sections are merged in below)
+    structured_llm = llm.with_structured_output(NarrativeOutput)
+    
+    # Invoke the chain
+    messages = [
+        SystemMessage(content=final_prompt),
+        HumanMessage(content=f"Generate the Beresfords Life-First Plan based on the PROCESSED data below:\n\nUser JSON:\n{data.model_dump_json()}")
+    ]
+    
+    narrative = await llm_governor.call("analyze", lambda: structured_llm.ainvoke(messages))
+    
+    if not narrative:
+         raise ValueError("Empty response from LLM")
         
-        if not result_parsed:
-             raise ValueError("Empty response from LLM")
-            
-        return result_parsed
+    return assemble_output(numeric_sections, narrative)
+
+
+@app.post("/api/analyze", response_model=SystemOutput)
+async def analyze_life_plan(data: SystemInput):
+    """Run the full analysis in the request (see /api/analyze/jobs for the background version)."""
+    if not llm_configured(api_key):
+         raise HTTPException(status_code=500, detail="Server Error: OPENAI_API_KEY not configured in .env file.")
+
+    try:
+        # A repeated submit of the same plan while the first is running waits for that one
+        return await llm_inflight.do(canonical_hash("analyze", data), lambda: run_analysis(data))
 
+    except (Overloaded, *RETRYABLE_ERRORS) as e:
+        raise overloaded_error(e)
     except Exception as e:
         print(f"Error in analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# @app.post("/api/pdf")
-# async def generate_pdf(
-#     html_content: str = Body(...),
-#     css_content: str = Body(...)
-# ):
-#     try:
-#         # Create a PDF in memory
-#         pdf_file = io.BytesIO()
-        
-#         # WeasyPrint conversion
-#         html = HTML(string=html_content)
-#         css = CSS(string=css_content)
-#         html.write_pdf(target=pdf_file, stylesheets=[css])
-        
-#         pdf_file.seek(0)
-        
-#         return StreamingResponse(
-#             pdf_file, 
-#             media_type="application/pdf",
-#             headers={"Content-Disposition": "attachment; filename=Beresfords_Life_Strategy.pdf"}
-#         )
-#     except Exception as e:
-#         print(f"PDF Generation Error: {str(e)}")
-#         raise HTTPException(status_code=500, detail=str(e))
+# --- Background Analysis Jobs ---
+# POST /api/analyze/jobs returns a job id at once and a worker runs the same pipeline off the request.
+# Poll GET /api/analyze/jobs/{id} (or subscribe to .../events, Server-Sent Events with each stage), then
+# fetch .../result; finished plans stay downloadable for JOB_RESULT_TTL. Resubmitting the same input returns
+# the existing job. A job that finds the provider busy is re-queued with backoff (status "queued", stage
+# "retrying") and only fails after JOB_MAX_ATTEMPTS runs.
+from jobs import JobQueue
+
+async def analyze_job(payload: dict, progress):
+    output = await run_analysis(SystemInput.model_validate(payload), progress)
+    return output.model_dump_json().encode("utf-8")
+
+analysis_jobs = JobQueue({"analyze": analyze_job}, retryable=(Overloaded, *RETRYABLE_ERRORS))
+
+@app.on_event("startup")
+async def start_analysis_jobs():
+    await analysis_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_analysis_jobs():
+    await analysis_jobs.stop()
+
+def job_response(job: dict) -> dict:
+    base = f"/api/analyze/jobs/{job['job_id']}"
+    return {**job, "poll_url": base, "events_url": f"{base}/events", "result_url": f"{base}/result",
+            "pdf_url": f"{base}/pdf"}
+
+@app.post("/api/analyze/jobs", status_code=202)
+async def submit_analysis_job(data: SystemInput):
+    if not llm_configured(api_key):
+         raise HTTPException(status_code=500, detail="Server Error: OPENAI_API_KEY not configured in .env file.")
+    job, created = await analysis_jobs.submit("analyze", data.model_dump(mode="json"), key=canonical_hash("analyze", data))
+    return job_response(job)
+
+@app.get("/api/analyze/jobs/{job_id}")
+async def analysis_job_status(job_id: str):
+    job = await analysis_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job_response(job)
+
+@app.get("/api/analyze/jobs/{job_id}/result", response_model=SystemOutput)
+async def analysis_job_result(job_id: str):
+    job = await analysis_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if job["status"] == "error":
+        raise HTTPException(status_code=500, detail=job.get("error"))
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']} ({job['stage'] or 'waiting'})")
+    # Stored as the serialized SystemOutput: sent as-is
+    return Response(content=await analysis_jobs.result(job_id), media_type="application/json")
+
+@app.get("/api/analyze/jobs/{job_id}/events")
+async def analysis_job_events(job_id: str):
+    if await analysis_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    async def stream():
+        async for job in analysis_jobs.events(job_id):
+            yield b"event: status\ndata: " + dumps(job_response(job)) + b"\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- PDF Export ---
+# Rendered server-side from the plan itself (pdf_export.py): WeasyPrint in a process pool, cached by plan hash.
+from pdf_export import PDF_FILENAME, PdfRenderError, PdfRenderer, PdfUnavailable, iter_chunks
+
+pdf_renderer = PdfRenderer(templates)
+
+@app.on_event("shutdown")
+async def stop_pdf_workers():
+    pdf_renderer.shutdown()
+
+async def pdf_response(request: Request, plan: SystemOutput):
+    try:
+        key, pdf = await pdf_renderer.render(plan)
+    except PdfUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except PdfRenderError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache",
+               "Content-Disposition": f"attachment; filename={PDF_FILENAME}"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Length"] = str(len(pdf))
+    return StreamingResponse(iter_chunks(pdf), media_type="application/pdf", headers=headers)
+
+@app.post("/api/pdf")
+async def generate_pdf(request: Request, plan: SystemOutput):
+    """PDF of a plan returned by /api/analyze (the SystemOutput JSON, not HTML)."""
+    return await pdf_response(request, plan)
+
+@app.get("/api/analyze/jobs/{job_id}/pdf")
+async def analysis_job_pdf(request: Request, job_id: str):
+    """PDF of a finished analysis job, straight from the stored result."""
+    job = await analysis_jobs.get(job_id)
+    if job is None or job["status"] != "done":
+        raise HTTPException(status_code=404 if job is None else 409, detail="No finished plan for this job")
+    return await pdf_response(request, SystemOutput.model_validate_json(await analysis_jobs.result(job_id)))
 
 from langchain_core.tools import tool
 from langchain.agents import create_agent
 from calculations import calculate_income_portfolio, calculate_asset_portfolio, calculate_holiday_portfolio
 from pydantic import BaseModel
+from tool_results import store_table, get_table, table_markdown, select_rows, table_summary, collect_tables, ThreadToolMemo
+from starlette.concurrency import run_in_threadpool
 
 # --- Define Tools for LangChain ---
 @tool
@@ -410,13 +588,14 @@ def tool_income_portfolio(
         )
         table_rows.append(line)
         
-    table_str = "\n".join(table_rows)
+    title = f"### {name} ({portfolio_type}) - Stage Duration {duration_years}y (Defer: {defer_years}y)"
+    handle = store_table("income", title, table_rows[:2], table_rows[2:], [row['Year'] for row in data])
     
     summary = (
-        f"### {name} ({portfolio_type}) - Stage Duration {duration_years}y (Defer: {defer_years}y)\n"
+        f"{title}\n"
         f"**Required Starting Capital:** ${start_capital:,.0f}\n"
-        f"**Parameters:** Inc Return {inc_ret*100:.2f}%, Growth {gr_ret*100:.2f}%, Tax {tax_rate*100:.2f}%, Fees {fee_rate*100:.2f}%, Inflation {inflation*100:.2f}%\n\n"
-        f"{table_str}"
+        f"**Parameters:** Inc Return {inc_ret*100:.2f}%, Growth {gr_ret*100:.2f}%, Tax {tax_rate*100:.2f}%, Fees {fee_rate*100:.2f}%, Inflation {inflation*100:.2f}%\n"
+        f"{table_summary(handle, [row['Year'] for row in data], [row['Closing Balance'] for row in data])}"
     )
     
     return summary
@@ -503,13 +682,14 @@ def tool_asset_portfolio(
         )
         table_rows.append(line)
         
-    table_str = "\n".join(table_rows)
+    title = f"### Asset Portfolio ({name}) - {portfolio_type}"
+    handle = store_table("asset", title, table_rows[:2], table_rows[2:], [row['Year'] for row in data])
     
     return (
-        f"### Asset Portfolio ({name}) - {portfolio_type}\n"
+        f"{title}\n"
         f"**Required Starting Capital:** ${capital:,.0f}\n"
-        f"**Assumptions:** Inf {inflation*100:.2f}%, Inc {inc_ret*100:.2f}%, Growth {gr_ret*100:.2f}%, Sell at End: {sell_at_end}\n\n"
-        f"{table_str}"
+        f"**Assumptions:** Inf {inflation*100:.2f}%, Inc {inc_ret*100:.2f}%, Growth {gr_ret*100:.2f}%, Sell at End: {sell_at_end}\n"
+        f"{table_summary(handle, [row['Year'] for row in data], [row['Closing Balance'] for row in data])}"
     )
 
 @tool
@@ -554,15 +734,30 @@ def tool_holiday_portfolio(start_year: int, duration: int, total_trip_cost: floa
         )
         table_rows.append(line)
         
-    table_str = "\n".join(table_rows)
+    title = "### Holiday Portfolio (Travel) - Balanced"
+    handle = store_table("holiday", title, table_rows[:2], table_rows[2:], [row['Year'] for row in df])
 
     return (
-        f"### Holiday Portfolio (Travel) - Balanced\n"
+        f"{title}\n"
         f"**Required Starting Capital:** ${capital:,.0f}\n"
-        f"**Parameters:** Freq {frequency}y, Cost ${total_trip_cost:,.0f}, Inf {inflation*100:.2f}%\n\n"
-        f"{table_str}"
+        f"**Parameters:** Freq {frequency}y, Cost ${total_trip_cost:,.0f}, Inf {inflation*100:.2f}%\n"
+        f"{table_summary(handle, [row['Year'] for row in df], [row['Closing Balance'] for row in df])}"
     )
 
+@tool
+def tool_table_rows(handle: str, start_year: Optional[int] = None, end_year: Optional[int] = None):
+    """
+    Returns specific rows of a table produced by a portfolio tool (by its handle).
+    Use this to answer questions about particular years (e.g. "balance in 2040") without showing the whole table.
+    start_year / end_year are inclusive; at most 15 rows are returned.
+    """
+    entry = get_table(handle)
+    if entry is None:
+        return f"Error: no table with handle {handle} (re-run the portfolio tool)."
+    rows, matched = select_rows(entry, start_year, end_year)
+    note = f"\n(Showing {len(rows)} of {matched} matching rows; narrow the year range for more.)" if matched > len(rows) else ""
+    return f"{entry['title']}\n" + table_markdown(entry, rows) + note
+
 @tool
 def tool_project_age(current_age: int, start_year: int, target_age: int):
     """
@@ -596,26 +791,38 @@ class ChatRequest(BaseModel):
     thread_id: Optional[str] = None
 
 # --- Agent Helpers ---
-tools = [tool_income_portfolio, tool_asset_portfolio, tool_holiday_portfolio, tool_project_age, tool_calculator]
+tools = [tool_income_portfolio, tool_asset_portfolio, tool_holiday_portfolio, tool_table_rows, tool_project_age, tool_calculator]
 
 # Global Checkpointer (In-Memory for now)
 from langgraph.checkpoint.memory import MemorySaver
 memory_saver = MemorySaver()
 
+# Independent tool calls of one model step run concurrently in a pool of this size;
+# repeated calls within a thread are answered from the per-thread memo
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "8"))
+tool_memo = ThreadToolMemo()
+agent_graph = None
+
 def get_agent_graph():
-    if not api_key:
+    global agent_graph
+    if not llm_configured(api_key):
         raise ValueError("OpenAI API Key missing")
+    if agent_graph is not None:
+        return agent_graph
         
-    llm = ChatOpenAI(model="gpt-5.2-2025-12-11", temperature=0, api_key=api_key)
+    llm = get_chat_model("gpt-5.2-2025-12-11", temperature=0, api_key=api_key, max_retries=0)
     
     system_prompt = (
         "You are the Beresfords Life Planner Assistant. You have access to precise financial calculation tools.\n"
         "1. **Always use tools** to calculate numbers. Do not guess.\n"
         "2. **Age & Date Math**: Use `tool_project_age` to solve 'Until Age X' queries. Use `tool_calculator` for adding durations (e.g. Stage 3 Deferral = Stage 1 + Stage 2 durations).\n"
         "3. **Ask Questions**: If the user's request is vague, ask for the missing details properly.\n"
-        "4. **Table Output**: ALWAYS display the full table returned by the tool.\n"
+        "4. **Table Output**: Portfolio tools return a summary and a table handle. To show a table, put its marker "
+        "(e.g. [[table:0123456789abcdef]]) on its own line; the full table is rendered for the user. Never copy table rows "
+        "yourself. Use `tool_table_rows` to look up specific years.\n"
         "5. **Multi-Stage Income**: If user mentions 'Stage 2/3', calculate the `defer_years` accurately using the durations of identifying previous stages.\n"
         "6. **Asset Logic**: If user implies selling the asset at the end, use 'sell_at_end=True'.\n"
+        "7. **Parallel Calls**: Request independent calculations (e.g. every stage and asset of a plan) together in one step; they run in parallel.\n"
         "Assume Start Year is 2026 unless specified."
     )
     
@@ -624,15 +831,26 @@ def get_agent_graph():
         model=llm,
         tools=tools,
         system_prompt=system_prompt,
+        middleware=[tool_memo],
         checkpointer=memory_saver
     )
+    agent_graph = graph
     return graph
 
 # --- Routes ---
 
+@app.get("/api/table/{handle}")
+async def table_endpoint(handle: str):
+    """Full projection table behind an agent table handle."""
+    entry = get_table(handle)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired table handle")
+    return FastJSONResponse({"handle": handle, "title": entry["title"], "markdown": table_markdown(entry),
+                             "years": entry["years"]})
+
 @app.get("/chat", response_class=HTMLResponse)
 async def chat_page(request: Request):
-    return templates.TemplateResponse("chat.html", {"request": request})
+    return HTMLResponse(static_pages.render("chat.html"))
 
 @app.post("/api/chat_message")
 async def chat_message_endpoint(req: ChatRequest):
@@ -642,17 +860,21 @@ async def chat_message_endpoint(req: ChatRequest):
         # Use provided thread_id or default to a generic one (but treating generic as shared is risky)
         # Ideally, frontend generates a UUID on load.
         thread_id = req.thread_id or "default_session"
-        config = {"configurable": {"thread_id": thread_id}}
+        config = {"configurable": {"thread_id": thread_id}, "max_concurrency": AGENT_TOOL_WORKERS}
         
-        # Input: list of messages
+        # Input: list of messages (graph runs off the event loop; its tool node fans out to the worker pool)
         inputs = {"messages": [{"role": "user", "content": req.message}]}
-        final_state = graph.invoke(inputs, config=config)
+        async with llm_governor.slot("agent"):
+            final_state = await run_in_threadpool(graph.invoke, inputs, config=config)
         
         # Output: state dict with 'messages'
         messages = final_state.get("messages", [])
         if messages:
             last_msg = messages[-1]
-            return {"response": last_msg.content}
+            # Tables produced or referenced this turn are sent alongside the reply, not through the model
+            turn_start = max((i for i, m in enumerate(messages) if m.type == "human"), default=0)
+            tables = collect_tables(*(m.content for m in messages[turn_start:] if m.type in ("tool", "ai")))
+            return {"response": last_msg.content, "tables": tables}
         else:
             return {"response": "No response generated."}
             
@@ -662,561 +884,183 @@ async def chat_message_endpoint(req: ChatRequest):
 
 # --- Comprehensive Planner Routes ---
 
-# --- Comprehensive Planner Routes & Logic ---
-
-class CompProfile(BaseModel):
-    p1_name: str
-    p1_dob: str
-    p2_name: str
-    p2_dob: str
-    children: List[dict] = []  # [{"name": "Emily", "dob": "2010-05-15"}, ...]
-
-class CompAssumptions(BaseModel):
-    income_return: float
-    growth_return: float
-    tax_rate: float
-    inflation: float
-    fee_load: float
-    tax_free_age: Optional[int] = None  # Age after which tax drops to 0%
-
-class CompItem(BaseModel):
-    name: str
-    income: Optional[float] = 0
-    start: Optional[int] = 0
-    end: Optional[int] = 0
-    cost: Optional[float] = 0
-    cycle: Optional[int] = 0
-    holding: Optional[float] = 0
-    resale: Optional[float] = 0
-    tradein: Optional[float] = 0  # Trade-in value for cars/assets
-    type: Optional[str] = None
-    funding_start: Optional[int] = None # Age to start funding (if different from start age)
-    apply_inflation: Optional[bool] = True
-    portfolio: Optional[str] = None  # "conservative"/"balanced"/"growth"/None=auto
-    # Per-item overrides (None = use global assumption)
-    income_return: Optional[float] = None
-    growth_return: Optional[float] = None
-    tax_rate: Optional[float] = None
-    fee_load: Optional[float] = None
-
-class CompInput(BaseModel):
-    profile: CompProfile
-    assumptions: CompAssumptions
-    incomes: List[CompItem]
-    cars: List[CompItem]
-    assets: List[CompItem]
-    travel: List[CompItem]
-    medical: dict
-    universal_fund_age: Optional[int] = None
-
-# --- Portfolio Presets ---
-PORTFOLIO_PRESETS = {
-    "conservative": {"income_return": 4.5, "growth_return": 0.5},
-    "balanced":     {"income_return": 3.5, "growth_return": 4.5},
-    "growth":       {"income_return": 2.5, "growth_return": 6.5},
-}
-
-def resolve_item_returns(item, global_asm: CompAssumptions, duration: int):
-    """Resolve income_return, growth_return, tax_rate, fee_load for an item.
-    Priority: item-level override > item.portfolio preset > auto-default by duration > global assumptions.
-    Auto-default: >15yr=growth, 5-15yr=balanced, <5yr=conservative
-    """
-    ir = global_asm.income_return
-    gr = global_asm.growth_return
-    tax = global_asm.tax_rate
-    fee = global_asm.fee_load
-
-    # Determine portfolio
-    portfolio = getattr(item, 'portfolio', None) if hasattr(item, 'portfolio') else None
-    if not portfolio:
-        if duration > 14:
-            portfolio = "growth"
-        elif duration >= 6:
-            portfolio = "balanced"
-        else:
-            portfolio = "conservative"
-
-    if portfolio in PORTFOLIO_PRESETS:
-        ir = PORTFOLIO_PRESETS[portfolio]["income_return"]
-        gr = PORTFOLIO_PRESETS[portfolio]["growth_return"]
-
-    # Per-item overrides take highest priority
-    item_ir = getattr(item, 'income_return', None) if hasattr(item, 'income_return') else None
-    item_gr = getattr(item, 'growth_return', None) if hasattr(item, 'growth_return') else None
-    item_tax = getattr(item, 'tax_rate', None) if hasattr(item, 'tax_rate') else None
-    item_fee = getattr(item, 'fee_load', None) if hasattr(item, 'fee_load') else None
-    
-    if item_ir is not None: ir = item_ir
-    if item_gr is not None: gr = item_gr
-    if item_tax is not None: tax = item_tax
-    if item_fee is not None: fee = item_fee
+# Models + scenario engine live in engine.py (importable without the web/LLM stack)
+from engine import CompProfile, CompAssumptions, CompItem, CompInput, PORTFOLIO_PRESETS, resolve_item_returns, ScenarioTimeline, iter_scenario, process_scenario
 
-    return ir, gr, tax, fee, portfolio
+@app.get("/comprehensive", response_class=HTMLResponse)
+async def comp_page(request: Request):
+    return HTMLResponse(static_pages.render("comprehensive_input.html"))
 
-def process_scenario(data: CompInput):
-    """
-    Central logic to process the CompInput scenario and return results + total capital.
-    Now supports: per-item portfolio, inflate-from-current-age, universal fund age, child ages.
-    """
-    # 1. Parse Profile & Ages
-    p1_birth_year = int(data.profile.p1_dob.split("-")[0]) 
-    p2_birth_year = int(data.profile.p2_dob.split("-")[0]) if data.profile.p2_dob else p1_birth_year
-    current_year = 2026
-    p1_current_age = current_year - p1_birth_year
-    p2_current_age = current_year - p2_birth_year
-    
-    # Parse children info
-    children_info = []
-    for child in data.profile.children:
-        child_birth_year = int(child.get("dob", "2000-01-01").split("-")[0])
-        children_info.append({
-            "name": child.get("name", "Child"),
-            "birth_year": child_birth_year,
-            "current_age": current_year - child_birth_year
-        })
-    
-    results = []
-    asm = data.assumptions
-    
-    # Helper: Resolve fund_age — universal overrides individual
-    def get_fund_age(item_funding_start):
-        # Universal fund age takes priority when set
-        if data.universal_fund_age is not None:
-            return data.universal_fund_age
-        if item_funding_start is not None:
-            return item_funding_start
-        return p1_current_age
-
-    # Helper: Build per-year tax schedule that drops to 0% after tax_free_age
-    def build_tax_schedule(tax_pct, p1_start_age, total_years):
-        """Returns a list of per-year tax rates (as decimals).
-        If tax_free_age is set, years where P1 age >= tax_free_age get 0% tax.
-        If tax_free_age is None, returns the flat rate for every year."""
-        rate = tax_pct / 100
-        if asm.tax_free_age is None:
-            return rate  # Return scalar — backwards compatible
-        schedule = []
-        for yr in range(total_years):
-            age_this_year = p1_start_age + yr
-            if age_this_year >= asm.tax_free_age:
-                schedule.append(0.0)
-            else:
-                schedule.append(rate)
-        return schedule
-    
-    # Helper for Chart Data - includes children ages
-    def make_chart_data(df):
-        labels = []
-        for d in df:
-            lbl = str(d['Year'])
-            if 'P1 Age' in d and 'P2 Age' in d:
-                lbl += f" ({d['P1 Age']}/{d['P2 Age']})"
-            labels.append(lbl)
-            
-        return {
-            "labels": labels,
-            "balance": [d['Closing Balance'] for d in df],
-            "drawdown": [d['Drawdown'] for d in df],
-            "table_data": df,
-            "children": children_info
-        }
-
-    # Helper: Prepend zero-balance rows from current_age to fund_age so graphs start from today
-    def prepend_prefunding_rows(df_list, fund_age_local):
-        """Prepend rows with $0 balance for years before funding starts."""
-        if fund_age_local <= p1_current_age:
-            return df_list
-        prefix = []
-        p2_base = p2_current_age if p2_current_age else p1_current_age
-        for i in range(fund_age_local - p1_current_age):
-            yr = current_year + i
-            prefix.append({
-                'Year': yr, 'P1 Age': p1_current_age + i, 'P2 Age': p2_base + i,
-                'Opening Balance': 0, 'Income Return': 0, 'Tax': 0,
-                'Income Net': 0, 'Growth': 0, 'Fees': 0,
-                'Drawdown': 0, 'Closing Balance': 0
-            })
-        return prefix + df_list
-
-    # Helper: PV discount capital from fund_age back to today
-    def pv_to_today(cap_at_fund_age, growth_pct, fund_age_local):
-        """Discount capital from fund_age to present value at current age."""
-        years_back = fund_age_local - p1_current_age
-        if years_back > 0:
-            return cap_at_fund_age / ((1 + growth_pct / 100) ** years_back)
-        return cap_at_fund_age
-
-    # --- Process Incomes (Stages) ---
-    for item in data.incomes:
-        duration = item.end - item.start
-        
-        # Resolve per-item portfolio returns
-        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
-        
-        # Funding logic: start projection from fund_age
-        fund_age = get_fund_age(item.funding_start)
-        if fund_age < p1_current_age: fund_age = p1_current_age
-        fund_year = current_year + (fund_age - p1_current_age)
-        
-        # Inflate income from current age to usage age
-        years_to_inflate = item.start - p1_current_age
-        if years_to_inflate > 0:
-            inflated_income = item.income * ((1 + asm.inflation/100) ** years_to_inflate)
-        else:
-            inflated_income = item.income
-        
-        # Deferral from fund_age to start_age (capital grows, no drawdown)
-        deferral_years = item.start - fund_age
-        if deferral_years < 0: deferral_years = 0
-        
-        total_years_inc = deferral_years + duration
-        tax_sched = build_tax_schedule(tax, fund_age, total_years_inc)
-        
-        cap, df_list = calculate_income_portfolio(
-            start_year=fund_year,
-            duration_years=duration,
-            initial_drawdown=inflated_income,
-            inflation=asm.inflation / 100,
-            income_return=ir / 100,
-            growth_return=gr / 100,
-            tax_rate=tax_sched,
-            fee_rate=fee / 100,
-            p1_age=fund_age, 
-            p2_age=p2_current_age + (fund_age - p1_current_age),
-            defer_years=deferral_years
-        )
-        
-        # Prepend zero rows so graph starts from current age
-        df_list = prepend_prefunding_rows(df_list, fund_age)
-        
-        # PV discount to today for total capital calculation
-        pv = pv_to_today(cap, gr, fund_age)
-        
-        # Build details string
-        if years_to_inflate > 0:
-            details = f"${item.income:,.0f}/yr today → ${inflated_income:,.0f}/yr inflated. Start Age {item.start}. Fund Age {fund_age}"
-        else:
-            details = f"${item.income:,.0f}/yr (Start Age {item.start}). Fund Age {fund_age}"
-        
-        results.append({
-            "title": f"Income Stream: {item.name}",
-            "capital_required": pv,
-            "capital_at_fund_age": cap,
-            "fund_age": fund_age,
-            "chart_data": make_chart_data(df_list),
-            "details": details,
-            "portfolio_used": portfolio,
-            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
-        })
-
-    # --- Process Cars ---
-    for item in data.cars:
-        duration = 30  
-        
-        # Resolve per-item portfolio returns
-        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
-        
-        # Funding Logic: start projection from fund_age
-        fund_age = get_fund_age(item.funding_start)
-        if fund_age < p1_current_age: fund_age = p1_current_age
-        fund_year = current_year + (fund_age - p1_current_age)
-        
-        # Inflation Logic
-        eff_inflation = (asm.inflation / 100) if item.apply_inflation else 0.0
-        
-        # Inflate cost from current age to usage age
-        years_to_inflate = item.start - p1_current_age
-        if years_to_inflate > 0:
-            inflated_cost = item.cost * ((1 + asm.inflation/100) ** years_to_inflate)
-        else:
-            inflated_cost = item.cost
-        
-        # Use tradein if provided, else 30% of inflated cost
-        tradein_val = item.tradein if item.tradein else inflated_cost * 0.3
-        
-        # Deferral from fund_age to item start
-        defer_years_car = item.start - fund_age
-        if defer_years_car < 0: defer_years_car = 0
-        
-        total_years_car = defer_years_car + duration
-        car_tax_sched = build_tax_schedule(tax, fund_age, total_years_car)
-        
-        cap, df_list = calculate_asset_portfolio(
-            start_year=fund_year,
-            duration_years=duration,
-            purchase_value=inflated_cost,
-            replacement_cycle=item.cycle,
-            annual_holding_cost=item.holding,
-            trade_in_value=tradein_val, 
-            inflation=eff_inflation,
-            income_return=ir / 100,
-            growth_return=gr / 100,
-            tax_rate=car_tax_sched,
-            fee_rate=fee / 100,
-            p1_age=fund_age,
-            p2_age=p2_current_age + (fund_age - p1_current_age),
-            defer_years=defer_years_car
-        )
-        
-        # Prepend zero rows so graph starts from current age
-        df_list = prepend_prefunding_rows(df_list, fund_age)
-        
-        # PV discount to today
-        pv = pv_to_today(cap, gr, fund_age)
+# Rendered reports keyed by a canonical hash of (CompInput, display_mode, template version)
+report_cache = ResultCache(
+    max_bytes=int(os.getenv("REPORT_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    spill_dir=os.getenv("REPORT_CACHE_DIR") or None,
+    spill_max_bytes=int(os.getenv("REPORT_CACHE_DIR_MAX_MB", "512")) * 1024 * 1024,
+)
 
-        if years_to_inflate > 0:
-            cost_detail = f"${item.cost:,.0f} today → ${inflated_cost:,.0f} inflated"
-        else:
-            cost_detail = f"${item.cost:,.0f}"
-        
-        results.append({
-            "title": f"Vehicle: {item.name}",
-            "capital_required": pv,
-            "capital_at_fund_age": cap,
-            "fund_age": fund_age,
-            "chart_data": make_chart_data(df_list),
-            "details": f"Cost {cost_detail}/{item.cycle}y. Fund Age {fund_age}. Inflation: {item.apply_inflation}",
-            "portfolio_used": portfolio,
-            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
-        })
-
-    # --- Process Assets (Toys) ---
-    for item in data.assets:
-        duration = item.end - item.start
-        
-        # Resolve per-item portfolio returns
-        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
-        
-        fund_age = get_fund_age(item.funding_start)
-        if fund_age < p1_current_age: fund_age = p1_current_age
-        fund_year = current_year + (fund_age - p1_current_age)
-        eff_inflation = (asm.inflation / 100) if item.apply_inflation else 0.0
-        
-        # Inflate cost from current age to usage age
-        years_to_inflate = item.start - p1_current_age
-        if years_to_inflate > 0:
-            inflated_cost = item.cost * ((1 + asm.inflation/100) ** years_to_inflate)
-        else:
-            inflated_cost = item.cost
-        
-        # Deferral from fund_age to item start
-        defer_years_asset = item.start - fund_age
-        if defer_years_asset < 0: defer_years_asset = 0
-        
-        total_years_asset = defer_years_asset + duration
-        asset_tax_sched = build_tax_schedule(tax, fund_age, total_years_asset)
-        
-        cap, df_list = calculate_asset_portfolio(
-             start_year=fund_year,
-             duration_years=duration,
-             purchase_value=inflated_cost,
-             replacement_cycle=0, 
-             annual_holding_cost=item.holding,
-             trade_in_value=item.resale,
-             inflation=eff_inflation,
-             income_return=ir / 100,
-             growth_return=gr / 100,
-             tax_rate=asset_tax_sched,
-             fee_rate=fee / 100,
-             p1_age=fund_age,
-             p2_age=p2_current_age + (fund_age - p1_current_age),
-             sell_at_end=True,
-             defer_years=defer_years_asset
+@app.post("/api/generate_comprehensive_report", response_class=HTMLResponse)
+async def generate_comp_report(request: Request, data: CompInput, display_mode: str = "charts"):
+    # The report is fully deterministic in its inputs, so its hash doubles as the ETag
+    template = templates.env.get_template("report_view.html")
+    report_key = canonical_hash(data, display_mode, os.path.getmtime(template.filename), static_fingerprints.current())
+    etag = f'"{report_key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    html = report_cache.get(report_key)
+    if html is None:
+        results, total_capital = process_scenario(data)
+        html = template.render(
+            results_json=dumps_html(round_results(results)), # orjson, pre-rounded to cents
+            total_capital=total_capital,
+            profile=data.profile.model_dump(),
+            scenario_json=data.model_dump_json(), # Pass full state to frontend for interactive chat
+            display_mode=display_mode  # Pass the display mode choice
+        ).encode("utf-8")
+        report_cache.put(report_key, html)
+
+    return HTMLResponse(html, headers=headers)
+
+@app.post("/api/recalc")
+async def recalc_scenario(data: CompInput):
+    """Totals-only run for live recalculation while the input form is edited (no tables/charts)."""
+    results, total_capital = process_scenario(data, totals_only=True)
+    return FastJSONResponse({"items": round_results(results), "total_capital": round(total_capital, 2)})
+
+# Portfolio x fund-age goal seek (optimizer.py)
+from optimizer import OptimizeRequest, optimize_scenario
+
+@app.post("/api/optimize")
+async def optimize_endpoint(req: OptimizeRequest):
+    """Cheapest per-item portfolio / fund age (optionally risk-capped or with one universal fund age),
+    plus the exact capital vs. growth-asset capital Pareto frontier. result["scenario"] can be fed straight to the report."""
+    try:
+        result = optimize_scenario(
+            req.scenario,
+            universal=req.universal,
+            portfolios=req.portfolios,
+            max_portfolio=req.max_portfolio,
+            min_fund_age=req.min_fund_age,
+            max_fund_age=req.max_fund_age,
+            fund_age_step=req.fund_age_step,
+            frontier=req.frontier
         )
-        
-        # Prepend zero rows so graph starts from current age
-        df_list = prepend_prefunding_rows(df_list, fund_age)
-        
-        # PV discount to today
-        pv = pv_to_today(cap, gr, fund_age)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(result)
 
-        if years_to_inflate > 0:
-            cost_detail = f"${item.cost:,.0f} today → ${inflated_cost:,.0f} inflated"
-        else:
-            cost_detail = f"${item.cost:,.0f}"
-
-        results.append({
-            "title": f"Asset: {item.name}",
-            "capital_required": pv,
-            "capital_at_fund_age": cap,
-            "fund_age": fund_age,
-            "chart_data": make_chart_data(df_list),
-            "details": f"Buy {cost_detail} @ Age {item.start}. Fund Age {fund_age}. Inf: {item.apply_inflation}",
-            "portfolio_used": portfolio,
-            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
-        })
-
-    # --- Process Travel ---
-    for item in data.travel:
-        duration = item.end - item.start
-        if duration <= 0: continue
-        
-        # Resolve per-item portfolio returns
-        ir, gr, tax, fee, portfolio = resolve_item_returns(item, asm, duration)
-        
-        fund_age = get_fund_age(item.funding_start)
-        if fund_age < p1_current_age: fund_age = p1_current_age
-        fund_year = current_year + (fund_age - p1_current_age)
-        
-        # Inflate cost from current age to usage age
-        years_to_inflate = item.start - p1_current_age
-        if years_to_inflate > 0:
-            inflated_cost = item.cost * ((1 + asm.inflation/100) ** years_to_inflate)
-        else:
-            inflated_cost = item.cost
-        
-        # Deferral from fund_age to item start
-        defer_years_travel = item.start - fund_age
-        if defer_years_travel < 0: defer_years_travel = 0
-        
-        total_years_travel = defer_years_travel + duration
-        travel_tax_sched = build_tax_schedule(tax, fund_age, total_years_travel)
-        
-        cap, df_list = calculate_holiday_portfolio(
-            start_year=fund_year,
-            duration_years=duration,
-            daily_cost_total=inflated_cost,
-            days_per_trip=1,
-            trip_frequency_years=1,
-            inflation=asm.inflation / 100,
-            income_return=ir / 100,
-            growth_return=gr / 100,
-            tax_rate=travel_tax_sched,
-            fee_rate=fee / 100,
-            defer_years=defer_years_travel,
-            p1_age=fund_age,
-            p2_age=p2_current_age + (fund_age - p1_current_age)
-        )
-        
-        # Prepend zero rows so graph starts from current age
-        df_list = prepend_prefunding_rows(df_list, fund_age)
-        
-        # PV discount to today
-        pv = pv_to_today(cap, gr, fund_age)
+# Historical sequence backtest (backtest.py)
+from backtest import BacktestRequest, backtest_scenario, history_arrays, load_history
 
-        if years_to_inflate > 0:
-            cost_detail = f"${item.cost:,.0f}/yr today → ${inflated_cost:,.0f}/yr inflated"
-        else:
-            cost_detail = f"${item.cost:,.0f}/yr"
-
-        results.append({
-            "title": f"Travel: {item.name}",
-            "capital_required": pv,
-            "capital_at_fund_age": cap,
-            "fund_age": fund_age,
-            "chart_data": make_chart_data(df_list),
-            "details": f"{cost_detail} from Age {item.start}. Fund Age {fund_age}.",
-            "portfolio_used": portfolio,
-            "item_returns": {"income_return": ir, "growth_return": gr, "tax_rate": tax, "fee_load": fee}
-        })
-
-    # --- Process Medical ---
-    med = data.medical
-    med_cost = float(med.get('cost', 0))
-    if med_cost > 0:
-        start = int(med.get('start', 70))
-        end = int(med.get('end', 100))
-        duration = end - start
-        
-        # Medical uses the same portfolio logic
-        med_portfolio = med.get('portfolio', None)
-        if not med_portfolio:
-            if duration > 15: med_portfolio = "growth"
-            elif duration >= 5: med_portfolio = "balanced"
-            else: med_portfolio = "conservative"
-        
-        med_ir = asm.income_return
-        med_gr = asm.growth_return
-        med_tax = asm.tax_rate
-        med_fee = asm.fee_load
-        if med_portfolio in PORTFOLIO_PRESETS:
-            med_ir = PORTFOLIO_PRESETS[med_portfolio]["income_return"]
-            med_gr = PORTFOLIO_PRESETS[med_portfolio]["growth_return"]
-        # Allow per-item overrides from medical dict
-        if med.get('income_return'): med_ir = float(med['income_return'])
-        if med.get('growth_return'): med_gr = float(med['growth_return'])
-        if med.get('tax_rate') is not None: med_tax = float(med['tax_rate'])
-        if med.get('fee_load'): med_fee = float(med['fee_load'])
-        
-        fund_age = int(med.get('funding_start', get_fund_age(None)))
-        if fund_age < p1_current_age: fund_age = p1_current_age
-        fund_year = current_year + (fund_age - p1_current_age)
-        
-        # Inflate medical cost from current age to usage age
-        years_to_inflate = start - p1_current_age
-        if years_to_inflate > 0:
-            inflated_med = med_cost * ((1 + asm.inflation/100) ** years_to_inflate)
-        else:
-            inflated_med = med_cost
-        
-        # Deferral from fund_age to medical start
-        defer_years_med = start - fund_age
-        if defer_years_med < 0: defer_years_med = 0
-        
-        total_years_med = defer_years_med + duration
-        med_tax_sched = build_tax_schedule(med_tax, fund_age, total_years_med)
-        
-        cap, df_list = calculate_holiday_portfolio(
-            start_year=fund_year,
-            duration_years=duration,
-            daily_cost_total=inflated_med,
-            days_per_trip=1,
-            trip_frequency_years=1,
-            inflation=asm.inflation / 100,
-            income_return=med_ir / 100, 
-            growth_return=med_gr / 100,
-            tax_rate=med_tax_sched,
-            fee_rate=med_fee / 100,
-            defer_years=defer_years_med,
-            p1_age=fund_age,
-            p2_age=p2_current_age + (fund_age - p1_current_age)
-        )
-        
-        # Prepend zero rows so graph starts from current age
-        df_list = prepend_prefunding_rows(df_list, fund_age)
-        
-        # PV discount to today
-        pv = pv_to_today(cap, med_gr, fund_age)
-        
-        if years_to_inflate > 0:
-            cost_detail = f"${med_cost:,.0f}/yr today → ${inflated_med:,.0f}/yr inflated"
-        else:
-            cost_detail = f"${med_cost:,.0f}/yr"
-             
-        results.append({
-            "title": "Medical Buffer",
-            "capital_required": pv,
-            "capital_at_fund_age": cap,
-            "fund_age": fund_age,
-            "chart_data": make_chart_data(df_list),
-            "details": f"{cost_detail} from Age {start}. Fund Age {fund_age}.",
-            "portfolio_used": med_portfolio,
-            "item_returns": {"income_return": med_ir, "growth_return": med_gr, "tax_rate": med_tax, "fee_load": med_fee}
-        })
-
-    total_capital = sum(r['capital_required'] for r in results)
-    
-    return results, total_capital
+@app.post("/api/backtest")
+async def backtest_endpoint(req: BacktestRequest):
+    """Worst / median / success-rate capital over every rolling window of the return history
+    (inline `history` rows, else the RETURNS_HISTORY_FILE CSV)."""
+    try:
+        history = history_arrays(req.history) if req.history else load_history()
+        report = backtest_scenario(req.scenario, history, anchor=req.anchor, wrap=req.wrap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(report)
+
+# Inverse solve: maximum sustainable spend from available capital (spend_solver.py)
+from spend_solver import SpendRequest, max_sustainable_spend, scale_for_budget
+
+@app.post("/api/solve_spend")
+async def solve_spend_endpoint(req: SpendRequest):
+    """Largest life-stage income (mode="income") or uniform scaling of all costs (mode="all")
+    that the available capital fully funds. Capital comes from available_capital or context.total_investable."""
+    available = req.available_capital
+    if available is None and req.context is not None:
+        available = req.context.total_investable
+    if available is None:
+        raise HTTPException(status_code=400, detail="Provide available_capital or context")
+    try:
+        result = max_sustainable_spend(req.scenario, available, req.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(result)
+
+# Deterministic shock grid: market drop / growth stall at every possible year (stress.py)
+from stress import StressRequest, flow_item, stress_items, stress_scenario
+
+@app.post("/api/stress")
+async def stress_endpoint(req: StressRequest):
+    """Extra capital (and shortfall with only the planned capital) for each shock placed at every year,
+    per item and for the household."""
+    return FastJSONResponse(stress_scenario(req.scenario, req.shocks))
+
+# Consolidated year x item ledger (ledger.py)
+from ledger import FEE_SUMMARY_YEARS, build_ledger, ledger_response, scenario_ledger
+
+@app.post("/api/ledger")
+async def ledger_endpoint(data: CompInput):
+    """Drawdown / balance / fees / tax as year x item matrices with household totals per year,
+    cumulative fees and a pooled single-portfolio projection."""
+    return FastJSONResponse(ledger_response(scenario_ledger(data)))
+
+# Survival-weighted capital from a life table (mortality.py)
+from mortality import MortalityRequest, life_table_arrays, load_life_table, mortality_scenario
+
+@app.post("/api/mortality")
+async def mortality_endpoint(req: MortalityRequest):
+    """Expected capital per item with drawdowns weighted by P1/P2 survival (last-survivor or joint),
+    plus life expectancies and planning ages (inline `life_table` rows, else the LIFE_TABLE_FILE CSV)."""
+    try:
+        table = life_table_arrays(req.life_table) if req.life_table else load_life_table()
+        report = mortality_scenario(req.scenario, table, req.p1_sex, req.p2_sex, req.basis)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(report)
+
+# Year-by-year projection export (export.py; the CLI there handles multi-client books)
+from export import FORMATS, ExportUnavailable, check_format, iter_export, iter_rows, scenario_name
+
+@app.post("/api/export")
+async def export_endpoint(data: CompInput, format: str = "csv"):
+    """Every item's projection table as CSV, XLSX or Parquet, generated and streamed row by row."""
+    try:
+        check_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    media_type, extension = FORMATS[format]
+    rows = iter_rows([(scenario_name(data, "Scenario"), data)])
+    # Sync generator: Starlette pulls it from a worker thread, off the event loop
+    return StreamingResponse(iter_export(rows, format), media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename=projections.{extension}"})
+
+# --- Spreadsheet Import ---
+# Legacy client workbooks -> CompInput (importer.py; its CLI handles bulk runs)
+from fastapi import UploadFile
+from importer import ImportUnavailable, import_workbooks
+
+@app.post("/api/import")
+async def import_endpoint(file: UploadFile):
+    """One client workbook -> validated CompInput, its total capital and any row-level errors."""
+    content = await file.read()
+    try:
+        result = await run_in_threadpool(lambda: next(import_workbooks([(io.BytesIO(content), file.filename)])))
+    except ImportUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    # 422 when nothing usable came out of the workbook; the errors say which rows to fix
+    return FastJSONResponse(result, status_code=200 if result["scenario"] is not None else 422)
 
+# --- Interactive Chat Endpoint ---
+# Prompt, action protocol and session state live in scenario_chat.py
+from scenario_chat import (
+    build_system_prompt, parse_actions, apply_actions, ReplyStream, ScenarioSession, SessionStore,
+    ChatResponseCache, chat_cache_key, is_reply_only,
+)
 
-@app.get("/comprehensive", response_class=HTMLResponse)
-async def comp_page(request: Request):
-    return templates.TemplateResponse("comprehensive_input.html", {"request": request})
+CHAT_MODEL = "gpt-5.2-2025-12-11"
 
-@app.post("/api/generate_comprehensive_report", response_class=HTMLResponse)
-async def generate_comp_report(request: Request, data: CompInput, display_mode: str = "charts"):
-    results, total_capital = process_scenario(data)
-    
-    return templates.TemplateResponse("report_view.html", {
-        "request": request, 
-        "results": results, 
-        "total_capital": total_capital,
-        "profile": data.profile.model_dump(),
-        "scenario_json": data.model_dump_json(), # Pass full state to frontend for interactive chat
-        "display_mode": display_mode  # Pass the display mode choice
-    })
+# Reply-only answers to repeated questions (same scenario, question and recent turns) skip the LLM
+chat_cache = ChatResponseCache()
 
-# --- Interactive Chat Endpoint ---
 class ChatMessage(BaseModel):
     role: str  # "user" or "assistant"
     content: str
@@ -1226,6 +1070,21 @@ class ChatInteractiveRequest(BaseModel):
     scenario: CompInput
     chat_history: List[ChatMessage] = []
 
+def build_chat_messages(scenario: CompInput, chat_history: list, message: str):
+    """System prompt (with the live scenario) + prior turns + the new user message."""
+    messages = [SystemMessage(content=build_system_prompt(scenario))]
+    
+    # Add conversation history (keeps context across turns)
+    for msg in chat_history:
+        if msg["role"] == "user":
+            messages.append(HumanMessage(content=msg["content"]))
+        else:
+            messages.append(AIMessage(content=msg["content"]))
+    
+    # Add the current user message
+    messages.append(HumanMessage(content=message))
+    return messages
+
 @app.post("/api/chat_interactive")
 async def chat_interactive(req: ChatInteractiveRequest):
     """
@@ -1236,186 +1095,28 @@ async def chat_interactive(req: ChatInteractiveRequest):
     """
     
     current_scenario = req.scenario.model_copy(deep=True)
-    scenario_json = current_scenario.model_dump_json(indent=2)
-
-    system_prompt = f"""You are an expert Financial Planner AI assistant embedded in an interactive financial planning tool.
-You have DEEP expertise in investment strategy, retirement planning, tax optimization, and portfolio management.
-
-═══════════════════════════════════════════
-CURRENT CLIENT SCENARIO (Live State):
-═══════════════════════════════════════════
-{scenario_json}
-
-═══════════════════════════════════════════
-YOUR CAPABILITIES:
-═══════════════════════════════════════════
-
-1. ANSWER QUESTIONS intelligently about the plan:
-   - Explain how capital requirements are calculated
-   - Analyze the impact of changes before making them
-   - Compare different strategies and recommend the best approach
-   - Explain tax implications, inflation effects, and portfolio choices
-   - Calculate and explain compound growth scenarios
-   - Discuss the trade-offs between conservative vs growth portfolios
-
-2. MODIFY THE PLAN precisely using structured JSON actions (see below)
-
-3. PROVIDE PROACTIVE ADVICE:
-   - If you see a suboptimal configuration, mention it
-   - Suggest improvements (e.g., "Your medical fund starts late — consider funding from age 50 to reduce the lump sum needed")
-   - Warn about risks (e.g., "A growth portfolio for a 5-year horizon is risky")
-
-═══════════════════════════════════════════
-REASONING PROCESS (Think step by step):
-═══════════════════════════════════════════
-Before making changes, ALWAYS:
-1. Identify what the user is asking for
-2. Check the current values in the scenario JSON
-3. Determine the minimal set of changes needed
-4. Consider side effects (e.g., changing fund age affects capital required)
-5. Explain what you're doing and why in your reply
-
-═══════════════════════════════════════════
-OUTPUT FORMAT (STRICT):
-═══════════════════════════════════════════
-Return ONLY a JSON array of actions. No markdown, no code fences, just raw JSON.
-
-Available actions:
-[
-  {{"action": "reply", "text": "Your explanation here..."}},
-  {{"action": "update_assumption", "key": "inflation|income_return|growth_return|tax_rate|fee_load|tax_free_age", "value": 5.0}},
-  {{"action": "update_income", "stage_matches": "Stage 1", "field": "income|start|end|funding_start", "value": 90000}},
-  {{"action": "update_car", "name_matches": "Car", "field": "cost|start|cycle|holding|tradein|funding_start|apply_inflation", "value": 60000}},
-  {{"action": "update_item", "category": "incomes|cars|assets|travel", "name_matches": "Stage 1", "field": "tax_rate|income_return|growth_return|fee_load|portfolio|start|end|income|cost|cycle|holding|resale|tradein|funding_start|apply_inflation", "value": 0}},
-  {{"action": "update_item_portfolio", "category": "incomes|cars|assets|travel", "name_matches": "Stage 1", "portfolio": "conservative|balanced|growth"}},
-  {{"action": "update_universal_fund_age", "value": 55}},
-  {{"action": "add_child", "name": "Emily", "dob": "2010-05-15"}},
-  {{"action": "update_medical", "field": "cost|start|end|funding_start|portfolio", "value": 10000}}
-]
-
-═══════════════════════════════════════════
-CRITICAL RULES:
-═══════════════════════════════════════════
-- ALWAYS include a "reply" action explaining what you did and why
-- You can combine multiple actions in one response  
-- Portfolio options: "conservative" (4.5% income, 0.5% growth), "balanced" (3.5% income, 4.5% growth), "growth" (2.5% income, 6.5% growth)
-- tax_free_age: age after which tax on income returns drops to 0%
-- universal_fund_age: overrides ALL individual fund-from ages
-- Per-item overrides (tax_rate, income_return, growth_return, fee_load) are in PERCENTAGE points (e.g., 15 not 0.15)
-- name_matches is case-insensitive partial match (e.g., "stage 1" matches "Stage 1")
-- If user asks a question without requesting changes, return ONLY a reply action with a thorough answer
-- Reference specific numbers from the scenario when answering questions
-- Be concise but thorough in your explanations
-"""
 
     # Build message history for the LLM
-    messages = [SystemMessage(content=system_prompt)]
-    
-    # Add conversation history (keeps context across turns)
-    for msg in req.chat_history:
-        if msg.role == "user":
-            messages.append(HumanMessage(content=msg.content))
-        else:
-            messages.append(AIMessage(content=msg.content))
-    
-    # Add the current user message
-    messages.append(HumanMessage(content=req.message))
-    
-    llm = ChatOpenAI(model="gpt-5.2-2025-12-11", temperature=0.1, api_key=api_key)
-    resp = llm.invoke(messages)
-    
-    raw_response = resp.content
+    history = [m.model_dump() for m in req.chat_history]
+    messages = build_chat_messages(current_scenario, history, req.message)
+
+    cache_key = chat_cache_key(CHAT_MODEL, current_scenario, req.message, history)
+    raw_response = chat_cache.get(cache_key)
+    cached = raw_response is not None
+    if not cached:
+        llm = get_chat_model(CHAT_MODEL, temperature=0.1, api_key=api_key, max_retries=0)
+        flight_key = canonical_hash("chat", CHAT_MODEL, current_scenario, req.message, history)
+        try:
+            resp = await llm_inflight.do(flight_key, lambda: llm_governor.call("chat", lambda: llm.ainvoke(messages)))
+        except (Overloaded, *RETRYABLE_ERRORS) as e:
+            raise overloaded_error(e)
+        raw_response = resp.content
     
     try:
-        content = raw_response.replace("```json", "").replace("```", "").strip()
-        actions = json.loads(content)
-        
-        reply_text = "Changes applied."
-        
-        if isinstance(actions, dict): actions = [actions]
-        
-        for act in actions:
-            action_type = act.get("action")
-            
-            if action_type == "reply":
-                reply_text = act.get("text")
-                
-            elif action_type == "update_assumption":
-                key = act.get("key")
-                val = act.get("value")
-                if hasattr(current_scenario.assumptions, key):
-                     setattr(current_scenario.assumptions, key, val)
-                     reply_text = f"Updated assumption {key} to {val}"
-
-            elif action_type == "update_income":
-                match = act.get("stage_matches", "").lower()
-                field = act.get("field")
-                value = act.get("value")
-                for item in current_scenario.incomes:
-                    if match in item.name.lower():
-                        setattr(item, field, value)
-                        reply_text = f"Updated {item.name}: set {field} to {value}"
-
-            elif action_type == "update_car":
-                match = act.get("name_matches", "").lower()
-                field = act.get("field")
-                value = act.get("value")
-                for item in current_scenario.cars:
-                    if match in item.name.lower() or match in "car":
-                         setattr(item, field, value)
-                         reply_text = f"Updated Car: set {field} to {value}"
-
-            elif action_type == "update_item":
-                category = act.get("category", "").lower()
-                match = act.get("name_matches", "").lower()
-                field = act.get("field")
-                value = act.get("value")
-                
-                category_map = {
-                    "incomes": current_scenario.incomes,
-                    "cars": current_scenario.cars,
-                    "assets": current_scenario.assets,
-                    "travel": current_scenario.travel,
-                }
-                items = category_map.get(category, [])
-                for item in items:
-                    if match in item.name.lower():
-                        setattr(item, field, value)
-                        reply_text = f"Updated {item.name} ({category}): set {field} to {value}"
-
-            elif action_type == "update_item_portfolio":
-                category = act.get("category", "").lower()
-                match = act.get("name_matches", "").lower()
-                portfolio = act.get("portfolio")
-                
-                category_map = {
-                    "incomes": current_scenario.incomes,
-                    "cars": current_scenario.cars,
-                    "assets": current_scenario.assets,
-                    "travel": current_scenario.travel,
-                }
-                items = category_map.get(category, [])
-                for item in items:
-                    if match in item.name.lower():
-                        item.portfolio = portfolio
-                        reply_text = f"Set {item.name} portfolio to {portfolio}"
-
-            elif action_type == "update_universal_fund_age":
-                value = act.get("value")
-                current_scenario.universal_fund_age = value
-                reply_text = f"Set universal fund age to {value}"
-
-            elif action_type == "add_child":
-                name = act.get("name", "Child")
-                dob = act.get("dob", "2010-01-01")
-                current_scenario.profile.children.append({"name": name, "dob": dob})
-                reply_text = f"Added child: {name} (DOB: {dob})"
-
-            elif action_type == "update_medical":
-                field = act.get("field")
-                value = act.get("value")
-                current_scenario.medical[field] = value
-                reply_text = f"Updated medical: set {field} to {value}"
+        actions = parse_actions(raw_response)
+        reply_text = apply_actions(current_scenario, actions)
+        if not cached and is_reply_only(actions):
+            chat_cache.put(cache_key, raw_response)
 
     except Exception as e:
         print(f"Agent Error: {e}")
@@ -1425,13 +1126,122 @@ CRITICAL RULES:
     # Re-Calculate
     new_results, new_total = process_scenario(current_scenario)
     
-    return {
+    # Returned as a Response so FastAPI skips the jsonable_encoder walk over every table row
+    return FastJSONResponse({
         "reply": reply_text,
-        "new_scenario": current_scenario.model_dump(),
-        "new_results": new_results,
+        "new_scenario": current_scenario, # serialized via model_dump_json (no intermediate dict)
+        "new_results": round_results(new_results),
         "new_total": new_total,
-        "raw_response": raw_response  # For debugging
-    }
+        "raw_response": raw_response,  # For debugging
+        "cached": cached,
+    })
+
+# --- Scenario Session WebSocket ---
+# One socket per report page. The server keeps the scenario + chat history, streams the reply
+# while the LLM writes it, then pushes each recalculated item that changed.
+#
+# Client -> server: {"type": "init", "scenario": {...}, "chat_history": [...]}
+#                   {"type": "message", "message": "..."}
+# Server -> client: {"type": "ready", "resumed": bool, "scenario": {...}, "results": [...], "total": x}
+#                   {"type": "token", "text": "..."}            (partial reply text)
+#                   {"type": "reply", "text": "...", "raw_response": "...", "cached": bool}
+#                   {"type": "item", "index": i, "result": {...}}  (only items whose result changed)
+#                   {"type": "done", "new_total": x, "new_scenario": {...}, "count": n}
+#                   {"type": "error", "message": "...", "raw_response": "..."}
+chat_sessions = SessionStore(max_sessions=int(os.getenv("CHAT_SESSIONS_MAX", "256")))
+
+async def ws_send(websocket: WebSocket, payload: dict):
+    await websocket.send_text(dumps(payload).decode("utf-8"))
+
+async def run_chat_turn(websocket: WebSocket, session: ScenarioSession, message: str):
+    scenario = session.scenario.model_copy(deep=True)
+    messages = build_chat_messages(scenario, session.history, message)
+
+    cache_key = chat_cache_key(CHAT_MODEL, scenario, message, session.history)
+    raw_response = chat_cache.get(cache_key)
+    cached = raw_response is not None
+    if not cached:
+        llm = get_chat_model(CHAT_MODEL, temperature=0.1, api_key=api_key, max_retries=0)
+        stream = ReplyStream()
+        try:
+            # Streamed replies are admitted but not retried (tokens may already be on the client)
+            async with llm_governor.slot("chat"):
+                async for chunk in llm.astream(messages):
+                    delta = stream.feed(chunk.content if isinstance(chunk.content, str) else "")
+                    if delta:
+                        await ws_send(websocket, {"type": "token", "text": delta})
+        except (Overloaded, *RETRYABLE_ERRORS) as e:
+            await ws_send(websocket, {"type": "error", "message": f"The assistant is busy, please retry shortly. ({e})"})
+            return
+        raw_response = stream.raw
+
+    try:
+        actions = parse_actions(raw_response)
+        reply_text = apply_actions(scenario, actions)
+        if not cached and is_reply_only(actions):
+            chat_cache.put(cache_key, raw_response)
+    except Exception as e:
+        print(f"Agent Error: {e}")
+        print(f"Raw LLM response: {raw_response}")
+        await ws_send(websocket, {"type": "error", "message": f"Sorry, I couldn't process that. Error: {e}", "raw_response": raw_response})
+        return
+
+    session.remember(message, reply_text)
+    await ws_send(websocket, {"type": "reply", "text": reply_text, "raw_response": raw_response, "cached": cached})
+
+    # Re-Calculate in the threadpool (a large scenario would stall every socket on this worker), then push
+    # only the items that changed since the last turn
+    new_results, new_total = await run_in_threadpool(process_scenario, scenario)
+    round_results(new_results)
+    previous = session.results
+    for index, result in enumerate(new_results):
+        if index >= len(previous) or previous[index] != result:
+            await ws_send(websocket, {"type": "item", "index": index, "result": result})
+
+    session.scenario, session.results, session.total = scenario, new_results, new_total
+    await ws_send(websocket, {"type": "done", "new_total": new_total, "new_scenario": scenario, "count": len(new_results)})
+
+@app.websocket("/ws/scenario/{session_id}")
+async def scenario_socket(websocket: WebSocket, session_id: str):
+    await websocket.accept()
+    session = chat_sessions.get(session_id)
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            kind = msg.get("type")
+
+            if kind == "init":
+                # A reconnecting page resumes its session; the server copy wins
+                resumed = session is not None
+                if not resumed:
+                    try:
+                        scenario = CompInput.model_validate(msg.get("scenario"))
+                        history = [ChatMessage.model_validate(m).model_dump() for m in msg.get("chat_history") or []]
+                    except ValidationError as e:
+                        await ws_send(websocket, {"type": "error", "message": str(e)})
+                        continue
+                    # The session's first calculation runs off the event loop too
+                    session = chat_sessions.put(session_id, await run_in_threadpool(ScenarioSession, scenario, history))
+                await ws_send(websocket, {"type": "ready", "resumed": resumed, "scenario": session.scenario,
+                                          "results": session.results if resumed else None, "total": session.total})
+
+            elif kind == "message":
+                if session is None:
+                    await ws_send(websocket, {"type": "error", "message": "Send an init message first."})
+                    continue
+                async with session.lock:
+                    try:
+                        await run_chat_turn(websocket, session, msg.get("message", ""))
+                    except WebSocketDisconnect:
+                        raise
+                    except Exception as e:
+                        print(f"Agent Error: {e}")
+                        await ws_send(websocket, {"type": "error", "message": f"Sorry, I couldn't process that. Error: {e}"})
+
+            else:
+                await ws_send(websocket, {"type": "error", "message": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
 
 if __name__ == "__main__":
     import uvicorn
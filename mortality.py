@@ -0,0 +1,254 @@
+import argparse
+import csv
+import os
+import sys
+from typing import List, Literal, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from calculations import annuity_factors
+from engine import CURRENT_YEAR, CompInput, process_scenario
+
+# Mortality-weighted capital.
+# A life table (one-year death probabilities q by age) gives P1 / P2 survival curves from today; a cash flow
+# t years out is only spent while the household exists, so it is weighted by the last-survivor probability
+# (or joint-life, both alive). Capital is linear in the drawdowns, so the expected capital of an item is its
+# survival-weighted drawdowns dotted with the same discount weights — one vector product per item.
+# The open-ended streams (car replacements, medical buffer) are run out to the end of the life table rather
+# than their fixed horizons; the survival weights then decide how much of that tail is funded.
+
+# Default table: CSV with columns age, qx_male, qx_female (or a single qx column). Abridged tables (e.g. one
+# row per 5-year band) are interpolated to single ages.
+LIFE_TABLE_FILE = os.getenv("LIFE_TABLE_FILE", "data/life_table.csv")
+
+# Survival levels reported as planning ages ("10% chance someone is still alive at ...")
+SURVIVAL_LEVELS = (0.5, 0.25, 0.1)
+
+
+class LifeTableRow(BaseModel):
+    age: int
+    qx_male: Optional[float] = None
+    qx_female: Optional[float] = None
+    qx: Optional[float] = None  # unisex
+
+
+class MortalityRequest(BaseModel):
+    scenario: CompInput
+    life_table: Optional[List[LifeTableRow]] = None  # inline table; default LIFE_TABLE_FILE
+    p1_sex: Literal["male", "female", "unisex"] = "male"
+    p2_sex: Literal["male", "female", "unisex"] = "female"
+    basis: Literal["last", "joint"] = "last"         # spend while either is alive, or only while both are
+
+
+def _q_by_age(rows, key):
+    """One-year q for every age 0..last listed age: ages between rows are interpolated linearly, ages
+    before the first row take its q, and the last age is closed with q = 1. None if no row has the column."""
+    points = sorted((int(r["age"]), float(r[key])) for r in rows if r.get(key) not in (None, ""))
+    if not points:
+        return None
+    ages, qs = zip(*points)
+    if len(set(ages)) != len(ages):
+        raise ValueError(f"Life table lists an age twice in {key}")
+    q = np.interp(np.arange(ages[-1] + 1), ages, qs)
+    q[-1] = 1.0
+    return np.clip(q, 0.0, 1.0)
+
+
+def life_table_arrays(rows):
+    """Rows (dicts or LifeTableRow) -> arrays of q indexed by age 0..max, for each sex the table can serve.
+    Missing sex columns fall back to the unisex column (and vice versa); a sex with no usable column is left
+    out and only rejected when it is requested (household_survival)."""
+    rows = [r if isinstance(r, dict) else r.model_dump() for r in rows]
+    if not rows:
+        raise ValueError("Life table is empty")
+
+    columns = {}
+    table = {}
+    for sex, keys in (("male", ("qx_male", "qx")), ("female", ("qx_female", "qx")),
+                      ("unisex", ("qx", "qx_male", "qx_female"))):
+        for key in keys:
+            if key not in columns:
+                columns[key] = _q_by_age(rows, key)
+            if columns[key] is not None:
+                table[sex] = columns[key]
+                break
+    if not table:
+        raise ValueError("Life table has no q column (qx_male, qx_female or qx)")
+    return table
+
+
+_table_cache = {}  # path -> (mtime, arrays)
+
+def load_life_table(path: str = None):
+    """Read (and cache until the file changes) an age,qx_male,qx_female CSV."""
+    path = path or LIFE_TABLE_FILE
+    if not os.path.exists(path):
+        raise ValueError(f"Life table file not found: {path}")
+    mtime = os.path.getmtime(path)
+    cached = _table_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = [{k.strip().lower(): v for k, v in row.items()} for row in csv.DictReader(f)]
+    table = life_table_arrays(rows)
+    _table_cache[path] = (mtime, table)
+    return table
+
+
+def survival_curve(q, current_age, horizon):
+    """S[t] = probability of being alive t years from today (S[0] = 1), t = 0..horizon-1."""
+    ages = np.minimum(current_age + np.arange(horizon), len(q) - 1)
+    return np.concatenate([[1.0], np.cumprod(1 - q[ages])[:-1]])
+
+
+def _current_age(dob):
+    return CURRENT_YEAR - int(dob.split("-")[0]) if dob else None
+
+
+def _q_for(table, sex):
+    if sex not in table:
+        raise ValueError(f"Life table has no q column for {sex}")
+    return table[sex]
+
+
+def household_survival(profile, table, horizon, p1_sex="male", p2_sex="female"):
+    """P1 / P2 survival curves plus joint-life (both) and last-survivor (either) curves over `horizon` years."""
+    p1 = survival_curve(_q_for(table, p1_sex), _current_age(profile.p1_dob), horizon)
+    p2_age = _current_age(profile.p2_dob)
+    if p2_age is None:
+        return {"p1": p1, "p2": None, "joint": p1, "last": p1}
+    p2 = survival_curve(_q_for(table, p2_sex), p2_age, horizon)
+    return {"p1": p1, "p2": p2, "joint": p1 * p2, "last": p1 + p2 - p1 * p2}
+
+
+def life_expectancy(curve):
+    """Curtate expectation of life from a survival curve (years)."""
+    return float(curve[1:].sum())
+
+
+def weighted_capital(flows, survival):
+    """
+    Survival-weighted drawdowns and expected capital (today) for one item.
+    survival is indexed in years from today; the item's projection starts at flows["offset"].
+    """
+    k = max(flows["offset"], 0)
+    funding = np.asarray(flows["funding_drawdowns"], dtype=float)
+    n = len(funding)
+    if n == 0:
+        return np.zeros(0), 0.0, 1.0
+
+    weights = np.asarray(annuity_factors(flows["income_return"], flows["growth_return"], flows["tax_rate"],
+                                         flows["fee_rate"], flows["subtract_fees"], n))
+    alive = np.zeros(n)
+    covered = max(0, min(n, len(survival) - k))
+    alive[:covered] = survival[k:k + covered]
+
+    expected = funding * alive
+    capital = float(expected @ weights) / (1 + flows["growth_return"]) ** k
+    return expected, capital, float(alive[-1])
+
+
+def mortality_scenario(data: CompInput, table: dict, p1_sex="male", p2_sex="female", basis="last"):
+    """
+    Expected (survival-weighted) capital for every item of the scenario next to the deterministic figure,
+    with longevity figures for the household and the probability someone outlives each item's horizon.
+    Open-ended items (cars, medical) are weighted out to the end of the life table, not their fixed horizon.
+    """
+    results, planned_total = process_scenario(data, totals_only=True, with_flows=True)
+    horizon = max((max(r["flows"]["offset"], 0) + len(r["flows"]["funding_drawdowns"]) for r in results), default=1)
+    horizon = max([horizon] + [len(q) for q in table.values()])
+    curves = household_survival(data.profile, table, horizon, p1_sex, p2_sex)
+    survival = curves[basis]
+
+    # Survival curves only fall, so this is the P1 age by which the household has certainly ended
+    p1_age = _current_age(data.profile.p1_dob)
+    table_end_age = p1_age + int(np.count_nonzero(survival > 0))
+    extended, _ = process_scenario(data, totals_only=True, with_flows=True, horizon_age=table_end_age)
+
+    items = []
+    expected_total = 0.0
+    for r, e in zip(results, extended):
+        flows, weighted = r["flows"], e["flows"]
+        _, _, alive_at_end = weighted_capital(flows, survival)
+        _, capital, _ = weighted_capital(weighted, survival)
+        expected_total += capital
+        items.append({
+            "title": r["title"],
+            "planned_capital": r["capital_required"],
+            "expected_capital": capital,
+            "saving": r["capital_required"] - capital,
+            "end_year": CURRENT_YEAR + max(flows["offset"], 0) + len(flows["funding_drawdowns"]),
+            "p_alive_at_end": alive_at_end,  # chance the household outlives the item's fixed horizon
+            # open-ended stream weighted past its fixed horizon, to this year
+            "weighted_to_year": CURRENT_YEAR + max(weighted["offset"], 0) + len(weighted["funding_drawdowns"]),
+            "horizon_extended": len(weighted["funding_drawdowns"]) > len(flows["funding_drawdowns"]),
+        })
+
+    longevity = {
+        "p1_life_expectancy": life_expectancy(curves["p1"]),
+        "p2_life_expectancy": life_expectancy(curves["p2"]) if curves["p2"] is not None else None,
+        "last_survivor_expectancy": life_expectancy(curves["last"]),
+        # P1 age by which the chance that anyone (basis curve) is still alive falls to each level
+        "planning_ages": {
+            f"{level:.0%}": p1_age + int(np.argmax(survival < level)) if (survival < level).any() else None
+            for level in SURVIVAL_LEVELS
+        },
+        "p_p1_dies_within_10y": float(1 - curves["p1"][min(10, horizon - 1)]),
+        "table_end_age": table_end_age,  # P1 age the open-ended items are weighted to
+    }
+
+    report = {
+        "basis": basis,
+        "items": items,
+        "planned_total": planned_total,
+        "expected_total": expected_total,
+        "longevity": longevity,
+    }
+    report["summary"] = describe_mortality(report)
+    return report
+
+
+def describe_mortality(report) -> str:
+    """Number-backed text for ResilienceReport.longevity_check / early_death_implication."""
+    lon = report["longevity"]
+    ages = lon["planning_ages"]
+    outlived = [i for i in report["items"] if i["p_alive_at_end"] >= 0.1]
+    text = (
+        f"Survival-weighted capital is ${report['expected_total']:,.0f} against ${report['planned_total']:,.0f} "
+        f"for the fixed horizons. The household ({report['basis']}-survivor basis) has a 50% chance of lasting to "
+        f"P1 age {ages['50%']} and a 10% chance of lasting to P1 age {ages['10%']}. "
+        f"There is a {lon['p_p1_dies_within_10y']:.0%} chance P1 dies within 10 years."
+    )
+    if outlived:
+        text += " Horizons with a 10%+ chance of being outlived: " + ", ".join(
+            f"{i['title']} ({i['p_alive_at_end']:.0%})" for i in outlived) + "."
+    extended = [i["title"] for i in report["items"] if i["horizon_extended"]]
+    if extended:
+        text += (f" Open-ended items are weighted to P1 age {lon['table_end_age']} instead of their fixed horizons: "
+                 + ", ".join(extended) + ".")
+    return text
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Survival-weighted capital for a CompInput scenario.")
+    parser.add_argument("scenario", help="Path to a CompInput JSON file ('-' for stdin)")
+    parser.add_argument("life_table", nargs="?", default=None, help=f"Life table CSV (default {LIFE_TABLE_FILE})")
+    parser.add_argument("--basis", choices=["last", "joint"], default="last")
+    parser.add_argument("--p1-sex", choices=["male", "female", "unisex"], default="male")
+    parser.add_argument("--p2-sex", choices=["male", "female", "unisex"], default="female")
+    args = parser.parse_args(argv)
+
+    raw = sys.stdin.read() if args.scenario == "-" else open(args.scenario, encoding="utf-8").read()
+    report = mortality_scenario(CompInput.model_validate_json(raw), load_life_table(args.life_table),
+                                args.p1_sex, args.p2_sex, args.basis)
+    for item in report["items"]:
+        print(f"{item['title']:<40} planned ${item['planned_capital']:>12,.0f}  "
+              f"expected ${item['expected_capital']:>12,.0f}  outlived {item['p_alive_at_end']:>4.0%}")
+    print(report["summary"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from engine import CURRENT_YEAR, CompInput, CompItem, PORTFOLIO_PRESETS, iter_scenario, process_scenario
+
+# Goal-seek over portfolio preset x fund age for every item of a CompInput.
+# Each item's present-value capital depends only on its own (portfolio, fund age), so the total is
+# minimised item by item. All candidate variants of all items go through ONE totals-only engine run
+# (shared timeline, cached annuity factors), which keeps thousands of evaluations in the low milliseconds.
+# The Pareto frontier trades total capital against growth-asset capital (capital x growth share). Both are
+# sums over items, so it is built exactly from the evaluated grid by combining items one at a time and
+# keeping only the non-dominated partial sums.
+
+# Share of growth assets per preset — the risk axis of the Pareto frontier
+PORTFOLIO_RISK = {"conservative": 0.0, "balanced": 0.5, "growth": 1.0}
+
+CATEGORIES = ["incomes", "cars", "assets", "travel"]
+
+
+class OptimizeRequest(BaseModel):
+    scenario: CompInput
+    universal: bool = False                 # one shared fund age for every item (universal_fund_age)
+    portfolios: Optional[List[str]] = None  # allowed presets (default: all)
+    max_portfolio: Optional[str] = None     # risk cap, e.g. "balanced" excludes "growth"
+    min_fund_age: Optional[int] = None
+    max_fund_age: Optional[int] = None
+    fund_age_step: int = 1
+    frontier: bool = True
+
+
+def allowed_portfolios(portfolios=None, max_portfolio=None):
+    names = [p for p in (portfolios or PORTFOLIO_PRESETS) if p in PORTFOLIO_PRESETS]
+    if max_portfolio in PORTFOLIO_RISK:
+        names = [p for p in names if PORTFOLIO_RISK[p] <= PORTFOLIO_RISK[max_portfolio]]
+    if not names:
+        raise ValueError("No portfolio satisfies the given constraints")
+    return names
+
+
+def _current_age(data: CompInput):
+    return CURRENT_YEAR - int(data.profile.p1_dob.split("-")[0])
+
+
+def _scenario_items(data: CompInput):
+    """(category, index, name, start age) for every item the engine actually solves, in engine order."""
+    items = []
+    for category in CATEGORIES:
+        for i, item in enumerate(getattr(data, category)):
+            if category == "travel" and item.end - item.start <= 0:
+                continue  # skipped by the engine too
+            items.append((category, i, item.name, item.start))
+    if float(data.medical.get("cost", 0)) > 0:
+        items.append(("medical", None, "Medical Buffer", int(data.medical.get("start", 70))))
+    return items
+
+
+def _candidate_ages(current_age, start_age, min_fund_age, max_fund_age, step):
+    """Fund ages from today (or min_fund_age) up to the item's start — funding later would shift the spending."""
+    lo = max(current_age, min_fund_age if min_fund_age is not None else current_age)
+    hi = max(lo, start_age)
+    if max_fund_age is not None:
+        hi = max(lo, min(hi, max_fund_age))
+    ages = list(range(lo, hi + 1, max(1, step)))
+    if ages[-1] != hi:
+        ages.append(hi)
+    return ages
+
+
+def _with_item(data: CompInput, category, index, portfolio, fund_age):
+    """Copy of the scenario with one item pinned to (portfolio, fund_age)."""
+    if category == "medical":
+        medical = dict(data.medical, portfolio=portfolio, funding_start=fund_age)
+        return data.model_copy(update={"medical": medical})
+    items = list(getattr(data, category))
+    items[index] = items[index].model_copy(update={"portfolio": portfolio, "funding_start": fund_age})
+    return data.model_copy(update={category: items})
+
+
+def _medical_as_travel(medical: dict, portfolio, fund_age) -> CompItem:
+    """The medical buffer is solved exactly like an annual travel item (calculate_holiday_portfolio),
+    so its variants can ride in the same batched engine run. Mirrors the engine's medical overrides."""
+    return CompItem(
+        name="Medical Buffer",
+        cost=float(medical.get("cost", 0)),
+        start=int(medical.get("start", 70)),
+        end=int(medical.get("end", 100)),
+        portfolio=portfolio,
+        funding_start=fund_age,
+        income_return=float(medical["income_return"]) if medical.get("income_return") else None,
+        growth_return=float(medical["growth_return"]) if medical.get("growth_return") else None,
+        tax_rate=float(medical["tax_rate"]) if medical.get("tax_rate") is not None else None,
+        fee_load=float(medical["fee_load"]) if medical.get("fee_load") else None,
+    )
+
+
+def evaluate_grid(data: CompInput, items, portfolios, ages_per_item):
+    """PV capital for every (item, portfolio, fund age) candidate, from a single totals-only engine run
+    (one timeline, shared factor caches). Returns one dict per item: {(portfolio, fund_age): capital_required}."""
+    batch = {category: [] for category in CATEGORIES}
+    keys = {category: [] for category in CATEGORIES}
+    grid = [{} for _ in items]
+
+    for n, (category, index, _, start) in enumerate(items):
+        for portfolio in portfolios:
+            for age in ages_per_item[n]:
+                if category == "medical":
+                    if int(data.medical.get("end", 100)) <= start:
+                        grid[n][(portfolio, age)] = 0.0  # zero-length buffer (travel would skip it)
+                        continue
+                    batch["travel"].append(_medical_as_travel(data.medical, portfolio, age))
+                    keys["travel"].append((n, portfolio, age))
+                    continue
+                item = getattr(data, category)[index]
+                batch[category].append(item.model_copy(update={"portfolio": portfolio, "funding_start": age}))
+                keys[category].append((n, portfolio, age))
+
+    batched = data.model_copy(update={**batch, "medical": {}, "universal_fund_age": None})
+    ordered_keys = [key for category in CATEGORIES for key in keys[category]]
+    for (n, portfolio, age), result in zip(ordered_keys, iter_scenario(batched, totals_only=True)):
+        grid[n][(portfolio, age)] = result["capital_required"]
+
+    return grid
+
+
+def _candidates(table, fund_age=None):
+    """An item's (portfolio, fund_age) options; fund_age pins every item to one shared age (universal mode)."""
+    return table if fund_age is None else [(p, fund_age) for p in PORTFOLIO_RISK if (p, fund_age) in table]
+
+
+def _choose(grid, fund_age=None):
+    """Per item, the (portfolio, fund_age) with the lowest capital."""
+    return [min(_candidates(table, fund_age), key=table.get) for table in grid]
+
+
+def _pareto(points):
+    """Non-dominated (capital, growth capital, ...) tuples, by increasing capital and decreasing growth capital."""
+    front = []
+    for point in sorted(points, key=lambda p: (p[0], p[1])):
+        if not front or point[1] < front[-1][1]:
+            front.append(point)
+    return front
+
+
+def pareto_frontier(grid, fund_age=None):
+    """Every non-dominated (total capital, growth-asset capital, choice) over all per-item choices.
+    A partial sum dominated on the items combined so far stays dominated whatever the remaining items add,
+    so pruning after each item is exact."""
+    front = [(0.0, 0.0, ())]
+    for table in grid:
+        options = _pareto([(table[pa], table[pa] * PORTFOLIO_RISK[pa[0]], pa) for pa in _candidates(table, fund_age)])
+        front = _pareto([(t + c, g + cg, choice + (pa,)) for t, g, choice in front for c, cg, pa in options])
+    return front
+
+
+def _summarise(grid, choice):
+    total = sum(grid[n][c] for n, c in enumerate(choice))
+    exposure = sum(grid[n][c] * PORTFOLIO_RISK[c[0]] for n, c in enumerate(choice))
+    return total, (exposure / total if total else 0.0)
+
+
+def apply_configuration(data: CompInput, items, choice, universal_fund_age=None) -> CompInput:
+    """The scenario with every item pinned to its chosen (portfolio, fund_age)."""
+    scenario = data.model_copy(deep=True)
+    for (category, index, _, _), (portfolio, age) in zip(items, choice):
+        scenario = _with_item(scenario, category, index, portfolio, age)
+    scenario.universal_fund_age = universal_fund_age
+    return scenario
+
+
+def optimize_scenario(data: CompInput, universal=False, portfolios=None, max_portfolio=None,
+                      min_fund_age=None, max_fund_age=None, fund_age_step=1, frontier=True):
+    """
+    Minimise total present-value capital over portfolio presets x fund ages.
+    universal=True searches a single fund age shared by all items (like universal_fund_age),
+    otherwise each item gets its own. Returns the optimal configuration, the baseline it improves on,
+    and (optionally) the Pareto frontier of total capital vs. growth-asset exposure.
+    """
+    portfolios = allowed_portfolios(portfolios, max_portfolio)
+    current_age = _current_age(data)
+    items = _scenario_items(data)
+    if not items:
+        raise ValueError("Scenario has no items to optimise")
+
+    per_item_ages = [_candidate_ages(current_age, start, min_fund_age, max_fund_age, fund_age_step) for *_, start in items]
+    if universal:
+        # A shared age must not pass any item's start age
+        shared = _candidate_ages(current_age, min(start for *_, start in items), min_fund_age, max_fund_age, fund_age_step)
+        per_item_ages = [shared for _ in items]
+    grid = evaluate_grid(data, items, portfolios, per_item_ages)
+
+    if universal:
+        choice, shared_age = min(((_choose(grid, age), age) for age in per_item_ages[0]),
+                                 key=lambda ca: sum(grid[n][c] for n, c in enumerate(ca[0])))
+    else:
+        choice, shared_age = _choose(grid), None
+    total, exposure = _summarise(grid, choice)
+    baseline_results, baseline_total = process_scenario(data, totals_only=True)
+
+    result = {
+        "total_capital": total,
+        "baseline_total": baseline_total,
+        "savings": baseline_total - total,
+        "growth_exposure": exposure,
+        "universal_fund_age": shared_age,
+        "items": [
+            {
+                "title": base["title"],
+                "category": category,
+                "name": name,
+                "portfolio": portfolio,
+                "fund_age": age,
+                "capital_required": grid[n][(portfolio, age)],
+                "baseline_capital": base["capital_required"],
+            }
+            for n, ((category, _, name, _), (portfolio, age), base) in enumerate(zip(items, choice, baseline_results))
+        ],
+        "scenario": apply_configuration(data, items, choice, shared_age),
+        "evaluations": sum(len(table) for table in grid),
+    }
+
+    if frontier:
+        if universal:
+            points = _pareto([(t, g, c, age) for age in per_item_ages[0] for t, g, c in pareto_frontier(grid, age)])
+        else:
+            points = [(t, g, c, None) for t, g, c in pareto_frontier(grid)]
+        result["frontier"] = [
+            {
+                "total_capital": t,
+                "growth_capital": g,
+                "growth_exposure": g / t if t else 0.0,
+                "universal_fund_age": age,
+                "configuration": [{"portfolio": p, "fund_age": a} for p, a in c],
+            }
+            for t, g, c, age in points
+        ]
+
+    return result
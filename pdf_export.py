@@ -0,0 +1,126 @@
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from result_cache import ResultCache, canonical_hash
+from governor import SingleFlight
+
+# Server-side PDF export of an analysed plan.
+# The PDF is rendered from the plan itself (SystemOutput -> templates/plan_pdf.html -> WeasyPrint), not from
+# HTML posted by the browser. WeasyPrint is CPU-bound and holds the GIL, so it runs in a small process pool
+# (PDF_WORKERS) and the event loop only awaits the bytes. PDFs are cached by a hash of the plan and template,
+# identical concurrent requests share one render. WeasyPrint is in requirements.txt; it is still imported
+# lazily (in the worker), so an install where it or its native libraries (Pango) are missing answers 503
+# instead of failing at startup.
+
+logger = logging.getLogger(__name__)
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_CACHE_BYTES = int(os.getenv("PDF_CACHE_MAX_MB", "64")) * 1024 * 1024
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR") or None
+PDF_CACHE_DIR_BYTES = int(os.getenv("PDF_CACHE_DIR_MAX_MB", "512")) * 1024 * 1024
+PDF_TEMPLATE = "plan_pdf.html"
+PDF_FILENAME = "Beresfords_Life_Strategy.pdf"
+
+# Renders per worker process before it is replaced (WeasyPrint's font/layout caches only grow)
+PDF_TASKS_PER_WORKER = 50
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class PdfUnavailable(RuntimeError):
+    """WeasyPrint, or a native library it loads, is not installed in this environment."""
+
+
+class PdfRenderError(RuntimeError):
+    """WeasyPrint is installed but rendering this plan failed (details are logged, not sent to the client)."""
+
+
+def weasyprint_available() -> bool:
+    return importlib.util.find_spec("weasyprint") is not None
+
+
+def format_money(value) -> str:
+    return f"${value:,.0f}"
+
+
+def write_pdf(html: str) -> bytes:
+    """HTML -> PDF bytes (runs in a pool worker)."""
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError) as e:
+        # OSError: the package is there but cannot load Pango / its other shared libraries
+        raise PdfUnavailable(f"PDF export needs WeasyPrint and its system libraries ({e})") from None
+    return HTML(string=html).write_pdf()
+
+
+def iter_chunks(data: bytes, size: int = STREAM_CHUNK_BYTES):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+class PdfRenderer:
+    """Plan -> cached PDF bytes, rendered in a bounded process pool."""
+
+    def __init__(self, templates, workers: int = PDF_WORKERS, cache: ResultCache = None):
+        self.env = templates.env
+        self.env.filters.setdefault("money", format_money)
+        self.workers = workers
+        self.cache = cache or ResultCache(max_bytes=PDF_CACHE_BYTES, spill_dir=PDF_CACHE_DIR,
+                                            spill_max_bytes=PDF_CACHE_DIR_BYTES)
+        self._pool = None
+        self._inflight = SingleFlight()
+        self._unavailable = None  # reason, once a worker found WeasyPrint unusable
+
+    def _executor(self):
+        if self._pool is None:
+            # spawn: workers import only this module, not the web app and its threads
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             max_tasks_per_child=PDF_TASKS_PER_WORKER)
+        return self._pool
+
+    def render_html(self, plan) -> str:
+        return self.env.get_template(PDF_TEMPLATE).render(plan=plan)
+
+    def key(self, plan) -> str:
+        template = self.env.get_template(PDF_TEMPLATE)
+        return canonical_hash("pdf", plan, os.path.getmtime(template.filename))
+
+    async def render(self, plan):
+        """(key, pdf bytes) for a SystemOutput, from the cache when the same plan was rendered before."""
+        key = self.key(plan)
+        pdf = self.cache.get(key)
+        if pdf is not None:
+            return key, pdf
+        if not weasyprint_available():
+            raise PdfUnavailable("PDF export needs WeasyPrint (pip install weasyprint)")
+        if self._unavailable:
+            raise PdfUnavailable(self._unavailable)
+
+        async def build():
+            try:
+                html = self.render_html(plan)
+                data = await asyncio.get_running_loop().run_in_executor(self._executor(), write_pdf, html)
+            except PdfUnavailable as e:
+                self._unavailable = str(e)
+                raise
+            except BrokenProcessPool as e:
+                self.shutdown()  # a worker died; the next render starts a fresh pool
+                logger.error("PDF worker pool broke while rendering %s", key)
+                raise PdfRenderError("PDF rendering failed") from e
+            except Exception as e:
+                logger.exception("PDF rendering failed for %s", key)
+                raise PdfRenderError("PDF rendering failed") from e
+            self.cache.put(key, data)
+            return data
+
+        return key, await self._inflight.do(key, build)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
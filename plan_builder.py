@@ -0,0 +1,204 @@
+from schemas import (
+    AssumptionsLog, BucketDetail, BucketStructure, CapitalRequirement, FeeRelativity, KeyValuePair,
+    LifelineItemDetail, NarrativeOutput, SystemInput, SystemOutput, TwoNumbers,
+)
+
+# Deterministic SystemOutput sections.
+# Every number in the plan (capital requirements, the two numbers, bucket targets / funding / gaps, fees and
+# the assumptions log) is already known after the /api/analyze pre-calculation, so it is built here from the
+# pre-calc totals, the item cash flows and FinancialContext. The LLM only writes NarrativeOutput (the text
+# fields), which keeps its structured output — and the latency and cost that scale with it — small.
+
+# Bucket 1 (Stability) holds the emergency reserve plus this many years of first-stage income
+STABILITY_INCOME_YEARS = 2
+
+
+def _rate(value):
+    return f"{value * 100:.2f}%"
+
+
+def build_lifeline_register(data: SystemInput):
+    """The 5-attribute register of every lifestyle item in the input."""
+    ls = data.lifestyle
+    register = []
+    for car in ls.cars:
+        register.append(LifelineItemDetail(
+            item_name=car.name, category="Transport", purchase_value=car.purchase_value,
+            purchase_timing=f"Age {car.start_age} (replaced every {car.replacement_cycle} yrs)",
+            holding_cost=car.holding_cost, disposal_timing=f"Age {car.end_age}",
+            disposal_value=car.purchase_value * 0.2,  # trade-in rule used by the pre-calc
+        ))
+    for name, toy in (("Boat", ls.boat), ("Caravan", ls.caravan), ("Holiday Home", data.big_rocks.holiday_home)):
+        if toy and toy.purchase_value > 0:
+            register.append(LifelineItemDetail(
+                item_name=toy.name or name, category="Lifestyle Assets", purchase_value=toy.purchase_value,
+                purchase_timing=f"Age {toy.purchase_timing}", holding_cost=toy.holding_cost,
+                disposal_timing=f"Age {toy.disposal_timing}", disposal_value=toy.disposal_value,
+            ))
+    for trip in (ls.travel_domestic, ls.travel_international, ls.travel_parents, ls.travel_others):
+        if trip:
+            register.append(LifelineItemDetail(
+                item_name=trip.name, category="Travel", purchase_value=trip.total_annual_cost,
+                purchase_timing=f"Age {trip.start_age} (annual)", holding_cost=0.0,
+                disposal_timing=f"Age {trip.end_age}", disposal_value=0.0,
+            ))
+    for item, category in ((ls.health_buffer, "Health"), (ls.medical_expenses, "Health")):
+        if item and item.purchase_value > 0:
+            register.append(LifelineItemDetail(
+                item_name=item.name, category=category, purchase_value=item.purchase_value,
+                purchase_timing=f"Age {item.purchase_timing}", holding_cost=item.holding_cost,
+                disposal_timing=f"Age {item.disposal_timing}", disposal_value=item.disposal_value,
+            ))
+    family = data.family
+    for items, category in ((family.wedding_contributions, "Family - Weddings"),
+                            (family.home_deposits, "Family - Home Deposits"),
+                            (family.education_support, "Family - Education")):
+        for item in items:
+            register.append(LifelineItemDetail(
+                item_name=item.name, category=category, purchase_value=item.purchase_value,
+                purchase_timing=f"Age {item.purchase_timing}", holding_cost=item.holding_cost,
+                disposal_timing=f"Age {item.disposal_timing}", disposal_value=item.disposal_value,
+            ))
+    aged = data.big_rocks.aged_care
+    register.append(LifelineItemDetail(
+        item_name="Aged Care (RAD)", category="Housing", purchase_value=aged.rad_deposit,
+        purchase_timing=f"Age {aged.entry_age}", holding_cost=aged.daily_fees * 365,
+        disposal_timing="Estate", disposal_value=aged.rad_deposit,  # refundable deposit
+    ))
+    return register
+
+
+def build_capital_requirements(precalc):
+    """One row per pre-calc category, with the per-item breakdown as the details."""
+    rows = [
+        ("Necessary Life - Income (Life Stages)", "income", "Deferred, inflation-indexed income streams"),
+        ("Necessary Life - Transport", "cars", "Replacement cycles less 20% trade-in, plus holding costs"),
+        ("Necessary Life - Health & Medical", "health", "Recurring medical costs, discounted to today at 5%"),
+        ("Best Life - Travel", "travel", "Annual trips, discounted to today at 6%"),
+        ("Best Life - Toys & Lumpy Assets", "toys", "Purchase, holding and disposal, discounted to today at 6%"),
+    ]
+    requirements = []
+    for category, key, method in rows:
+        details = precalc.get(f"{key}_details") or []
+        requirements.append(CapitalRequirement(
+            category=category,
+            lump_sum_required=round(precalc[key], 2),
+            details=method + (f": {', '.join(details)}" if details else ""),
+        ))
+    return requirements
+
+
+def build_two_numbers(precalc, emergency_reserve, gap_analysis=""):
+    necessary = precalc["income"] + precalc["cars"] + precalc["health"] + emergency_reserve
+    best = necessary + precalc["travel"] + precalc["toys"]
+    return TwoNumbers(necessary_life_capital=round(necessary, 2), best_life_capital=round(best, 2),
+                      gap_analysis=gap_analysis)
+
+
+def build_capital_structure(data: SystemInput, precalc, explanation=""):
+    """
+    Bucket targets from the doctrine (1: emergency + 2 years of income, 2: cars/travel/toys, 3: the rest of the
+    income capital plus health), funded as a waterfall of the investable assets in bucket order.
+    """
+    stages = data.lifestyle.life_stages
+    first_income = stages[0].annual_income if stages else 0.0
+    stability_income = min(STABILITY_INCOME_YEARS * first_income, precalc["income"])
+    targets = [
+        ("Bucket 1 - Stability", "Emergency reserve plus two years of income",
+         data.lifestyle.emergency_reserve + stability_income),
+        ("Bucket 2 - Momentum", "Active lifestyle: cars, travel and lumpy assets",
+         precalc["cars"] + precalc["travel"] + precalc["toys"]),
+        ("Bucket 3 - Growth", "Long-term income, health and legacy",
+         precalc["income"] - stability_income + precalc["health"]),
+    ]
+    available = data.context.total_investable
+    buckets = []
+    for name, purpose, target in targets:
+        funded = min(max(available, 0.0), target)
+        available -= funded
+        buckets.append(BucketDetail(bucket_name=name, purpose=purpose, target_amount=round(target, 2),
+                                    funded_amount=round(funded, 2), gap=round(target - funded, 2)))
+    return BucketStructure(bucket_1=buckets[0], bucket_2=buckets[1], bucket_3=buckets[2], explanation=explanation)
+
+
+def build_fee_relativity(ledger, narrative=""):
+    return FeeRelativity(total_estimated_fees_10y=round(ledger["fees_10y"], 2),
+                         total_life_funded_value=round(ledger["lifetime_drawdowns"], 2),
+                         fee_ratio_narrative=narrative)
+
+
+def build_assumptions_log(data: SystemInput, flow_items):
+    """Rates exactly as used by the pre-calc, grouped by return profile (from the item cash flows)."""
+    asm = data.assumptions
+    profiles = {}
+    for item in flow_items:
+        f = item["flows"]
+        tax = f["tax_rate"] if not isinstance(f["tax_rate"], (list, tuple)) else max(f["tax_rate"], default=0)
+        key = (f["income_return"], f["growth_return"], tax, f["fee_rate"] if f["subtract_fees"] else 0.0,
+               f.get("discount_rate") if f.get("offset") else None)
+        profiles.setdefault(key, []).append(item["title"])
+
+    return_rates = []
+    for (income, growth, tax, fee, discount), titles in profiles.items():
+        value = f"Income {_rate(income)}, Growth {_rate(growth)}, Tax on income {_rate(tax)}, Fees {_rate(fee)}"
+        if discount is not None:
+            value += f", PV discount {_rate(discount)}"
+        return_rates.append(KeyValuePair(key=", ".join(titles), value=value))
+
+    fee_rates = sorted({item["flows"]["fee_rate"] for item in flow_items})
+    return AssumptionsLog(
+        inflation_rates_used=[
+            KeyValuePair(key="General inflation", value=f"{asm.general_inflation:.2f}%"),
+            KeyValuePair(key="Education inflation", value=f"{asm.education_inflation:.2f}%"),
+        ],
+        return_rates_used=return_rates,
+        depreciation_rules_applied=(
+            "Cars are traded in at 20% of purchase value at each replacement; boats, caravans and other "
+            f"lumpy assets are sold at their stated disposal value (assumed car depreciation {asm.car_depreciation:.1f}% p.a.)."
+        ),
+        fee_assumptions=(
+            f"Portfolio fees of {', '.join(_rate(f) for f in fee_rates) or 'n/a'} p.a. on opening balances "
+            f"(client fee load {asm.fee_load:.2f}%); deducted from income portfolios, shown for lifestyle portfolios."
+        ),
+    )
+
+
+def build_numeric_sections(data: SystemInput, precalc, flow_items, ledger):
+    """All numeric SystemOutput sections (narrative strings left empty until assemble_output)."""
+    return {
+        "lifeline_register": build_lifeline_register(data),
+        "capital_requirements": build_capital_requirements(precalc),
+        "two_numbers": build_two_numbers(precalc, data.lifestyle.emergency_reserve),
+        "capital_structure": build_capital_structure(data, precalc),
+        "fee_relativity": build_fee_relativity(ledger),
+        "assumptions_log": build_assumptions_log(data, flow_items),
+    }
+
+
+def numeric_summary(sections) -> str:
+    """Compact JSON of the computed sections, for the narrative prompt."""
+    return "\n".join(
+        f"{name}: " + (
+            "[" + ", ".join(v.model_dump_json() for v in value) + "]" if isinstance(value, list)
+            else value.model_dump_json()
+        )
+        for name, value in sections.items() if name != "lifeline_register"
+    )
+
+
+def assemble_output(sections, narrative: NarrativeOutput) -> SystemOutput:
+    """Merge the computed sections with the model's narrative into the full SystemOutput."""
+    two_numbers = sections["two_numbers"].model_copy(update={"gap_analysis": narrative.gap_analysis})
+    structure = sections["capital_structure"].model_copy(update={"explanation": narrative.bucket_explanation})
+    fees = sections["fee_relativity"].model_copy(update={"fee_ratio_narrative": narrative.fee_ratio_narrative})
+    return SystemOutput(
+        true_north=narrative.true_north,
+        client_narrative=narrative.client_narrative,
+        lifeline_register=sections["lifeline_register"],
+        capital_requirements=sections["capital_requirements"],
+        two_numbers=two_numbers,
+        capital_structure=structure,
+        resilience_report=narrative.resilience_report,
+        fee_relativity=fees,
+        assumptions_log=sections["assumptions_log"],
+    )
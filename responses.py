@@ -0,0 +1,81 @@
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# Dollar amounts are shown to the cent at most — anything finer is payload noise
+CURRENCY_PLACES = 2
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+_Fragment = getattr(orjson, "Fragment", None)
+
+
+def _default(obj):
+    """Fallback for types orjson does not know natively."""
+    if isinstance(obj, BaseModel):
+        # Reuse pydantic's own (Rust) serializer instead of going through model_dump();
+        # orjson.Fragment is 3.9+, older orjson gets the parsed JSON back
+        if _Fragment is not None:
+            return _Fragment(obj.model_dump_json())
+        return orjson.loads(obj.model_dump_json())
+    if hasattr(obj, "item"):
+        # NumPy / pandas scalars that slipped past OPT_SERIALIZE_NUMPY
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+def dumps_html(content) -> str:
+    """JSON for embedding inside a <script> block (same escaping as Jinja's |tojson)."""
+    return (
+        dumps(content).decode("utf-8")
+        .replace("<", "\\u003c")
+        .replace(">", "\\u003e")
+        .replace("&", "\\u0026")
+        .replace("'", "\\u0027")
+    )
+
+
+def _round_row(row, places):
+    return {k: round(v, places) if isinstance(v, float) else v for k, v in row.items()}
+
+
+def round_results(results, places: int = CURRENCY_PLACES):
+    """Round the currency figures of process_scenario results in place (returns the same list)."""
+    for r in results:
+        r["capital_required"] = round(r["capital_required"], places)
+        r["capital_at_fund_age"] = round(r["capital_at_fund_age"], places)
+        chart = r.get("chart_data")
+        if chart:
+            chart["balance"] = [round(v, places) for v in chart["balance"]]
+            chart["drawdown"] = [round(v, places) for v in chart["drawdown"]]
+            chart["table_data"] = [_round_row(row, places) for row in chart["table_data"]]
+    return results
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (NumPy arrays, pydantic models, non-str keys)."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """True when an If-None-Match header lists `etag` (or is "*"). If-None-Match uses weak comparison,
+    so a W/ prefix on either side is ignored; tags are compared whole, never as substrings."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
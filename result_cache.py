@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import orjson
+from pydantic import BaseModel
+
+# A spill directory over its cap is pruned (oldest-used first) down to this share of it, so it is not
+# rescanned on every write once full
+SPILL_PRUNE_TO = 0.8
+
+
+def canonical_hash(*parts) -> str:
+    """Stable hash of normalized inputs (pydantic models are dumped with defaults filled, keys sorted)."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, BaseModel):
+            part = part.model_dump(mode="json")
+        h.update(orjson.dumps(part, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU of bytes values, bounded by total size.
+
+    With `spill_dir` set, every entry is also written through to disk; entries evicted from memory are
+    promoted back from there on the next hit, so a restarted or memory-constrained worker still answers
+    repeat requests without recomputing. The directory is bounded too (`spill_max_bytes`, default max_bytes):
+    reads refresh a file's mtime, and once the files outgrow the cap the least recently used are deleted.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, spill_dir: str = None, spill_max_bytes: int = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes if spill_max_bytes is not None else max_bytes
+        self._entries = OrderedDict()  # key -> bytes
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._spill_size = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._prune_spill()
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.bin")
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.spill_dir:
+            path = self._spill_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = f.read()
+                os.utime(path)  # recently used: pruned last
+            except FileNotFoundError:
+                value = None  # never written, or pruned (possibly by another process sharing the directory)
+            if value is not None:
+                self.put(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _write_through(self, key: str, value: bytes):
+        path = self._spill_path(key)
+        if os.path.exists(path):
+            return  # values are immutable per key (already written, or promoted back from disk)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+        with self._lock:
+            self._spill_size += len(value)
+            full = self._spill_size > self.spill_max_bytes
+        if full:
+            self._prune_spill()
+
+    def _prune_spill(self):
+        """Delete the least recently used spill files until the directory is within SPILL_PRUNE_TO of its cap.
+        The directory is rescanned, since other processes may share it."""
+        files = []
+        for entry in os.scandir(self.spill_dir):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > self.spill_max_bytes:
+            target = self.spill_max_bytes * SPILL_PRUNE_TO
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._spill_size = total
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, old_value = self._entries.popitem(last=False)
+                self._size -= len(old_value)
+        if self.spill_dir:
+            self._write_through(key, value)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.spill_dir) and os.path.exists(self._spill_path(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+            if self.spill_dir:
+                stats["spill_bytes"] = self._spill_size
+            return stats
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from responses import round_results
+from result_cache import canonical_hash
+from engine import CompInput, process_scenario
+from llm_provider import LLM_PROVIDER
+
+# Scenario chat: the prompt, the JSON action protocol and per-session state shared by
+# POST /api/chat_interactive and the /ws/scenario/{session_id} WebSocket.
+
+# Most recent chat messages (user + assistant) sent back to the LLM as context
+CHAT_HISTORY_WINDOW = 20
+
+
+def build_system_prompt(scenario: CompInput) -> str:
+    scenario_json = scenario.model_dump_json(indent=2)
+
+    return f"""You are an expert Financial Planner AI assistant embedded in an interactive financial planning tool.
+You have DEEP expertise in investment strategy, retirement planning, tax optimization, and portfolio management.
+
+═══════════════════════════════════════════
+CURRENT CLIENT SCENARIO (Live State):
+═══════════════════════════════════════════
+{scenario_json}
+
+═══════════════════════════════════════════
+YOUR CAPABILITIES:
+═══════════════════════════════════════════
+
+1. ANSWER QUESTIONS intelligently about the plan:
+   - Explain how capital requirements are calculated
+   - Analyze the impact of changes before making them
+   - Compare different strategies and recommend the best approach
+   - Explain tax implications, inflation effects, and portfolio choices
+   - Calculate and explain compound growth scenarios
+   - Discuss the trade-offs between conservative vs growth portfolios
+
+2. MODIFY THE PLAN precisely using structured JSON actions (see below)
+
+3. PROVIDE PROACTIVE ADVICE:
+   - If you see a suboptimal configuration, mention it
+   - Suggest improvements (e.g., "Your medical fund starts late — consider funding from age 50 to reduce the lump sum needed")
+   - Warn about risks (e.g., "A growth portfolio for a 5-year horizon is risky")
+
+═══════════════════════════════════════════
+REASONING PROCESS (Think step by step):
+═══════════════════════════════════════════
+Before making changes, ALWAYS:
+1. Identify what the user is asking for
+2. Check the current values in the scenario JSON
+3. Determine the minimal set of changes needed
+4. Consider side effects (e.g., changing fund age affects capital required)
+5. Explain what you're doing and why in your reply
+
+═══════════════════════════════════════════
+OUTPUT FORMAT (STRICT):
+═══════════════════════════════════════════
+Return ONLY a JSON array of actions. No markdown, no code fences, just raw JSON.
+
+Available actions:
+[
+  {{"action": "reply", "text": "Your explanation here..."}},
+  {{"action": "update_assumption", "key": "inflation|income_return|growth_return|tax_rate|fee_load|tax_free_age", "value": 5.0}},
+  {{"action": "update_income", "stage_matches": "Stage 1", "field": "income|start|end|funding_start", "value": 90000}},
+  {{"action": "update_car", "name_matches": "Car", "field": "cost|start|cycle|holding|tradein|funding_start|apply_inflation", "value": 60000}},
+  {{"action": "update_item", "category": "incomes|cars|assets|travel", "name_matches": "Stage 1", "field": "tax_rate|income_return|growth_return|fee_load|portfolio|start|end|income|cost|cycle|holding|resale|tradein|funding_start|apply_inflation", "value": 0}},
+  {{"action": "update_item_portfolio", "category": "incomes|cars|assets|travel", "name_matches": "Stage 1", "portfolio": "conservative|balanced|growth"}},
+  {{"action": "update_universal_fund_age", "value": 55}},
+  {{"action": "add_child", "name": "Emily", "dob": "2010-05-15"}},
+  {{"action": "update_medical", "field": "cost|start|end|funding_start|portfolio", "value": 10000}}
+]
+
+═══════════════════════════════════════════
+CRITICAL RULES:
+═══════════════════════════════════════════
+- ALWAYS include a "reply" action explaining what you did and why
+- You can combine multiple actions in one response  
+- Portfolio options: "conservative" (4.5% income, 0.5% growth), "balanced" (3.5% income, 4.5% growth), "growth" (2.5% income, 6.5% growth)
+- tax_free_age: age after which tax on income returns drops to 0%
+- universal_fund_age: overrides ALL individual fund-from ages
+- Per-item overrides (tax_rate, income_return, growth_return, fee_load) are in PERCENTAGE points (e.g., 15 not 0.15)
+- name_matches is case-insensitive partial match (e.g., "stage 1" matches "Stage 1")
+- If user asks a question without requesting changes, return ONLY a reply action with a thorough answer
+- Reference specific numbers from the scenario when answering questions
+- Be concise but thorough in your explanations
+"""
+
+
+def parse_actions(raw_response: str) -> list:
+    """The LLM answers with a JSON array of actions (sometimes fenced, sometimes a single object)."""
+    content = raw_response.replace("```json", "").replace("```", "").strip()
+    actions = json.loads(content)
+    if isinstance(actions, dict): actions = [actions]
+    return actions
+
+
+def apply_actions(scenario: CompInput, actions: list) -> str:
+    """Apply chat actions to the scenario in place. Returns the reply text for the user."""
+    reply_text = "Changes applied."
+
+    for act in actions:
+        action_type = act.get("action")
+
+        if action_type == "reply":
+            reply_text = act.get("text")
+
+        elif action_type == "update_assumption":
+            key = act.get("key")
+            val = act.get("value")
+            if hasattr(scenario.assumptions, key):
+                 setattr(scenario.assumptions, key, val)
+                 reply_text = f"Updated assumption {key} to {val}"
+
+        elif action_type == "update_income":
+            match = act.get("stage_matches", "").lower()
+            field = act.get("field")
+            value = act.get("value")
+            for item in scenario.incomes:
+                if match in item.name.lower():
+                    setattr(item, field, value)
+                    reply_text = f"Updated {item.name}: set {field} to {value}"
+
+        elif action_type == "update_car":
+            match = act.get("name_matches", "").lower()
+            field = act.get("field")
+            value = act.get("value")
+            for item in scenario.cars:
+                if match in item.name.lower() or match in "car":
+                     setattr(item, field, value)
+                     reply_text = f"Updated Car: set {field} to {value}"
+
+        elif action_type == "update_item":
+            category = act.get("category", "").lower()
+            match = act.get("name_matches", "").lower()
+            field = act.get("field")
+            value = act.get("value")
+
+            category_map = {
+                "incomes": scenario.incomes,
+                "cars": scenario.cars,
+                "assets": scenario.assets,
+                "travel": scenario.travel,
+            }
+            items = category_map.get(category, [])
+            for item in items:
+                if match in item.name.lower():
+                    setattr(item, field, value)
+                    reply_text = f"Updated {item.name} ({category}): set {field} to {value}"
+
+        elif action_type == "update_item_portfolio":
+            category = act.get("category", "").lower()
+            match = act.get("name_matches", "").lower()
+            portfolio = act.get("portfolio")
+
+            category_map = {
+                "incomes": scenario.incomes,
+                "cars": scenario.cars,
+                "assets": scenario.assets,
+                "travel": scenario.travel,
+            }
+            items = category_map.get(category, [])
+            for item in items:
+                if match in item.name.lower():
+                    item.portfolio = portfolio
+                    reply_text = f"Set {item.name} portfolio to {portfolio}"
+
+        elif action_type == "update_universal_fund_age":
+            value = act.get("value")
+            scenario.universal_fund_age = value
+            reply_text = f"Set universal fund age to {value}"
+
+        elif action_type == "add_child":
+            name = act.get("name", "Child")
+            dob = act.get("dob", "2010-01-01")
+            scenario.profile.children.append({"name": name, "dob": dob})
+            reply_text = f"Added child: {name} (DOB: {dob})"
+
+        elif action_type == "update_medical":
+            field = act.get("field")
+            value = act.get("value")
+            scenario.medical[field] = value
+            reply_text = f"Updated medical: set {field} to {value}"
+
+    return reply_text
+
+
+# --- Streaming Reply ---
+_REPLY_START = re.compile(r'"action"\s*:\s*"reply"\s*,\s*"text"\s*:\s*"')
+_PARTIAL_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{0,3})?$')
+
+class ReplyStream:
+    """Pulls the "reply" text out of the action array while the LLM is still writing it,
+    so the user sees the answer token by token instead of waiting for the whole JSON."""
+    def __init__(self):
+        self.raw = ""
+        self._start = None  # index just after the opening quote of the reply text
+        self._sent = 0      # characters of decoded text already handed out
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of raw LLM output; returns the newly decoded reply text (may be "")."""
+        self.raw += chunk
+        if self._done:
+            return ""
+        if self._start is None:
+            m = _REPLY_START.search(self.raw)
+            if not m:
+                return ""
+            self._start = m.end()
+
+        body = self.raw[self._start:]
+        i = 0
+        while i < len(body):
+            if body[i] == "\\":
+                i += 2
+                continue
+            if body[i] == '"':
+                body = body[:i]
+                self._done = True
+                break
+            i += 1
+        if not self._done:
+            body = _PARTIAL_ESCAPE.sub("", body)  # wait for the rest of a split escape sequence
+
+        try:
+            text = json.loads('"' + body + '"')
+        except ValueError:
+            return ""
+        delta = text[self._sent:]
+        self._sent = len(text)
+        return delta
+
+
+# --- Sessions ---
+class ScenarioSession:
+    """Server-side state of one report page: the live scenario, its chat history and last results."""
+    def __init__(self, scenario: CompInput, history: list = None):
+        self.scenario = scenario
+        self.history = list(history or [])[-CHAT_HISTORY_WINDOW:]  # [{"role": ..., "content": ...}]
+        results, total = process_scenario(scenario)
+        self.results = round_results(results)
+        self.total = total
+        self.lock = asyncio.Lock()  # one chat turn at a time per session
+
+    def remember(self, message: str, reply: str):
+        self.history.append({"role": "user", "content": message})
+        self.history.append({"role": "assistant", "content": reply})
+        del self.history[:-CHAT_HISTORY_WINDOW]
+
+
+class SessionStore:
+    """In-process LRU of ScenarioSession by session id (a reconnecting socket resumes its session).
+    Sessions are per worker — run a single worker, or sticky routing, for the WebSocket channel."""
+    def __init__(self, max_sessions: int = 256):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session_id: str, session: ScenarioSession):
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+
+# --- Response Cache ---
+# Explanatory questions ("how is the car capital calculated?") are asked again and again against the same
+# scenario. A reply-only answer depends only on the scenario, the question and the recent conversation, so it
+# is cached on an exact-match hash of those: in-memory LRU in front of a SQLite file that survives restarts.
+# Answers that change the scenario are never cached. Keys include the provider and CHAT_PROMPT_VERSION, and the
+# replay provider (load tests) never writes to the persistent file, so canned replies cannot reach real users.
+
+# Bump when build_system_prompt or the action protocol changes, so cached answers to the old prompt stop matching
+CHAT_PROMPT_VERSION = 1
+
+# "" = memory only
+CHAT_CACHE_DB = os.getenv("CHAT_CACHE_DB", "" if LLM_PROVIDER == "replay" else "data/chat_cache.sqlite3")
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+CHAT_CACHE_MAX = int(os.getenv("CHAT_CACHE_MAX", "1024"))              # in-memory entries
+
+# Trailing chat messages that are part of the cache key (the question usually stands on its own,
+# but "and for the boat?" needs the previous exchange)
+CHAT_CACHE_HISTORY = 2
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    return _WHITESPACE.sub(" ", message).strip().strip("?!. ").lower()
+
+
+def chat_cache_key(model: str, scenario: CompInput, message: str, history: list) -> str:
+    recent = [(m["role"], m["content"]) for m in history[-CHAT_CACHE_HISTORY:]] if CHAT_CACHE_HISTORY else []
+    return canonical_hash(LLM_PROVIDER, CHAT_PROMPT_VERSION, model, scenario, normalize_message(message), recent)
+
+
+def is_reply_only(actions: list) -> bool:
+    return bool(actions) and all(act.get("action") == "reply" for act in actions)
+
+
+class ChatResponseCache:
+    """Exact-match cache of raw LLM responses: LRU + TTL in memory, optional persistent SQLite backend."""
+    def __init__(self, path: str = CHAT_CACHE_DB, ttl: float = CHAT_CACHE_TTL, max_entries: int = CHAT_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored_at, raw_response)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL, raw TEXT)")
+            self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - ttl,))
+            self._db.commit()
+
+    def _remember(self, key, stored_at, raw):
+        self._entries[key] = (stored_at, raw)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT stored_at, raw FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = tuple(row)
+                    self._remember(key, *entry)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, raw_response: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, raw_response)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, now, raw_response))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
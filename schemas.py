@@ -217,3 +217,12 @@ class SystemOutput(BaseModel):
     resilience_report: ResilienceReport
     fee_relativity: FeeRelativity
     assumptions_log: AssumptionsLog
+
+# --- Narrative-only LLM output (numbers are filled in code, see plan_builder.py) ---
+class NarrativeOutput(BaseModel):
+    true_north: TrueNorthComponents
+    client_narrative: str = Field(..., description="Poetic, empathetic summary")
+    gap_analysis: str = Field(..., description="Necessary vs Best Life capital: what the gap means and the trade-offs")
+    bucket_explanation: str = Field(..., description="Why the buckets are structured and funded as they are")
+    resilience_report: ResilienceReport
+    fee_ratio_narrative: str = Field(..., description="Fees in relation to the life they fund")
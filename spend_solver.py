@@ -0,0 +1,86 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from engine import CompInput, process_scenario
+from schemas import FinancialContext
+
+# Inverse of the capital engine: given the capital a household HAS, how much can it spend?
+# Required capital is linear in the spending amounts (every drawdown is amount x inflation factor and the
+# capital is a dot product of drawdowns with cached annuity factors), so C(s) = fixed + s * variable for a
+# spending scale s. Two engine runs give the line and the answer follows in closed form; a secant step
+# confirms it (and would keep iterating if a non-linear input ever crept in).
+
+SPEND_TOLERANCE = 0.01  # dollars of capital
+MAX_SECANT_STEPS = 20
+
+
+class SpendRequest(BaseModel):
+    scenario: CompInput
+    mode: Literal["income", "all"] = "income"  # scale life-stage incomes only, or every item's costs
+    available_capital: Optional[float] = None   # explicit, else context.total_investable
+    context: Optional[FinancialContext] = None
+
+
+def scale_for_budget(available, fixed, variable):
+    """Largest s with fixed + s * variable <= available (0 if the fixed part alone is unaffordable)."""
+    if variable <= 0:
+        raise ValueError("Nothing to scale: the scaled items need no capital")
+    return max(0.0, (available - fixed) / variable)
+
+
+def scale_scenario(data: CompInput, scale: float, mode: str = "income") -> CompInput:
+    """Copy of the scenario with spending multiplied by `scale`.
+    income: life-stage incomes. all: incomes plus every item's cost, holding cost and resale/trade-in."""
+    scenario = data.model_copy(deep=True)
+    for item in scenario.incomes:
+        item.income = (item.income or 0) * scale
+    if mode == "all":
+        for item in scenario.cars + scenario.assets + scenario.travel:
+            item.cost = (item.cost or 0) * scale
+            item.holding = (item.holding or 0) * scale
+            item.resale = (item.resale or 0) * scale
+            item.tradein = (item.tradein or 0) * scale
+        if "cost" in scenario.medical:
+            scenario.medical["cost"] = float(scenario.medical["cost"]) * scale
+    return scenario
+
+
+def max_sustainable_spend(data: CompInput, available_capital: float, mode: str = "income"):
+    """
+    Maximum spending scale (and the resulting incomes) that `available_capital` fully funds,
+    i.e. every item's projection stays non-negative and ends at zero.
+    Returns a dict with the scale, the fixed/variable split of the capital line and the scaled incomes.
+    """
+    def capital_at(scale):
+        return process_scenario(scale_scenario(data, scale, mode), totals_only=True)[1]
+
+    # Secant on f(s) = C(s) - available, seeded with s = 0 and s = 1 (exact after one step for linear C)
+    s0, s1 = 0.0, 1.0
+    c0, c1 = capital_at(s0), capital_at(s1)
+    fixed, variable = c0, c1 - c0
+    scale = scale_for_budget(available_capital, fixed, variable)
+    steps = 0
+    if scale > 0:
+        f0, f1 = c0 - available_capital, c1 - available_capital
+        while abs(f1) > SPEND_TOLERANCE and steps < MAX_SECANT_STEPS and f1 != f0:
+            s0, s1, f0 = s1, s1 - f1 * (s1 - s0) / (f1 - f0), f1
+            f1 = capital_at(s1) - available_capital
+            steps += 1
+        scale = s1
+
+    return {
+        "mode": mode,
+        "available_capital": available_capital,
+        "scale": scale,
+        "feasible": fixed <= available_capital,
+        "fixed_capital": fixed,        # capital for everything that is not scaled
+        "variable_capital": variable,  # capital per 1.0x of the scaled spending
+        "capital_at_scale": fixed + scale * variable,
+        "secant_steps": steps,
+        "incomes": [
+            {"name": item.name, "income": item.income, "max_income": (item.income or 0) * scale,
+             "start": item.start, "end": item.end}
+            for item in data.incomes
+        ],
+    }
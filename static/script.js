@@ -292,6 +292,53 @@ function getVehicleItems(listId) {
     return items;
 }
 
+// The analysis runs as a background job: submit, follow its stages over SSE, then fetch the result.
+const ANALYSIS_STAGES = {
+    queued: 'Queued...',
+    retrying: 'Assistant busy, retrying shortly...',
+    started: 'Starting analysis...',
+    pre_calc: 'Calculating capital requirements...',
+    life_theme: 'Reading your life theme...',
+    synthesis: 'Consulting Life Strategist...'
+};
+
+// The plan on screen (and its job, when it came from one) for the PDF export
+let lastPlan = null;
+let lastPlanJob = null;
+
+async function runAnalysisJob(formData, btn) {
+    const submit = await fetch('/api/analyze/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(formData)
+    });
+    if (!submit.ok) return submit;
+    const job = await submit.json();
+    lastPlanJob = job;
+
+    await new Promise((resolve) => {
+        const finish = () => { source.close(); resolve(); };
+        const source = new EventSource(job.events_url);
+        source.addEventListener('status', (ev) => {
+            const status = JSON.parse(ev.data);
+            if (btn && ANALYSIS_STAGES[status.stage || status.status]) {
+                btn.innerText = ANALYSIS_STAGES[status.stage || status.status];
+            }
+            if (status.status === 'done' || status.status === 'error') finish();
+        });
+        // Stream closed or dropped: the result request below reports the job's state either way
+        source.onerror = finish;
+    });
+
+    // A dropped stream may leave the job still running: poll until it settles
+    let response = await fetch(job.result_url);
+    while (response.status === 409) {
+        await new Promise(r => setTimeout(r, 2000));
+        response = await fetch(job.result_url);
+    }
+    return response;
+}
+
 async function handleFormSubmit(e) {
     e.preventDefault();
     let btn = e.submitter;
@@ -437,11 +484,7 @@ async function handleFormSubmit(e) {
             }
         };
 
-        const response = await fetch('/api/analyze', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(formData)
-        });
+        const response = await runAnalysisJob(formData, btn);
 
         if (response.ok) {
             const result = await response.json();
@@ -492,6 +535,7 @@ async function handleFormSubmit(e) {
 }
 
 function renderResults(data) {
+    lastPlan = data;
     // Hide form, show results
     document.getElementById('inputSection').style.display = 'none';
     const resDiv = document.getElementById('resultSection');
@@ -624,168 +668,15 @@ async function downloadPDF() {
     btn.disabled = true;
 
     try {
-        const element = document.getElementById('resultSection');
-
-        // Clone to clean up for PDF (remove button)
-        const clone = element.cloneNode(true);
-        const btnInClone = clone.querySelector('#downloadPdfBtn');
-        if (btnInClone) btnInClone.remove();
-
-        // TRANSFORM INPUTS TO TEXT
-        // Inputs cannot wrap text, which causes overflow in tables. 
-        // We replace them with their values in spans/divs.
-        const inputs = clone.querySelectorAll('input, select, textarea');
-        inputs.forEach(input => {
-            const span = document.createElement('span');
-            span.style.wordWrap = 'break-word';
-            span.style.whiteSpace = 'pre-wrap';
-
-            if (input.tagName === 'SELECT') {
-                // Get selected text, not value
-                span.innerText = input.options[input.selectedIndex]?.text || input.value;
-            } else {
-                span.innerText = input.value;
-            }
-            input.parentNode.replaceChild(span, input);
-        });
-
-
-        // Create dedicated Print CSS for WeasyPrint
-        const cssContent = `
-            @page {
-                size: A4;
-                margin: 25mm 20mm;
-                @top-center {
-                    content: "Beresfords Life-First Strategy";
-                    font-family: serif;
-                    font-size: 9pt;
-                    color: #666;
-                }
-                @bottom-center {
-                    content: counter(page);
-                    font-family: serif;
-                    font-size: 9pt;
-                    color: #666;
-                }
-            }
-            body { 
-                font-family: "Helvetica Neue", Helvetica, Arial, sans-serif; 
-                line-height: 1.5; 
-                color: #333; 
-                background: #fff;
-                font-size: 11pt;
-            }
-            h2 { 
-                color: #1a365d; 
-                border-bottom: 2px solid #1a365d; 
-                padding-bottom: 5px; 
-                margin-top: 30px; 
-                margin-bottom: 15px; 
-                font-size: 18pt;
-                page-break-after: avoid;
-            }
-            h3 { 
-                color: #2c5282; 
-                font-size: 14pt; 
-                margin-top: 20px; 
-                margin-bottom: 10px; 
-                page-break-after: avoid;
-            }
-            .section-card { 
-                border: 1px solid #e2e8f0; 
-                border-radius: 8px; 
-                padding: 20px; 
-                margin-bottom: 25px; 
-                background: #fff;
-                page-break-inside: avoid;
-            }
-            .form-grid {
-                display: block; /* WeasyPrint handles flows better than complex grids sometimes, but let's try strict flex */
-                overflow: hidden;
-            }
-            /* Emulate grid with float/width for reliability in PDF engines if grid fails, 
-               but WeasyPrint supports flex/grid reasonably well now. Let's use clean block layout for safety or Flex */
-            .form-grid > div {
-                margin-bottom: 15px;
-            }
-            
-            /* Two-Column Layout for Key Numbers */
-            #res_num1, #res_num2 {
-                font-size: 24pt !important;
-                font-weight: bold;
-                margin: 10px 0;
-            }
-            #res_num1 { color: #2f855a !important; } /* Green */
-            #res_num2 { color: #c53030 !important; } /* Red/Accent */
-
-            .highlight-box {
-                background-color: #f7fafc;
-                border: 1px solid #cbd5e0;
-                padding: 15px;
-                border-radius: 5px;
-            }
-            
-            /* Table-like structures */
-            .five-attr-grid {
-                display: table;
-                width: 100%;
-                table-layout: fixed; /* Force equal width or respect percentages */
-                border-collapse: collapse;
-                margin-bottom: 10px;
-                font-size: 8pt; /* Reduce base font for table */
-            }
-            .five-attr-grid .form-group {
-                display: table-cell;
-                padding: 4px;
-                border: 1px solid #eee;
-                word-wrap: break-word; /* Prevent overflow */
-                vertical-align: top;
-            }
-            label {
-                display: block;
-                font-weight: bold;
-                font-size: 7pt;
-                color: #666;
-                text-transform: uppercase;
-                margin-bottom: 2px;
-            }
-            .value-display {
-                font-size: 9pt;
-            }
-            
-            /* Assumptions Log - Fix Overflow */
-            #res_assumptions {
-                white-space: pre-wrap;       /* Wrap text */
-                word-wrap: break-word;       /* Break long words */
-                font-family: "Courier New", Courier, monospace;
-                font-size: 8pt;
-                background: #f4f4f4;
-                padding: 10px;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-                max-width: 100%;
-            }
-        `;
-
-        const htmlContent = `
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-            </head>
-            <body>
-                <div class="results-container">
-                    ${clone.innerHTML}
-                </div>
-            </body>
-            </html>
-        `;
-
-        const response = await fetch('/api/pdf', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ html_content: htmlContent, css_content: cssContent })
-        });
+        // The server renders the PDF from the plan itself: the finished job when there is one,
+        // otherwise the plan JSON (a few KB, not the page markup)
+        const response = lastPlanJob
+            ? await fetch(lastPlanJob.pdf_url)
+            : await fetch('/api/pdf', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(lastPlan)
+            });
 
         if (response.ok) {
             const blob = await response.blob();
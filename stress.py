@@ -0,0 +1,147 @@
+from typing import List, Literal
+
+import numpy as np
+from pydantic import BaseModel
+
+from calculations import flow_multipliers, portfolio_flows
+from engine import CURRENT_YEAR, CompInput, process_scenario
+
+# Deterministic shock grid.
+# Each item is laid out on a timeline from today: pre-funding years grow at the discount rate (exactly the
+# engine's PV discount), then the projection years use m = 1 + growth + income * (1 - tax) - fee.
+# A shock edits the multipliers of one row per possible start year of an (H x H) matrix — a balance drop
+# scales m at that year, a growth stall removes the growth term for a run of years — and one cumprod over
+# the matrix gives the capital needed for every shock position at once.
+
+class ShockSpec(BaseModel):
+    kind: Literal["drawdown", "stall"] = "drawdown"  # balance drop, or years of zero growth
+    size: float = 0.30                                # drawdown fraction (0.30 = -30%)
+    years: int = 1                                    # length of a growth stall
+
+    def label(self):
+        if self.kind == "drawdown":
+            return f"{self.size:.0%} market drop"
+        return f"{self.years}-year zero-growth run"
+
+
+DEFAULT_SHOCKS = [ShockSpec(kind="drawdown", size=0.30), ShockSpec(kind="stall", years=3)]
+
+
+class StressRequest(BaseModel):
+    scenario: CompInput
+    shocks: List[ShockSpec] = DEFAULT_SHOCKS
+
+
+def _item_vectors(flows):
+    """Multipliers, drawdowns and pure growth component from today to the end of the item's projection."""
+    k = max(flows.get("offset", 0), 0)
+    funding = np.asarray(flows["funding_drawdowns"], dtype=float)
+    n = len(funding)
+    discount_rate = flows.get("discount_rate", flows["growth_return"])
+
+    multipliers = np.concatenate([np.full(k, 1 + discount_rate), flow_multipliers(flows, n)])
+    growth = np.concatenate([np.full(k, discount_rate), np.full(n, flows["growth_return"])])
+    drawdowns = np.concatenate([np.zeros(k), funding])
+    return multipliers, drawdowns, growth
+
+
+def flow_item(title, kind, params, offset=0, discount_rate=None):
+    """Stress input for a direct calculate_<kind>_portfolio call: the capital is discounted to today over
+    `offset` years at `discount_rate` (default: the item's growth return, as the engine does)."""
+    flows = {**portfolio_flows(kind, params), "offset": offset}
+    if discount_rate is not None:
+        flows["discount_rate"] = discount_rate
+    return {"title": title, "flows": flows}
+
+
+def shock_grid(flows, shock: ShockSpec):
+    """
+    Row t = the shock starting t years from today (t = 0..H-1). Returns a dict of arrays over t:
+    capital (needed today), extra (vs. unshocked), depleted_at (first year the planned capital runs out,
+    -1 if never) and shortfall (end-of-horizon deficit when only the planned capital is held).
+    """
+    m, d, g = _item_vectors(flows)
+    h = len(m)
+    if h == 0:
+        return None
+    base_capital = float(np.sum(d / np.cumprod(m)))
+
+    grid = np.tile(m, (h, 1))
+    rows = np.arange(h)
+    if shock.kind == "drawdown":
+        grid[rows, rows] *= 1 - shock.size
+    else:
+        # Band of `years` columns from the diagonal: growth term removed
+        cols = np.arange(h)
+        band = (cols[None, :] >= rows[:, None]) & (cols[None, :] < rows[:, None] + max(shock.years, 1))
+        grid -= band * g[None, :]
+
+    growth_paths = np.cumprod(grid, axis=1)
+    weights = 1 / growth_paths
+    capital = weights @ d
+
+    # Balance paths when only the planned capital is held: B_j = P_j * (C - sum_{i<=j} d_i w_i)
+    balances = growth_paths * (base_capital - np.cumsum(weights * d, axis=1))
+    negative = balances < -0.01
+    depleted_at = np.where(negative.any(axis=1), negative.argmax(axis=1), -1)
+
+    return {
+        "base_capital": base_capital,
+        "capital": capital,
+        "extra": capital - base_capital,
+        "depleted_at": depleted_at,
+        "shortfall": np.maximum(-balances[:, -1], 0.0),
+    }
+
+
+def stress_items(items, shocks=None, p1_current_age=None):
+    """
+    Shock grid for a list of {"title", "flows"} items (flows as from iter_scenario(with_flows=True) or
+    calculations.portfolio_flows + offset [+ discount_rate]). Positions are calendar-aligned (years from today),
+    so the household row sums what one market event at that year costs across all items.
+    """
+    shocks = shocks or DEFAULT_SHOCKS
+    report = []
+    for shock in shocks:
+        grids = [(item, shock_grid(item["flows"], shock)) for item in items]
+        grids = [(item, grid) for item, grid in grids if grid is not None]
+        horizon = max((len(grid["extra"]) for _, grid in grids), default=0)
+        household = np.zeros(horizon)
+
+        item_rows = []
+        for item, grid in grids:
+            extra = grid["extra"]
+            household[:len(extra)] += extra
+            t = int(np.argmax(extra.round(2)))  # ties (e.g. any pre-funding year) -> earliest
+            item_rows.append({
+                "title": item["title"],
+                "planned_capital": grid["base_capital"],
+                "worst_year": CURRENT_YEAR + t,
+                "worst_age": (p1_current_age + t) if p1_current_age is not None else None,
+                "worst_extra_capital": float(extra[t]),
+                "mean_extra_capital": float(extra.mean()),
+                "depletion_year": (CURRENT_YEAR + int(grid["depleted_at"][t])) if grid["depleted_at"][t] >= 0 else None,
+                "shortfall": float(grid["shortfall"][t]),
+            })
+
+        t = int(np.argmax(household.round(2))) if horizon else 0
+        report.append({
+            "shock": shock.model_dump(),
+            "label": shock.label(),
+            "items": item_rows,
+            "household": {
+                "worst_year": CURRENT_YEAR + t,
+                "worst_age": (p1_current_age + t) if p1_current_age is not None else None,
+                "worst_extra_capital": float(household[t]) if horizon else 0.0,
+                "by_year": [{"year": CURRENT_YEAR + i, "extra_capital": float(v)} for i, v in enumerate(household)],
+            },
+        })
+    return report
+
+
+def stress_scenario(data: CompInput, shocks=None):
+    """Shock grid for every item of a CompInput scenario."""
+    results, _ = process_scenario(data, totals_only=True, with_flows=True)
+    p1_current_age = CURRENT_YEAR - int(data.profile.p1_dob.split("-")[0])
+    return stress_items(results, shocks, p1_current_age)
+
@@ -0,0 +1,151 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import orjson
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import ToolMessage
+
+from result_cache import ResultCache, canonical_hash
+
+# Server-side store for the agent's projection tables.
+# Tools return a compact summary plus a handle; the full table lives here and is rendered for the user
+# outside the LLM context (the reply carries [[table:<handle>]] markers), so the MemorySaver thread history
+# — resent to the model on every turn — only ever holds the summaries.
+
+TOOL_RESULT_CACHE_BYTES = int(os.getenv("TOOL_RESULT_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+# Rows returned by one tool_table_rows call
+MAX_TOOL_ROWS = 15
+
+HANDLE_LENGTH = 16
+MARKER_RE = re.compile(r"\[\[table:([0-9a-f]{%d})\]\]" % HANDLE_LENGTH)
+
+tool_results = ResultCache(max_bytes=TOOL_RESULT_CACHE_BYTES)
+
+
+def table_marker(handle: str) -> str:
+    return f"[[table:{handle}]]"
+
+
+def store_table(tool_name: str, title: str, header: list, rows: list, years: list) -> str:
+    """Keep a rendered table (markdown header lines + one line per year) and return its handle.
+    Handles are content-addressed, so repeating a calculation reuses the same entry."""
+    handle = canonical_hash(tool_name, title, rows)[:HANDLE_LENGTH]
+    tool_results.put(handle, orjson.dumps({"title": title, "header": header, "rows": rows, "years": years}))
+    return handle
+
+
+def get_table(handle: str):
+    value = tool_results.get(handle)
+    return orjson.loads(value) if value is not None else None
+
+
+def table_markdown(entry, rows=None) -> str:
+    return "\n".join(entry["header"] + (entry["rows"] if rows is None else rows))
+
+
+def select_rows(entry, start_year=None, end_year=None, max_rows=MAX_TOOL_ROWS):
+    """Table lines for years in [start_year, end_year], capped at max_rows."""
+    rows = [row for year, row in zip(entry["years"], entry["rows"])
+            if (start_year is None or year >= start_year) and (end_year is None or year <= end_year)]
+    return rows[:max_rows], len(rows)
+
+
+def table_summary(handle: str, years, closing_balances) -> str:
+    """Compact description of a stored table for the tool result."""
+    span = f"{years[0]}-{years[-1]}" if years else "no years"
+    low = min(closing_balances) if closing_balances else 0
+    return (
+        f"**Table:** {len(years)} rows ({span}), lowest closing balance ${low:,.0f}. "
+        f"Handle `{handle}`: show it to the user with {table_marker(handle)}; "
+        f"use tool_table_rows for specific years."
+    )
+
+
+def collect_tables(*texts):
+    """{handle: {"title", "markdown"}} for every table marker / handle mentioned in the texts."""
+    tables = {}
+    for text in texts:
+        for handle in MARKER_RE.findall(text or "") + _handles(text):
+            if handle in tables:
+                continue
+            entry = get_table(handle)
+            if entry is not None:
+                tables[handle] = {"title": entry["title"], "markdown": table_markdown(entry)}
+    return tables
+
+
+# --- Per-thread tool memoization ---
+# Portfolio tools are pure functions of their arguments and follow-up turns often repeat a call verbatim,
+# so results are memoized per chat thread (thread_id from the graph config), keyed on tool name + args.
+
+MEMO_MAX_THREADS = int(os.getenv("AGENT_MEMO_THREADS", "256"))
+MEMO_MAX_ENTRIES = 64  # per thread
+
+
+class ThreadToolMemo(AgentMiddleware):
+    """Agent middleware: answer a repeated tool call in the same thread from memory."""
+
+    def __init__(self, max_threads: int = MEMO_MAX_THREADS, max_entries: int = MEMO_MAX_ENTRIES):
+        super().__init__()
+        self.max_threads = max_threads
+        self.max_entries = max_entries
+        self._threads = OrderedDict()  # thread_id -> OrderedDict(key -> content)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, request):
+        config = getattr(request.runtime, "config", None) or {}
+        thread_id = config.get("configurable", {}).get("thread_id")
+        call = request.tool_call
+        return thread_id, canonical_hash(call["name"], call.get("args", {}))
+
+    def _lookup(self, request):
+        thread_id, key = self._key(request)
+        if thread_id is None:
+            return None
+        with self._lock:
+            memo = self._threads.get(thread_id)
+            content = memo.get(key) if memo is not None else None
+            if content is None or any(handle not in tool_results for handle in _handles(content)):
+                self.misses += 1
+                return None  # unseen, or its table has been evicted: recompute
+            self._threads.move_to_end(thread_id)
+            self.hits += 1
+        return ToolMessage(content=content, name=request.tool_call["name"], tool_call_id=request.tool_call["id"])
+
+    def _remember(self, request, result):
+        thread_id, key = self._key(request)
+        if thread_id is None or not isinstance(result, ToolMessage) or result.status == "error":
+            return
+        with self._lock:
+            memo = self._threads.setdefault(thread_id, OrderedDict())
+            self._threads.move_to_end(thread_id)
+            memo[key] = result.content
+            while len(memo) > self.max_entries:
+                memo.popitem(last=False)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def wrap_tool_call(self, request, handler):
+        cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        result = handler(request)
+        self._remember(request, result)
+        return result
+
+    async def awrap_tool_call(self, request, handler):
+        cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        result = await handler(request)
+        self._remember(request, result)
+        return result
+
+
+def _handles(text):
+    return re.findall(r"Handle `([0-9a-f]{%d})`" % HANDLE_LENGTH, text or "")
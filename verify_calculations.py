@@ -1,4 +1,17 @@
 from calculations import calculate_income_portfolio, calculate_asset_portfolio, calculate_holiday_portfolio
+from calculations import project_records, solve_required_capital, income_drawdowns, asset_cash_flows, cost_only
+from itertools import product
+
+import numpy as np
+
+from engine import CompInput, process_scenario
+from optimizer import _candidate_ages, _current_age, _pareto, _scenario_items, apply_configuration, evaluate_grid
+from optimizer import PORTFOLIO_RISK, optimize_scenario
+from backtest import RETURNS_HISTORY_SAMPLE, backtest_scenario, load_history
+from ledger import FEE_SUMMARY_YEARS, LEDGER_COLUMNS, build_ledger
+from mortality import mortality_scenario, weighted_capital
+from stress import ShockSpec, shock_grid
+from spend_solver import SPEND_TOLERANCE, max_sustainable_spend, scale_scenario
 
 def verify():
     print("--- Verifying Income Portfolio ---")
@@ -136,6 +149,260 @@ def verify():
     print(f"Calculated Holiday Capital (15 Years, 3% Inf): {cap_hol_15:,.2f}")
 
 
-    
+
+def close(a, b, rel=1e-9):
+    return abs(a - b) <= rel * max(abs(a), abs(b), 1.0)
+
+
+def report(ok, message):
+    """Print one SUCCESS / FAILURE line; returns 1 on failure so a check can add up its failures."""
+    print(f"{'SUCCESS' if ok else 'FAILURE'}: {message}")
+    return int(not ok)
+
+
+def check_close(label, value, expected, rel=1e-9):
+    """report() for one figure that must equal an independently computed one (to `rel`)."""
+    return report(close(value, expected, rel), f"{label}: {value:,.2f} (expected {expected:,.2f})")
+
+
+def verify_closed_form():
+    """solve_required_capital is a dot product with cached annuity factors, not a numeric search:
+    projecting the solved capital must close at (almost exactly) $0 in the final year."""
+    print("\n--- Verifying Closed-Form Capital Solver ---")
+    years = list(range(2026, 2046))
+    income = income_drawdowns(20, 80000, 0.03)
+    car = cost_only(asset_cash_flows(20, 50000, 7, 3300, 10000, 0.03, sell_at_end=True)[0])
+    cases = [
+        ("scalar tax", 0.15, True, income),
+        ("per-year tax schedule (0% after it ends)", [0.15] * 8 + [0.0] * 4, True, income),
+        ("fees not subtracted", 0.15, False, income),
+        ("asset cost-only drawdowns", 0.15, False, car),
+    ]
+    failures = 0
+    for label, tax_rate, subtract_fees, drawdowns in cases:
+        capital = solve_required_capital(years, 0.035, 0.045, tax_rate, 0.011, drawdowns, subtract_fees=subtract_fees)
+        records = project_records(capital, years, 0.035, 0.045, tax_rate, 0.011, drawdowns, subtract_fees=subtract_fees)
+        closing = records[-1]["Closing Balance"]
+        failures += report(abs(closing) < 1e-6 * capital,
+                           f"{label}: capital {capital:,.2f}, final closing balance {closing:.2e}")
+    return failures
+
+
+def sample_scenario():
+    """A household with deferred funding, a car, an asset, travel and a medical buffer (used by the engine checks)."""
+    return CompInput.model_validate({
+        "profile": {"p1_name": "Test User", "p1_dob": "1980-01-01", "p2_name": "Test Partner", "p2_dob": "1982-01-01"},
+        "assumptions": {"income_return": 3.5, "growth_return": 4.5, "tax_rate": 15.0, "inflation": 3.0,
+                        "fee_load": 1.1, "tax_free_age": 67},
+        "incomes": [
+            {"name": "Stage 1", "income": 80000, "start": 60, "end": 70, "funding_start": 55},
+            {"name": "Stage 2", "income": 60000, "start": 70, "end": 85},
+        ],
+        "cars": [{"name": "Primary Car", "cost": 50000, "start": 60, "cycle": 5, "holding": 2000}],
+        "assets": [{"name": "Boat", "cost": 100000, "start": 65, "end": 75, "holding": 5000, "resale": 30000}],
+        "travel": [{"name": "Europe Trip", "cost": 20000, "start": 60, "end": 70, "type": "annual"}],
+        "medical": {"cost": 5000, "start": 75, "end": 95},
+    })
+
+
+def verify_optimizer():
+    """The batched grid and the Pareto frontier against brute force: every (portfolio, fund age) combination is
+    summed from the grid, its non-dominated set must equal pareto_frontier's, and frontier configurations re-run
+    through process_scenario must reproduce the frontier totals."""
+    print("\n--- Verifying Optimizer Grid and Pareto Frontier ---")
+    data = sample_scenario()
+    step = 10  # coarse ages keep the brute-force product small
+    result = optimize_scenario(data, fund_age_step=step)
+    items = _scenario_items(data)
+    ages = [_candidate_ages(_current_age(data), start, None, None, step) for *_, start in items]
+    grid = evaluate_grid(data, items, list(PORTFOLIO_RISK), ages)
+
+    brute = _pareto([
+        (sum(grid[n][c] for n, c in enumerate(choice)),
+         sum(grid[n][c] * PORTFOLIO_RISK[c[0]] for n, c in enumerate(choice)), choice)
+        for choice in product(*(list(table) for table in grid))
+    ])
+    frontier = result["frontier"]
+    same = len(brute) == len(frontier) and all(
+        close(t, point["total_capital"]) and close(g, point["growth_capital"])
+        for (t, g, _), point in zip(brute, frontier))
+    failures = report(same, f"frontier has {len(frontier)} points, brute force over {result['evaluations']} "
+                            f"grid cells finds {len(brute)}")
+
+    picks = {"cheapest": brute[0], "median": brute[len(brute) // 2], "lowest growth": brute[-1]}
+    for label, (total, _, choice) in picks.items():
+        _, engine_total = process_scenario(apply_configuration(data, items, choice), totals_only=True)
+        failures += check_close(f"{label} frontier point vs process_scenario", total, engine_total)
+
+    _, engine_total = process_scenario(result["scenario"], totals_only=True)
+    failures += check_close("optimum vs process_scenario", result["total_capital"], engine_total)
+    failures += check_close("optimum vs cheapest brute-force point", result["total_capital"], brute[0][0])
+    return failures
+
+
+def verify_spend_solver():
+    """The solved spending scale, applied through scale_scenario, must need exactly the budget (within
+    SPEND_TOLERANCE dollars); a budget below the unscaled items' capital gives scale 0 and is infeasible."""
+    print("\n--- Verifying Maximum Sustainable Spend ---")
+    data = sample_scenario()
+    _, planned = process_scenario(data, totals_only=True)
+    failures = 0
+    for mode in ("income", "all"):
+        for budget in (0.6 * planned, planned, 1.5 * planned):
+            result = max_sustainable_spend(data, budget, mode)
+            _, needed = process_scenario(scale_scenario(data, result["scale"], mode), totals_only=True)
+            failures += report(result["feasible"] and abs(needed - budget) <= SPEND_TOLERANCE,
+                               f"{mode}, budget {budget:,.2f}: scale {result['scale']:.6f} needs {needed:,.2f}")
+
+    _, fixed = process_scenario(scale_scenario(data, 0.0), totals_only=True)
+    result = max_sustainable_spend(data, 0.5 * fixed)
+    failures += report(result["scale"] == 0.0 and not result["feasible"],
+                       f"budget below the fixed capital: scale {result['scale']}, feasible {result['feasible']}")
+    return failures
+
+
+# Ledger column -> per-item table column it must reproduce over the item's projection years
+LEDGER_TABLE_COLUMNS = {"drawdown": "Drawdown", "balance": "Closing Balance", "fees": "Fees", "tax": "Tax"}
+
+
+def verify_ledger():
+    """Every ledger column, year by year, against the item tables from iter_scenario (offset by the item's fund
+    age); capital today per item and in total against the engine's capital, the household rows as column sums,
+    the headline fee figure against the fees the tables actually deduct, and the pooled fund of any single item against that item's own capital."""
+    print("\n--- Verifying Household Ledger ---")
+    results, total = process_scenario(sample_scenario(), with_flows=True)
+    ledger = build_ledger(results)
+    failures = 0
+    for j, r in enumerate(results):
+        k = max(r["flows"]["offset"], 0)
+        rows = r["chart_data"]["table_data"]
+        worst = max(
+            abs(ledger["matrices"][name][k + t, j] - row[column])
+            for name, column in LEDGER_TABLE_COLUMNS.items() for t, row in enumerate(rows)
+        )
+        prefund_end = ledger["matrices"]["balance"][k - 1, j] if k else ledger["capital_today"][j]
+        ok = (worst < 1e-6 and close(ledger["capital_today"][j], r["capital_required"])
+              and close(prefund_end, r["capital_at_fund_age"])
+              and close(ledger["matrices"]["drawdown"][:, j].sum(), sum(row["Drawdown"] for row in rows)))
+        failures += report(ok, f"{r['title']}: {len(rows)} years from year {k}, largest table difference {worst:.2e}")
+
+    failures += check_close("household capital today vs engine total", ledger["capital_today"].sum(), total)
+    failures += report(all(np.allclose(ledger["household"][name], ledger["matrices"][name].sum(axis=1))
+                           for name in LEDGER_COLUMNS), "household rows are the sums of the item columns")
+
+    # Only the fees a projection takes out of its balance (income items) count towards the headline figure
+    deducted = sum(row["Fees"] for r in results if r["flows"]["subtract_fees"]
+                   for t, row in enumerate(r["chart_data"]["table_data"])
+                   if max(r["flows"]["offset"], 0) + t < FEE_SUMMARY_YEARS)
+    failures += check_close(f"fees deducted in the first {FEE_SUMMARY_YEARS} years", ledger["fees_10y"], deducted)
+
+    # Pooling a single item changes nothing, whether it is funded today or deferred
+    for r in results:
+        alone = build_ledger([r])
+        pooled = alone["pooled"]
+        failures += check_close(f"{r['title']} pooled alone vs separate", pooled["capital_required"],
+                                pooled["separate_capital"])
+        worst = float(np.max(np.abs(pooled["balance"] - alone["matrices"]["balance"][:, 0])))
+        failures += report(worst < 1e-6, f"{r['title']} pooled balances match its own column "
+                                         f"(largest difference {worst:.2e})")
+    return failures
+
+
+def verify_shock_grid():
+    """A zero-size market drop at any year must leave every row of the shock grid at the planned capital,
+    with no extra capital, no depletion and no shortfall."""
+    print("\n--- Verifying Shock Grid (zero shock) ---")
+    results, _ = process_scenario(sample_scenario(), totals_only=True, with_flows=True)
+    failures = 0
+    for r in results:
+        grid = shock_grid(r["flows"], ShockSpec(kind="drawdown", size=0.0))
+        worst = float(np.max(np.abs(grid["capital"] - r["capital_required"])))
+        ok = (close(grid["base_capital"], r["capital_required"]) and worst <= 1e-9 * r["capital_required"]
+              and (grid["depleted_at"] == -1).all() and (grid["shortfall"] < 0.01).all())
+        failures += report(ok, f"{r['title']}: {len(grid['capital'])} shock years, "
+                               f"largest difference from planned capital {worst:.2e}")
+    return failures
+
+
+def verify_mortality():
+    """With survival 1 in every year the expected capital is the planned capital: item by item through
+    weighted_capital, and through mortality_scenario with a no-death life table (items it runs past their fixed
+    horizon must match the engine run to the same horizon, on the same portfolio)."""
+    print("\n--- Verifying Mortality Weighting (certain survival) ---")
+    # A 10-year medical buffer is planned as balanced; run out to the table end it must stay balanced
+    data = sample_scenario().model_copy(update={"medical": {"cost": 5000, "start": 80, "end": 90}})
+    results, _ = process_scenario(data, totals_only=True, with_flows=True)
+    failures = 0
+    for r in results:
+        _, capital, alive_at_end = weighted_capital(r["flows"], np.ones(200))
+        failures += check_close(f"{r['title']} expected vs planned", capital, r["capital_required"])
+        failures += report(alive_at_end == 1.0, f"{r['title']} survives its horizon with probability 1")
+
+    table = {sex: np.concatenate([np.zeros(120), [1.0]]) for sex in ("male", "female")}
+    mortality = mortality_scenario(data, table)
+    end_age = mortality["longevity"]["table_end_age"]
+    planned, _ = process_scenario(data, with_flows=True)
+    extended, _ = process_scenario(data, with_flows=True, horizon_age=end_age)
+    for item, base, ext in zip(mortality["items"], planned, extended):
+        target = ext if item["horizon_extended"] else base
+        failures += check_close(f"{item['title']} weighted to {item['weighted_to_year']} vs engine",
+                                item["expected_capital"], target["capital_required"])
+        failures += report(ext["portfolio_used"] == base["portfolio_used"],
+                           f"{item['title']} keeps its {base['portfolio_used']} portfolio when extended")
+    return failures
+
+
+def constant_history(years, income_return, growth_return, cpi):
+    """Backtest history with the same returns / CPI (decimals) every year."""
+    return {"year": 2000 + np.arange(years), "income_return": np.full(years, income_return),
+            "growth_return": np.full(years, growth_return), "cpi": np.full(years, cpi)}
+
+
+def verify_backtest():
+    """A constant history has no sequence risk: anchored to the items' assumptions every window must need exactly
+    the planned capital, and a raw constant history at the items' own returns with a different CPI must need what
+    the engine needs at that inflation rate (asset purchases priced today, holding costs and stated trade-ins /
+    resale priced at the start). The shipped sample history must load and run."""
+    print("\n--- Verifying Historical Backtest ---")
+    data = sample_scenario()
+    failures = 0
+    backtest = backtest_scenario(data, constant_history(60, 0.02, 0.07, 0.04), anchor="item")
+    for item in backtest["items"] + [dict(backtest["total"], title="Household total")]:
+        failures += check_close(f"{item['title']} worst window vs planned", item["worst"], item["planned_capital"])
+        failures += check_close(f"{item['title']} best window vs planned", item["best"], item["planned_capital"])
+
+    # Every item on the global returns, with a stated trade-in, so one raw history fits them all
+    asm = data.assumptions
+    rates = {"income_return": asm.income_return, "growth_return": asm.growth_return}
+    pinned = data.model_copy(update={
+        category: [item.model_copy(update=rates) for item in getattr(data, category)]
+        for category in ("incomes", "cars", "assets", "travel")
+    })
+    pinned.medical = dict(pinned.medical, **rates)
+    pinned.cars[0].tradein = 12000
+    cpi = 5.0
+    backtest = backtest_scenario(pinned, constant_history(60, asm.income_return / 100, asm.growth_return / 100,
+                                                        cpi / 100), anchor="history")
+    engine_results, _ = process_scenario(pinned.model_copy(update={
+        "assumptions": asm.model_copy(update={"inflation": cpi})}), totals_only=True)
+    for item, r in zip(backtest["items"], engine_results):
+        failures += check_close(f"{item['title']} at {cpi}% CPI vs engine", item["worst"], r["capital_required"])
+
+    backtest = backtest_scenario(data, load_history(RETURNS_HISTORY_SAMPLE))
+    h = backtest["history"]
+    failures += report(np.isfinite(backtest["total"]["worst"]) and h["windows"] == (h["years"] if h["wrapped"] else
+                                                                                   h["years"] - h["horizon"] + 1),
+                       f"{RETURNS_HISTORY_SAMPLE}: {h['windows']} windows of {h['horizon']} years "
+                       f"(wrapped {h['wrapped']}), success rate {backtest['total']['success_rate']:.0%}")
+    return failures
+
+
+# Engine checks, run after the spreadsheet comparisons in verify(); each returns its number of failures
+CHECKS = (verify_closed_form, verify_optimizer, verify_spend_solver, verify_backtest, verify_ledger,
+          verify_shock_grid, verify_mortality)
+
+
 if __name__ == "__main__":
     verify()
+    failures = sum(check() for check in CHECKS)
+    raise SystemExit(1 if failures else 0)
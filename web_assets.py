@@ -0,0 +1,90 @@
+import hashlib
+import os
+
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+# Compiled template bytecode survives restarts / is shared by all workers
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", ".jinja_cache")
+
+# Fingerprinted assets never change under the same URL, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class StaticFingerprints:
+    """Content hashes for files under the static directory, recomputed only when a file changes."""
+    def __init__(self, directory: str, url_prefix: str = "/static"):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self._hashes = {}  # path -> (mtime_ns, size, digest)
+        # Prime every asset up front so current() is stable from the first request on
+        for root, _, files in os.walk(directory):
+            for name in files:
+                self.digest(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/"))
+
+    def digest(self, path: str) -> str:
+        st = os.stat(os.path.join(self.directory, path))
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        with open(os.path.join(self.directory, path), "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        self._hashes[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def current(self) -> tuple:
+        """Digests of every known asset (re-checked against the files on disk)."""
+        return tuple(self.digest(path) for path in sorted(self._hashes))
+
+    def url(self, path: str) -> str:
+        """e.g. static_url('styles.css') -> /static/styles.css?v=3f2a9c0d1e4b"""
+        return f"{self.url_prefix}/{path}?v={self.digest(path)}"
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with long-lived caching for fingerprinted (?v=...) URLs.
+    Un-fingerprinted requests still revalidate via the ETag/Last-Modified StaticFiles already sends."""
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            fingerprinted = b"v=" in scope.get("query_string", b"")
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL
+        return response
+
+
+def build_templates(directory: str, fingerprints: StaticFingerprints) -> Jinja2Templates:
+    """Jinja2Templates backed by a bytecode cache, with static_url() available in every template."""
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(directory),
+        autoescape=True,
+        bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+        auto_reload=os.getenv("TEMPLATE_AUTO_RELOAD", "1") == "1",
+    )
+    env.globals["static_url"] = fingerprints.url
+    return Jinja2Templates(env=env)
+
+
+class StaticPageCache:
+    """Pre-rendered shells for pages that do not depend on request data.
+    Re-rendered only when the template (or a fingerprinted asset it links) changes."""
+    def __init__(self, templates: Jinja2Templates, fingerprints: StaticFingerprints):
+        self.templates = templates
+        self.fingerprints = fingerprints
+        self._pages = {}  # name -> (version, html)
+
+    def _version(self, name: str):
+        template = self.templates.env.get_template(name)  # cheap: compiled template is cached
+        return (os.path.getmtime(template.filename), self.fingerprints.current())
+
+    def render(self, name: str) -> str:
+        version = self._version(name)
+        cached = self._pages.get(name)
+        if cached and cached[0] == version:
+            return cached[1]
+        html = self.templates.env.get_template(name).render()
+        # Rendering may have fingerprinted new assets — store under the post-render version
+        self._pages[name] = (self._version(name), html)
+        return html